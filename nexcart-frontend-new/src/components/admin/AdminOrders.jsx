@@ -49,7 +49,7 @@ const AdminOrders = () => {
 
         // First fetch orders
         const apiUrl = import.meta.env.VITE_API_URL || 'http://localhost:8000/api';
-        const response = await fetch(`${apiUrl}/admin/orders/`, {
+        const response = await fetch(`${apiUrl}/admin/orders/?expand=user,items,addresses`, {
           headers: {
             'Authorization': `Bearer ${token}`
           }
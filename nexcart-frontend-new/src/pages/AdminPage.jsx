@@ -134,7 +134,7 @@ const AdminPage = () => {
       const token = localStorage.getItem('access_token');
 
       const apiUrl = import.meta.env.VITE_API_URL || 'http://localhost:8000/api';
-      const response = await fetch(`${apiUrl}/admin/dashboard_stats/`, {
+      const response = await fetch(`${apiUrl}/admin/dashboard_stats/?expand=user`, {
         headers: {
           'Authorization': `Bearer ${token}`
         }
@@ -39,7 +39,7 @@ const OrdersPage = () => {
       }
 
       // Fetch orders from API
-      const response = await fetch(`${API_URL}/orders/`, {
+      const response = await fetch(`${API_URL}/orders/?expand=items,addresses`, {
         headers: {
           'Authorization': `Bearer ${token}`,
         },
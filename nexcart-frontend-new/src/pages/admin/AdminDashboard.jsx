@@ -57,7 +57,7 @@ const AdminDashboard = () => {
         });
 
         // Fetch orders
-        const ordersResponse = await fetch(`${apiUrl}/orders/`, {
+        const ordersResponse = await fetch(`${apiUrl}/orders/?expand=user`, {
           headers: {
             'Authorization': `Bearer ${token}`,
           },
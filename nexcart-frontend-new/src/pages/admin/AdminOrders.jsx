@@ -51,7 +51,7 @@ const AdminOrders = () => {
           throw new Error('No authentication token found');
         }
 
-        const response = await fetch(`${API_URL}/orders/`, {
+        const response = await fetch(`${API_URL}/orders/?expand=user,items,addresses`, {
           headers: {
             'Authorization': `Bearer ${token}`,
           },
@@ -1,3 +1,28 @@
 from django.contrib import admin
+from .models import DailyCatalogRollup, DailySalesRollup, DailySignupRollup, IdempotencyKey
 
-# Register your models here.
+@admin.register(IdempotencyKey)
+class IdempotencyKeyAdmin(admin.ModelAdmin):
+    list_display = ('key', 'scope', 'user', 'status', 'response_status', 'created_at')
+    list_filter = ('scope', 'status')
+    search_fields = ('key', 'user__username')
+    list_select_related = ('user',)
+
+
+@admin.register(DailySalesRollup)
+class DailySalesRollupAdmin(admin.ModelAdmin):
+    list_display = ('date', 'status', 'order_count', 'revenue', 'units_sold')
+    list_filter = ('status',)
+    date_hierarchy = 'date'
+
+
+@admin.register(DailySignupRollup)
+class DailySignupRollupAdmin(admin.ModelAdmin):
+    list_display = ('date', 'new_users')
+    date_hierarchy = 'date'
+
+
+@admin.register(DailyCatalogRollup)
+class DailyCatalogRollupAdmin(admin.ModelAdmin):
+    list_display = ('date', 'total_products', 'active_products', 'out_of_stock_products')
+    date_hierarchy = 'date'
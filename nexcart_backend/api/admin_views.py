@@ -2,15 +2,28 @@ from rest_framework import viewsets, status, permissions
 from rest_framework.decorators import api_view, permission_classes, action
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated, IsAdminUser
+from rest_framework.parsers import MultiPartParser, FormParser
+from django.http import StreamingHttpResponse
 from django.contrib.auth import get_user_model
-from django.db.models import Count, Sum, Q
+from django.db.models import Count, Q
 from django.utils import timezone
 from datetime import timedelta
 
 from products.models import Product, Category
+from products import bulk
 from orders.models import Order, OrderItem
-from products.serializers import ProductSerializer, CategorySerializer
-from orders.serializers import OrderSerializer, OrderItemSerializer
+from products.serializers import ProductSerializer, CategorySerializer, ProductStockUpdateSerializer
+from orders.serializers import (
+    OrderSerializer,
+    OrderItemSerializer,
+    OrderListSerializer,
+    ORDER_SELECT_RELATED,
+    ORDER_PREFETCH_RELATED,
+    order_list_queryset,
+)
+from orders.views import OrderListMixin
+from . import analytics, images, rollups
+from .querysets import EagerLoadingMixin
 from users.serializers import UserSerializer
 
 User = get_user_model()
@@ -27,40 +40,66 @@ def check_admin_status(request):
 @api_view(['GET'])
 @permission_classes([IsAdminUser])
 def dashboard_stats(request):
-    """Get dashboard statistics for admin"""
-    # Count total orders
-    total_orders = Order.objects.count()
+    """
+    Get dashboard statistics for admin. Totals come from the rollups kept
+    by the refresh_rollups command; 'asOf' says when they were refreshed.
+    """
+    as_of = rollups.rollup_watermark()
+    if as_of is None:
+        # Nothing built yet (fresh deploy): build once rather than show zeros
+        as_of = rollups.refresh_rollups()
+    totals = rollups.dashboard_totals()
 
-    # Count total users
-    total_users = User.objects.count()
-
-    # Count total products
-    total_products = Product.objects.count()
+    # Get recent orders
+    recent_orders = order_list_queryset(Order.objects.order_by('-created_at', '-id'), request)[:10]
+    recent_orders_data = OrderListSerializer(recent_orders, many=True, context={'request': request}).data
 
-    # Calculate total revenue
-    total_revenue = Order.objects.filter(status__in=['processing', 'shipped', 'delivered']).aggregate(
-        total=Sum('total_amount')
-    )['total'] or 0
+    return Response({
+        'totalOrders': totals['orders'],
+        'totalUsers': totals['users'],
+        'totalProducts': totals['products'],
+        'totalRevenue': totals['revenue'],
+        'recentOrders': recent_orders_data,
+        'asOf': as_of,
+    })
 
-    # Get recent orders
-    recent_orders = Order.objects.order_by('-created_at')[:10]
-    recent_orders_data = OrderSerializer(recent_orders, many=True, context={'request': request}).data
-    print("Recent orders data:", recent_orders_data)
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def sales_analytics(request):
+    """
+    Revenue, order count, average order value and units sold per bucket.
+    Query parameters: interval (hour, day, week or month; default day) and
+    start/end as ISO dates or datetimes (default: a recent window up to now).
+    """
+    interval = request.query_params.get('interval', 'day')
+    if interval not in analytics.INTERVALS:
+        return Response(
+            {'error': f"interval must be one of: {', '.join(analytics.INTERVALS)}"},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    now = timezone.now()
+    try:
+        end = analytics.parse_bound(request.query_params.get('end'), end=True) or now
+        start = analytics.parse_bound(request.query_params.get('start')) or min(end, now) - analytics.DEFAULT_SPANS[interval]
+        series = analytics.sales_series(interval, start, end, now)
+    except ValueError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
     return Response({
-        'totalOrders': total_orders,
-        'totalUsers': total_users,
-        'totalProducts': total_products,
-        'totalRevenue': total_revenue,
-        'recentOrders': recent_orders_data
+        'interval': interval,
+        'start': start,
+        'end': min(end, now),
+        'results': series,
     })
 
 # Admin Product ViewSet
-class AdminProductViewSet(viewsets.ModelViewSet):
+class AdminProductViewSet(EagerLoadingMixin, viewsets.ModelViewSet):
     """ViewSet for managing products (admin only)"""
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
     permission_classes = [IsAdminUser]
+    select_related_fields = ('category',)
 
     def get_serializer_context(self):
         context = super().get_serializer_context()
@@ -97,7 +136,7 @@ class AdminProductViewSet(viewsets.ModelViewSet):
             product_data = serializer.data
 
             # Add the image URL to the response
-            image_url = request.build_absolute_uri(product.image.url)
+            image_url = images.image_url(product, request)
             product_data['image_url'] = image_url
 
             return Response({
@@ -114,6 +153,68 @@ class AdminProductViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
+    @action(detail=False, methods=['post'], parser_classes=[MultiPartParser, FormParser])
+    def bulk_import(self, request):
+        """
+        Upsert products from an uploaded CSV or NDJSON file, keyed on slug.
+        Rows are validated and written in batches, each in its own transaction.
+        """
+        upload = request.FILES.get('file')
+        if not upload:
+            return Response({'error': 'No file provided'}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            file_format = bulk.detect_format(upload, request.data.get('import_format'))
+            batch_size = int(request.data.get('batch_size', 1000))
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        summary = bulk.import_products(upload, file_format, batch_size=max(1, min(batch_size, 5000)))
+        return Response(summary)
+
+    @action(detail=False, methods=['post'])
+    def bulk_update(self, request):
+        """
+        Apply many inventory/price changes at once. Accepts
+        {"updates": [{"id" or "slug", "inventory" or "inventory_delta",
+        "expected_inventory", "price", "discount_price"}, ...]} and returns
+        a compact status per row instead of full product payloads.
+        """
+        updates = request.data.get('updates')
+        if not isinstance(updates, list) or not updates:
+            return Response({'error': 'A non-empty updates list is required'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(updates) > 10000:
+            return Response({'error': 'At most 10000 updates per request'}, status=status.HTTP_400_BAD_REQUEST)
+
+        serializer = ProductStockUpdateSerializer(data=updates, many=True)
+        if not serializer.is_valid():
+            errors = [
+                {'index': index, 'errors': row_errors}
+                for index, row_errors in enumerate(serializer.errors) if row_errors
+            ]
+            return Response({'error': 'Validation failed', 'details': errors}, status=status.HTTP_400_BAD_REQUEST)
+
+        results = bulk.apply_stock_updates(serializer.validated_data)
+        return Response({
+            'updated': sum(1 for result in results if result['status'] == 'updated'),
+            'results': results,
+        })
+
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        """Stream every product as CSV (default) or NDJSON (?export_format=ndjson)"""
+        file_format = request.query_params.get('export_format', 'csv').lower()
+        if file_format not in bulk.IMPORT_FORMATS:
+            return Response({'error': 'Unsupported export format'}, status=status.HTTP_400_BAD_REQUEST)
+
+        content_type = 'text/csv' if file_format == 'csv' else 'application/x-ndjson'
+        response = StreamingHttpResponse(
+            bulk.export_products(Product.objects.all(), file_format),
+            content_type=content_type,
+        )
+        response['Content-Disposition'] = f'attachment; filename="products.{file_format}"'
+        return response
+
     def create(self, request, *args, **kwargs):
         """Custom create method to handle image upload"""
         # Log request data for debugging
@@ -205,6 +306,7 @@ class AdminCategoryViewSet(viewsets.ModelViewSet):
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
     permission_classes = [IsAdminUser]
+    cursor_ordering = ('name', 'id')
 
     def get_serializer_context(self):
         context = super().get_serializer_context()
@@ -339,11 +441,13 @@ class AdminCategoryViewSet(viewsets.ModelViewSet):
             )
 
 # Admin Order ViewSet
-class AdminOrderViewSet(viewsets.ModelViewSet):
+class AdminOrderViewSet(OrderListMixin, EagerLoadingMixin, viewsets.ModelViewSet):
     """ViewSet for managing orders (admin only)"""
     queryset = Order.objects.all().order_by('-created_at')
     serializer_class = OrderSerializer
     permission_classes = [IsAdminUser]
+    select_related_fields = ORDER_SELECT_RELATED
+    prefetch_related_fields = ORDER_PREFETCH_RELATED
 
     def get_serializer_context(self):
         context = super().get_serializer_context()
@@ -368,11 +472,13 @@ class AdminOrderViewSet(viewsets.ModelViewSet):
         return Response(OrderSerializer(order, context={'request': request}).data)
 
 # Admin User ViewSet
-class AdminUserViewSet(viewsets.ModelViewSet):
+class AdminUserViewSet(EagerLoadingMixin, viewsets.ModelViewSet):
     """ViewSet for managing users (admin only)"""
     queryset = User.objects.all().order_by('-date_joined')
     serializer_class = UserSerializer
     permission_classes = [IsAdminUser]
+    prefetch_related_fields = ('addresses',)
+    cursor_ordering = ('-date_joined',)
 
     @action(detail=True, methods=['post'])
     def change_password(self, request, pk=None):
@@ -392,6 +498,6 @@ class AdminUserViewSet(viewsets.ModelViewSet):
     def orders(self, request, pk=None):
         """Get orders for a specific user"""
         user = self.get_object()
-        orders = Order.objects.filter(user=user).order_by('-created_at')
-        serializer = OrderSerializer(orders, many=True, context={'request': request})
+        orders = order_list_queryset(Order.objects.filter(user=user).order_by('-created_at'), request)
+        serializer = OrderListSerializer(orders, many=True, context={'request': request})
         return Response({'results': serializer.data})
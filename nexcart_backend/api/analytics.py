@@ -0,0 +1,251 @@
+"""
+Time-series sales analytics for the admin API.
+
+Revenue, order count, average order value and units sold are bucketed by
+hour, day, week or month, counting orders in a revenue status by creation
+time. Closed buckets are cached with no expiry (see ANALYTICS_CACHE_TIMEOUT)
+and only the open bucket, the one containing now, is recomputed per
+request. Day, week and month buckets come from the daily sales rollups
+wherever those are complete; hour buckets and anything newer than the
+rollup watermark are grouped with date_trunc over Order/OrderItem.
+
+Cached buckets of a day are dropped when the rollup refresh recomputes that
+day, so late changes such as cancellations reach the cached series too.
+"""
+
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import Count, DateField, F, Sum
+from django.db.models.functions import Trunc
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from orders.models import Order, OrderItem
+from .models import DailySalesRollup
+from . import rollups
+
+INTERVALS = ('hour', 'day', 'week', 'month')
+MAX_BUCKETS = 1000
+
+# Range covered when no start is given
+DEFAULT_SPANS = {
+    'hour': timedelta(hours=24),
+    'day': timedelta(days=30),
+    'week': timedelta(weeks=12),
+    'month': timedelta(days=365),
+}
+
+ANALYTICS_VERSION_KEY = 'analytics:version'
+
+CENT = Decimal('0.01')
+
+
+def get_analytics_cache():
+    return caches[settings.ANALYTICS_CACHE_ALIAS]
+
+
+def get_analytics_version():
+    cache = get_analytics_cache()
+    version = cache.get(ANALYTICS_VERSION_KEY)
+    if version is None:
+        cache.add(ANALYTICS_VERSION_KEY, 1, timeout=None)
+        version = cache.get(ANALYTICS_VERSION_KEY, 1)
+    return version
+
+
+def bump_analytics_version():
+    """Invalidate every cached bucket, e.g. after the rollups were rebuilt from scratch"""
+    cache = get_analytics_cache()
+    try:
+        return cache.incr(ANALYTICS_VERSION_KEY)
+    except ValueError:
+        cache.add(ANALYTICS_VERSION_KEY, 1, timeout=None)
+        return cache.incr(ANALYTICS_VERSION_KEY)
+
+
+def parse_bound(value, end=False):
+    """
+    Parse a ``start``/``end`` query parameter: an ISO datetime, or a date
+    meaning the start of that day (the end of it for ``end``). None if empty.
+    """
+    if not value:
+        return None
+    moment = parse_datetime(value)
+    if moment is not None:
+        return moment if timezone.is_aware(moment) else timezone.make_aware(moment)
+    day = parse_date(value)
+    if day is None:
+        raise ValueError(f'Invalid date: {value}')
+    return rollups.day_start(day + timedelta(days=1) if end else day)
+
+
+def bucket_key(version, interval, bucket):
+    return f'analytics:v{version}:sales:{interval}:{bucket.isoformat()}'
+
+
+def bucket_of(moment, interval):
+    """The bucket containing an aware datetime: a local hour start, or a date for longer intervals"""
+    local = timezone.localtime(moment)
+    if interval == 'hour':
+        return local.replace(minute=0, second=0, microsecond=0)
+    day = local.date()
+    if interval == 'day':
+        return day
+    if interval == 'week':
+        return day - timedelta(days=day.weekday())
+    return day.replace(day=1)
+
+
+def next_bucket(bucket, interval):
+    if interval == 'hour':
+        return timezone.localtime(bucket + timedelta(hours=1))
+    if interval == 'day':
+        return bucket + timedelta(days=1)
+    if interval == 'week':
+        return bucket + timedelta(weeks=1)
+    return (bucket.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+def bucket_start(bucket):
+    """Aware datetime at which a bucket starts"""
+    return bucket if isinstance(bucket, datetime) else rollups.day_start(bucket)
+
+
+def bucket_range(interval, start, end):
+    """Buckets overlapping [start, end)"""
+    buckets = []
+    bucket = bucket_of(start, interval)
+    while bucket_start(bucket) < end:
+        buckets.append(bucket)
+        if len(buckets) > MAX_BUCKETS:
+            raise ValueError(f'At most {MAX_BUCKETS} buckets per request; narrow the range or use a longer interval')
+        bucket = next_bucket(bucket, interval)
+    return buckets
+
+
+def empty_bucket():
+    return {'orders': 0, 'revenue': Decimal('0'), 'units': 0}
+
+
+def source_buckets(interval, start, end):
+    """Group orders created in [start, end) with date_trunc"""
+    orders = Order.objects.filter(
+        created_at__gte=start, created_at__lt=end, status__in=rollups.REVENUE_STATUSES,
+    )
+    items = OrderItem.objects.filter(
+        order__created_at__gte=start, order__created_at__lt=end, order__status__in=rollups.REVENUE_STATUSES,
+    )
+    results = {}
+    for row in (orders.annotate(bucket=Trunc('created_at', interval)).values('bucket')
+                .annotate(orders=Count('id'), revenue=Sum('total_amount')).order_by()):
+        results[bucket_of(row['bucket'], interval)] = {
+            'orders': row['orders'], 'revenue': row['revenue'] or Decimal('0'), 'units': 0,
+        }
+    # Units separately, so the item join doesn't multiply order totals
+    for row in (items.annotate(bucket=Trunc('order__created_at', interval)).values('bucket')
+                .annotate(units=Sum('quantity')).order_by()):
+        results.setdefault(bucket_of(row['bucket'], interval), empty_bucket())['units'] = row['units'] or 0
+    return results
+
+
+def rollup_buckets(interval, first, end):
+    """Sum the daily rollups from date ``first`` up to (not including) date ``end``"""
+    bucket = F('date') if interval == 'day' else Trunc('date', interval, output_field=DateField())
+    rows = (
+        DailySalesRollup.objects
+        .filter(date__gte=first, date__lt=end, status__in=rollups.REVENUE_STATUSES)
+        .annotate(bucket=bucket).values('bucket')
+        .annotate(orders=Sum('order_count'), revenue=Sum('revenue'), units=Sum('units_sold'))
+        .order_by()
+    )
+    return {
+        row['bucket']: {'orders': row['orders'] or 0, 'revenue': row['revenue'] or Decimal('0'), 'units': row['units'] or 0}
+        for row in rows
+    }
+
+
+def compute_buckets(interval, buckets):
+    """
+    Metrics for consecutive closed ``buckets``: from the rollups for buckets
+    that ended before the last rollup refresh, from the orders for the rest.
+    """
+    watermark = rollups.rollup_watermark() if interval != 'hour' else None
+    from_rollups = [
+        bucket for bucket in buckets
+        if watermark is not None and bucket_start(next_bucket(bucket, interval)) <= watermark
+    ]
+    from_source = buckets[len(from_rollups):]
+
+    results = {}
+    if from_rollups:
+        results.update(rollup_buckets(interval, from_rollups[0], next_bucket(from_rollups[-1], interval)))
+    if from_source:
+        results.update(source_buckets(
+            interval, bucket_start(from_source[0]), bucket_start(next_bucket(from_source[-1], interval)),
+        ))
+    return {bucket: results.get(bucket, empty_bucket()) for bucket in buckets}
+
+
+def sales_series(interval, start, end, now):
+    """
+    Metrics for every ``interval`` bucket overlapping [start, end), oldest
+    first. Closed buckets are served from the cache when possible.
+    """
+    end = min(end, now)
+    buckets = bucket_range(interval, start, end) if start < end else []
+    open_bucket = bucket_of(now, interval)
+    closed = [bucket for bucket in buckets if bucket != open_bucket]
+
+    cache = get_analytics_cache()
+    version = get_analytics_version()
+    keys = {bucket: bucket_key(version, interval, bucket) for bucket in closed}
+    cached = cache.get_many(keys.values())
+    results = {bucket: cached[key] for bucket, key in keys.items() if key in cached}
+
+    missing = [bucket for bucket in closed if bucket not in results]
+    if missing:
+        # One grouped query over the missing span; cached neighbours are simply recomputed
+        span = bucket_range(interval, bucket_start(missing[0]), bucket_start(next_bucket(missing[-1], interval)))
+        computed = compute_buckets(interval, span)
+        for bucket in missing:
+            results[bucket] = computed[bucket]
+        cache.set_many({keys[bucket]: results[bucket] for bucket in missing}, settings.ANALYTICS_CACHE_TIMEOUT)
+
+    if open_bucket in buckets:
+        open_range = (bucket_start(open_bucket), bucket_start(next_bucket(open_bucket, interval)))
+        results[open_bucket] = source_buckets(interval, *open_range).get(open_bucket, empty_bucket())
+
+    return [series_row(bucket, results[bucket], bucket == open_bucket) for bucket in buckets]
+
+
+def series_row(bucket, metrics, is_open):
+    orders = metrics['orders']
+    revenue = Decimal(metrics['revenue']).quantize(CENT)
+    average = (revenue / orders).quantize(CENT) if orders else Decimal('0.00')
+    return {
+        'bucket': bucket.isoformat(),
+        'revenue': str(revenue),
+        'orders': orders,
+        'average_order_value': str(average),
+        'units_sold': metrics['units'],
+        'complete': not is_open,
+    }
+
+
+def invalidate_days(days):
+    """Drop cached buckets overlapping ``days`` (dates), after their rollups were recomputed"""
+    version = get_analytics_version()
+    keys = []
+    for day in days:
+        start = rollups.day_start(day)
+        for interval in ('day', 'week', 'month'):
+            keys.append(bucket_key(version, interval, bucket_of(start, interval)))
+        hour = bucket_of(start, 'hour')
+        while bucket_start(hour) < rollups.day_start(day + timedelta(days=1)):
+            keys.append(bucket_key(version, 'hour', hour))
+            hour = next_bucket(hour, 'hour')
+    get_analytics_cache().delete_many(keys)
+
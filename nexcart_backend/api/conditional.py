@@ -0,0 +1,50 @@
+import hashlib
+from functools import wraps
+
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+
+
+def make_etag(*parts):
+    """Build a weak ETag from the given validator parts"""
+    digest = hashlib.sha1('|'.join(str(part) for part in parts).encode('utf-8')).hexdigest()
+    return 'W/' + quote_etag(digest)
+
+
+def conditional_get(validator, private=False):
+    """
+    Decorator adding ETag / Last-Modified support to a viewset method.
+
+    ``validator(view, request, *args, **kwargs)`` must return an
+    ``(etag_parts, last_modified)`` pair computed without serializing the
+    response, e.g. from ``MAX(updated_at)``; either item may be None. When the
+    client's validators still match, a 304 is returned without running the view.
+    """
+    def decorator(view_method):
+        @wraps(view_method)
+        def wrapper(self, request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return view_method(self, request, *args, **kwargs)
+
+            etag_parts, last_modified = validator(self, request, *args, **kwargs)
+            etag = make_etag(*etag_parts) if etag_parts is not None else None
+            timestamp = int(last_modified.timestamp()) if last_modified else None
+
+            response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+            if response is None:
+                response = view_method(self, request, *args, **kwargs)
+                if response.status_code != 200:
+                    return response
+
+            if etag:
+                response['ETag'] = etag
+            if timestamp is not None:
+                response['Last-Modified'] = http_date(timestamp)
+            # Let clients keep the payload but always revalidate it
+            if private:
+                patch_cache_control(response, no_cache=True, private=True)
+            else:
+                patch_cache_control(response, no_cache=True)
+            return response
+        return wrapper
+    return decorator
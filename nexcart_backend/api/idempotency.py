@@ -0,0 +1,121 @@
+import hashlib
+import json
+from datetime import timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+
+from .models import IdempotencyKey
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+MAX_KEY_LENGTH = 255
+
+# A 'processing' record older than this belongs to a request that died
+PROCESSING_TIMEOUT = timedelta(seconds=60)
+
+
+def request_fingerprint(request):
+    """SHA-256 of the method, path and body, so a key can't be reused for a different request"""
+    data = request.data
+    if hasattr(data, 'lists'):
+        data = {key: values for key, values in data.lists()}
+    payload = json.dumps([request.method, request.path, data], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def replay(record):
+    response = Response(record.response_body, status=record.response_status)
+    response[REPLAYED_HEADER] = 'true'
+    return response
+
+
+def claim_key(user, scope, key, fingerprint):
+    """
+    Insert a 'processing' record for the key. Returns None when this request
+    now owns the key, otherwise the existing record.
+    """
+    try:
+        with transaction.atomic():
+            IdempotencyKey.objects.create(user=user, scope=scope, key=key, fingerprint=fingerprint)
+        return None
+    except IntegrityError:
+        pass
+
+    record = IdempotencyKey.objects.get(user=user, scope=scope, key=key)
+    now = timezone.now()
+    expired = record.created_at < now - timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL)
+    abandoned = record.status == 'processing' and record.updated_at < now - PROCESSING_TIMEOUT
+    if expired or abandoned:
+        # Take the key over; the conditional update keeps two retries from both winning
+        taken = IdempotencyKey.objects.filter(pk=record.pk, updated_at=record.updated_at).update(
+            fingerprint=fingerprint, status='processing', response_status=None,
+            response_body=None, created_at=now, updated_at=now,
+        )
+        if taken:
+            return None
+        record.refresh_from_db()
+    return record
+
+
+def idempotent(scope):
+    """
+    Decorator making a viewset action safe to retry with an ``Idempotency-Key``
+    header. The first request with a key runs the view and stores its
+    response; retries with the same key and body get that response back with
+    ``Idempotent-Replayed: true`` without running the view again. Server
+    errors are not stored, so they can be retried. Requests without the
+    header are unaffected.
+    """
+    def decorator(view_method):
+        @wraps(view_method)
+        def wrapper(self, request, *args, **kwargs):
+            key = request.headers.get(IDEMPOTENCY_HEADER)
+            if not key or not request.user.is_authenticated:
+                return view_method(self, request, *args, **kwargs)
+            if len(key) > MAX_KEY_LENGTH:
+                return Response(
+                    {"detail": f"{IDEMPOTENCY_HEADER} must be at most {MAX_KEY_LENGTH} characters."},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+
+            fingerprint = request_fingerprint(request)
+            record = claim_key(request.user, scope, key, fingerprint)
+            if record is not None:
+                if record.fingerprint != fingerprint:
+                    return Response(
+                        {"detail": f"{IDEMPOTENCY_HEADER} was already used for a different request."},
+                        status=status.HTTP_422_UNPROCESSABLE_ENTITY
+                    )
+                if record.status == 'completed':
+                    return replay(record)
+                response = Response(
+                    {"detail": "A request with this Idempotency-Key is still being processed."},
+                    status=status.HTTP_409_CONFLICT
+                )
+                response['Retry-After'] = '1'
+                return response
+
+            try:
+                response = view_method(self, request, *args, **kwargs)
+            except Exception:
+                IdempotencyKey.objects.filter(user=request.user, scope=scope, key=key).delete()
+                raise
+
+            records = IdempotencyKey.objects.filter(user=request.user, scope=scope, key=key)
+            if response.status_code >= 500:
+                records.delete()
+            else:
+                records.update(
+                    status='completed',
+                    response_status=response.status_code,
+                    response_body=response.data,
+                    updated_at=timezone.now(),
+                )
+            return response
+        return wrapper
+    return decorator
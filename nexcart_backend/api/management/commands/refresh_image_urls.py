@@ -0,0 +1,30 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+from api.images import stored_image_url
+from products.models import Category, Product
+
+
+class Command(BaseCommand):
+    help = 'Recompute the stored image URLs of categories, products and user avatars'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        targets = [
+            (Category, 'image', 'cached_image_url'),
+            (Product, 'image', 'cached_image_url'),
+            (get_user_model(), 'avatar', 'cached_avatar_url'),
+        ]
+        for model, image_field, url_field in targets:
+            changed = []
+            queryset = model.objects.exclude(**{f'{image_field}__isnull': True}).exclude(**{image_field: ''})
+            for instance in queryset.only('pk', image_field, url_field).iterator(chunk_size=batch_size):
+                url = stored_image_url(getattr(instance, image_field))
+                if url != getattr(instance, url_field):
+                    setattr(instance, url_field, url)
+                    changed.append(instance)
+            model.objects.bulk_update(changed, [url_field], batch_size=batch_size)
+            self.stdout.write(f'{model.__name__}: {len(changed)} image URLs updated')
@@ -0,0 +1,31 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from api.rollups import refresh_rollups
+
+
+class Command(BaseCommand):
+    help = 'Refresh the sales, signup and catalog rollups behind the admin dashboard'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true',
+                            help='Recompute every day instead of only the days changed since the last run')
+        parser.add_argument('--loop', action='store_true',
+                            help='Keep running, refreshing every --interval seconds')
+        parser.add_argument('--interval', type=float, default=300,
+                            help='Seconds between refreshes (with --loop)')
+
+    def handle(self, *args, **options):
+        rebuild = options['rebuild']
+        while True:
+            started = time.monotonic()
+            watermark = refresh_rollups(rebuild=rebuild)
+            self.stdout.write(f'Rollups refreshed up to {watermark:%Y-%m-%d %H:%M:%S} '
+                              f'in {time.monotonic() - started:.2f}s')
+            if not options['loop']:
+                break
+            rebuild = False
+            close_old_connections()
+            time.sleep(options['interval'])
@@ -1,3 +1,84 @@
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
 
-# Create your models here.
+
+class IdempotencyKey(models.Model):
+    """
+    A client-supplied Idempotency-Key with the fingerprint of the request it
+    was first used for and, once that request finished, its response
+    """
+    STATUS_CHOICES = (
+        ('processing', 'Processing'),
+        ('completed', 'Completed'),
+    )
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='idempotency_keys')
+    scope = models.CharField(max_length=100)
+    key = models.CharField(max_length=255)
+    fingerprint = models.CharField(max_length=64)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='processing')
+    response_status = models.PositiveSmallIntegerField(null=True, blank=True)
+    response_body = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'scope', 'key'], name='idempotency_key_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['created_at'], name='idempotency_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.scope} {self.key} ({self.status})"
+
+
+class DailySalesRollup(models.Model):
+    """Orders, revenue and units sold per day (by order creation date) and order status"""
+    date = models.DateField()
+    status = models.CharField(max_length=20)
+    order_count = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    units_sold = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'status'], name='daily_sales_rollup_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.date} {self.status}: {self.order_count} orders"
+
+
+class DailySignupRollup(models.Model):
+    """Users who joined on each day"""
+    date = models.DateField(unique=True)
+    new_users = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.date}: {self.new_users} new users"
+
+
+class DailyCatalogRollup(models.Model):
+    """Product counts as of the last refresh on each day"""
+    date = models.DateField(unique=True)
+    total_products = models.PositiveIntegerField(default=0)
+    active_products = models.PositiveIntegerField(default=0)
+    out_of_stock_products = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.date}: {self.total_products} products"
+
+
+class RollupWatermark(models.Model):
+    """
+    How far the rollups have been refreshed: source rows changed before
+    ``value`` are included. Null until the first full build.
+    """
+    name = models.CharField(max_length=50, unique=True)
+    value = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.name} @ {self.value}"
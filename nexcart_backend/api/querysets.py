@@ -0,0 +1,45 @@
+import copy
+
+from django.db.models import Prefetch
+
+
+def eager_load(queryset, select_related=(), prefetch_related=()):
+    """
+    Apply select_related / prefetch_related lookups to a queryset.
+    Prefetch objects are copied so shared declarations are never mutated.
+    """
+    if select_related:
+        queryset = queryset.select_related(*select_related)
+    if prefetch_related:
+        queryset = queryset.prefetch_related(*[
+            copy.copy(lookup) if isinstance(lookup, Prefetch) else lookup
+            for lookup in prefetch_related
+        ])
+    return queryset
+
+
+class EagerLoadingMixin:
+    """
+    Viewset mixin that applies the declared ``select_related_fields`` and
+    ``prefetch_related_fields`` to every queryset that goes through
+    ``filter_queryset`` (list, retrieve, update and destroy), so the serializer
+    never has to hit the database per row.
+    """
+    select_related_fields = ()
+    prefetch_related_fields = ()
+
+    def get_select_related_fields(self):
+        return self.select_related_fields
+
+    def get_prefetch_related_fields(self):
+        return self.prefetch_related_fields
+
+    def eager_load(self, queryset):
+        return eager_load(
+            queryset,
+            self.get_select_related_fields(),
+            self.get_prefetch_related_fields(),
+        )
+
+    def filter_queryset(self, queryset):
+        return self.eager_load(super().filter_queryset(queryset))
@@ -0,0 +1,190 @@
+"""
+Sales, signup and catalog rollups behind the admin dashboard.
+
+``refresh_rollups`` is run periodically by the refresh_rollups command. Each
+run finds the days touched since the last run (orders by ``updated_at``,
+users by ``date_joined``) and recomputes just those days from the source
+tables, so it also picks up rows changed by bulk updates that skip signals.
+Deleted orders and users are handled by signals (see api/signals.py).
+"""
+
+from contextlib import contextmanager
+from datetime import datetime, time, timedelta
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from orders.models import Order, OrderItem
+from products.models import Product
+from .models import DailyCatalogRollup, DailySalesRollup, DailySignupRollup, RollupWatermark
+
+User = get_user_model()
+
+# Order statuses that count towards revenue
+REVENUE_STATUSES = ('processing', 'shipped', 'delivered')
+
+WATERMARK = 'rollups'
+
+# Rows committed up to this long after their timestamp are still picked up
+REFRESH_OVERLAP = timedelta(minutes=5)
+
+
+def day_start(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def days_filter(field, days):
+    """Q matching ``field`` within any of ``days``, with consecutive days merged into one range"""
+    ranges = []
+    for day in sorted(days):
+        if ranges and ranges[-1][1] == day:
+            ranges[-1][1] = day + timedelta(days=1)
+        else:
+            ranges.append([day, day + timedelta(days=1)])
+    condition = Q()
+    for start, end in ranges:
+        condition |= Q(**{f'{field}__gte': day_start(start), f'{field}__lt': day_start(end)})
+    return condition
+
+
+def rebuild_sales_days(days=None):
+    """Recompute the sales rollup for ``days``, or for all time when None"""
+    orders = Order.objects.all()
+    items = OrderItem.objects.all()
+    rollups = DailySalesRollup.objects.all()
+    if days is not None:
+        days = set(days)
+        if not days:
+            return
+        orders = orders.filter(days_filter('created_at', days))
+        items = items.filter(days_filter('order__created_at', days))
+        rollups = rollups.filter(date__in=days)
+
+    rows = {}
+    for row in (orders.annotate(day=TruncDate('created_at')).values('day', 'status')
+                .annotate(order_count=Count('id'), revenue=Sum('total_amount')).order_by()):
+        rows[row['day'], row['status']] = DailySalesRollup(
+            date=row['day'], status=row['status'],
+            order_count=row['order_count'], revenue=row['revenue'] or 0,
+        )
+    # Units come from a separate query so the item join doesn't multiply order totals
+    for row in (items.annotate(day=TruncDate('order__created_at')).values('day', 'order__status')
+                .annotate(units=Sum('quantity')).order_by()):
+        rollup = rows.get((row['day'], row['order__status']))
+        if rollup is not None:
+            rollup.units_sold = row['units'] or 0
+
+    with transaction.atomic():
+        rollups.delete()
+        DailySalesRollup.objects.bulk_create(rows.values())
+
+    # Imported here: the analytics module builds on this one
+    from . import analytics
+    if days is None:
+        transaction.on_commit(analytics.bump_analytics_version)
+    else:
+        transaction.on_commit(lambda: analytics.invalidate_days(days))
+
+
+def rebuild_signup_days(days=None):
+    """Recompute the signup rollup for ``days``, or for all time when None"""
+    users = User.objects.all()
+    rollups = DailySignupRollup.objects.all()
+    if days is not None:
+        days = set(days)
+        if not days:
+            return
+        users = users.filter(days_filter('date_joined', days))
+        rollups = rollups.filter(date__in=days)
+
+    rows = [
+        DailySignupRollup(date=row['day'], new_users=row['new_users'])
+        for row in users.annotate(day=TruncDate('date_joined')).values('day')
+        .annotate(new_users=Count('id')).order_by()
+    ]
+    with transaction.atomic():
+        rollups.delete()
+        DailySignupRollup.objects.bulk_create(rows)
+
+
+def refresh_catalog():
+    """Record today's product counts (one aggregate over the product table)"""
+    counts = Product.objects.aggregate(
+        total_products=Count('id'),
+        active_products=Count('id', filter=Q(is_active=True)),
+        out_of_stock_products=Count('id', filter=Q(inventory=0)),
+    )
+    DailyCatalogRollup.objects.update_or_create(date=timezone.localdate(), defaults=counts)
+
+
+@contextmanager
+def locked_watermark():
+    """
+    Yield the watermark row locked for the rest of the transaction, so
+    rollup writers run one at a time and never interleave delete/insert
+    cycles on the same days.
+    """
+    with transaction.atomic():
+        RollupWatermark.objects.get_or_create(name=WATERMARK)
+        yield RollupWatermark.objects.select_for_update().get(name=WATERMARK)
+
+
+def refresh_rollups(rebuild=False):
+    """
+    Bring every rollup up to date and return the new watermark. The first
+    run, or one with ``rebuild``, recomputes everything.
+    """
+    now = timezone.now()
+    with locked_watermark() as watermark:
+        if rebuild or watermark.value is None:
+            rebuild_sales_days()
+            rebuild_signup_days()
+        else:
+            since = watermark.value - REFRESH_OVERLAP
+            rebuild_sales_days(
+                Order.objects.filter(updated_at__gte=since)
+                .annotate(day=TruncDate('created_at')).values_list('day', flat=True).distinct().order_by()
+            )
+            rebuild_signup_days(
+                User.objects.filter(date_joined__gte=since)
+                .annotate(day=TruncDate('date_joined')).values_list('day', flat=True).distinct().order_by()
+            )
+        refresh_catalog()
+        watermark.value = now
+        watermark.save(update_fields=['value'])
+    return now
+
+
+def rebuild_deleted(sales_days=(), signup_days=()):
+    """Recompute the days of deleted orders and users, unless nothing was built yet"""
+    if not sales_days and not signup_days:
+        return
+    with locked_watermark() as watermark:
+        if watermark.value is None:
+            return
+        rebuild_sales_days(sales_days)
+        rebuild_signup_days(signup_days)
+
+
+def rollup_watermark():
+    """When the rollups were last refreshed, or None if they never were"""
+    return RollupWatermark.objects.filter(name=WATERMARK).values_list('value', flat=True).first()
+
+
+def dashboard_totals():
+    """All-time totals for the admin dashboard, read from the rollups only"""
+    sales = DailySalesRollup.objects.aggregate(
+        orders=Sum('order_count'),
+        revenue=Sum('revenue', filter=Q(status__in=REVENUE_STATUSES)),
+    )
+    users = DailySignupRollup.objects.aggregate(total=Sum('new_users'))['total']
+    catalog = DailyCatalogRollup.objects.order_by('-date').first()
+    return {
+        'orders': sales['orders'] or 0,
+        'revenue': sales['revenue'] or 0,
+        'users': users or 0,
+        'products': catalog.total_products if catalog else 0,
+    }
@@ -0,0 +1,58 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from orders.models import Order
+from . import rollups
+
+
+class DeletedDays:
+    """
+    Days of rows deleted in one transaction, rebuilt together by a single
+    on_commit callback however many rows a cascade removes.
+    """
+    def __init__(self, connection):
+        self.connection = connection
+        self.sales = set()
+        self.signup = set()
+
+    def __call__(self):
+        if self.connection.deleted_rollup_days is self:
+            self.connection.deleted_rollup_days = None
+        rollups.rebuild_deleted(sales_days=self.sales, signup_days=self.signup)
+
+
+def schedule_rebuild(sales_day=None, signup_day=None):
+    """
+    Add a day to the current transaction's DeletedDays, registering its
+    callback on first use. A rolled back transaction or savepoint drops the
+    callback, and then a fresh DeletedDays is started.
+    """
+    connection = transaction.get_connection()
+    days = getattr(connection, 'deleted_rollup_days', None)
+    registered = days is not None and any(hook[1] is days for hook in connection.run_on_commit)
+    if not registered:
+        days = connection.deleted_rollup_days = DeletedDays(connection)
+    if sales_day is not None:
+        days.sales.add(sales_day)
+    if signup_day is not None:
+        days.signup.add(signup_day)
+    if not registered:
+        # Outside a transaction this runs at once
+        transaction.on_commit(days)
+
+
+@receiver(post_delete, sender=Order)
+def rebuild_sales_day(sender, instance, **kwargs):
+    """
+    Deleted rows leave no timestamp behind for the periodic refresh, so
+    recompute their day once the delete commits.
+    """
+    schedule_rebuild(sales_day=timezone.localdate(instance.created_at))
+
+
+@receiver(post_delete, sender=get_user_model())
+def rebuild_signup_day(sender, instance, **kwargs):
+    schedule_rebuild(signup_day=timezone.localdate(instance.date_joined))
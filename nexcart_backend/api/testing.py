@@ -0,0 +1,42 @@
+from django.core.cache import caches
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+
+class QueryBudgetMixin:
+    """
+    TestCase mixin asserting that an endpoint stays within a fixed number of
+    queries, and that the number does not grow with the amount of data listed.
+    """
+
+    def count_queries(self, url, method='get', **kwargs):
+        # Response caches would hide the queries we want to measure
+        for cache in caches.all():
+            cache.clear()
+        with CaptureQueriesContext(connection) as context:
+            response = getattr(self.client, method)(url, **kwargs)
+        self.assertLess(response.status_code, 400, getattr(response, 'data', response.content))
+        return len(context.captured_queries), context
+
+    def assertQueryBudget(self, url, budget, grow=None, method='get', **kwargs):
+        """
+        Request ``url`` and fail if it issues more than ``budget`` queries.
+        If ``grow`` is given it is called to add more rows, and the endpoint
+        must then issue exactly the same number of queries again.
+        """
+        count, context = self.count_queries(url, method, **kwargs)
+        self.assertLessEqual(
+            count, budget,
+            f'{url} issued {count} queries (budget {budget}):\n' + self._format_queries(context)
+        )
+        if grow is not None:
+            grow()
+            grown, context = self.count_queries(url, method, **kwargs)
+            self.assertEqual(
+                grown, count,
+                f'{url} went from {count} to {grown} queries as rows were added:\n' + self._format_queries(context)
+            )
+
+    @staticmethod
+    def _format_queries(context):
+        return '\n'.join(query['sql'] for query in context.captured_queries)
@@ -1,3 +1,468 @@
-from django.test import TestCase
+import base64
+import json
+from datetime import timedelta
+from decimal import Decimal
+from itertools import count
+from unittest import mock
+from urllib.parse import parse_qs, urlparse
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.test import override_settings
+from django.utils import timezone
+from rest_framework.test import APITestCase
+
+from orders.models import Cart, CartItem, Order, OrderItem
+from payments.models import Payment, StripePayment
+from products.models import Category, Product
+from users.models import Address
+from . import rollups
+from .pagination import KeysetPagination
+from .models import DailySalesRollup
+from .rollups import refresh_rollups
+from .testing import QueryBudgetMixin
+
+User = get_user_model()
+
+LOCAL_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'test-analytics'},
+    'carts': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'},
+}
+
+sequence = count(1)
+
+
+class QueryBudgetTests(QueryBudgetMixin, APITestCase):
+    """
+    Every list endpoint must issue a fixed number of queries per page,
+    however many rows (and nested rows) the page contains.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        cls.customer = User.objects.create_user('customer', 'customer@example.com', 'password')
+        cls.address = Address.objects.create(
+            user=cls.customer, address_type='shipping', street_address='1 Main St',
+            city='Springfield', state='IL', country='US', zip_code='62701', default=True,
+        )
+        cls.category = Category.objects.create(name='Electronics')
+        cls.cart = Cart.objects.create(user=cls.customer)
+        cls.add_orders(1)
+
+    @classmethod
+    def add_products(cls, number):
+        products = []
+        for _ in range(number):
+            n = next(sequence)
+            category = Category.objects.create(name=f'Category {n}')
+            products.append(Product.objects.create(
+                name=f'Product {n}', slug=f'product-{n}', description='A product',
+                price=Decimal('10.00'), category=category, inventory=10,
+            ))
+        return products
+
+    @classmethod
+    def add_orders(cls, number):
+        for _ in range(number):
+            products = cls.add_products(2)
+            Address.objects.create(
+                user=cls.customer, address_type='billing', street_address='2 Side St',
+                city='Springfield', state='IL', country='US', zip_code='62701',
+            )
+            order = Order.objects.create(
+                user=cls.customer, shipping_address=cls.address,
+                billing_address=cls.address, total_amount=Decimal('20.00'),
+            )
+            for product in products:
+                OrderItem.objects.create(order=order, product=product, quantity=1, price=product.price)
+                CartItem.objects.create(cart=cls.cart, product=product, quantity=1)
+            payment = Payment.objects.create(
+                user=cls.customer, order=order, payment_method='stripe',
+                amount=order.total_amount, transaction_id=f'pi_{order.id}',
+            )
+            StripePayment.objects.create(payment=payment, stripe_charge_id='', stripe_payment_intent_id=f'pi_{order.id}')
+            n = next(sequence)
+            User.objects.create_user(f'user{n}', f'user{n}@example.com', 'password')
+
+    def grow(self):
+        self.add_orders(3)
+
+    def test_product_list(self):
+        self.assertQueryBudget('/api/products/', 3, grow=self.grow)
+
+    def test_category_list(self):
+        self.assertQueryBudget('/api/categories/', 3, grow=self.grow)
+
+    def test_category_products(self):
+        def grow():
+            for product in self.add_products(3):
+                product.category = self.category
+                product.save()
+        self.assertQueryBudget(f'/api/categories/{self.category.id}/products/', 3, grow=grow)
+
+    def test_order_list(self):
+        self.client.force_authenticate(self.customer)
+        self.assertQueryBudget('/api/orders/', 5, grow=self.grow)
+
+    def test_expanded_order_list(self):
+        self.client.force_authenticate(self.customer)
+        self.assertQueryBudget('/api/orders/?expand=items,user,addresses', 6, grow=self.grow)
+
+    def test_order_list_is_compact_unless_expanded(self):
+        self.client.force_authenticate(self.customer)
+        order = self.client.get('/api/orders/').json()['results'][0]
+        self.assertEqual(order['item_count'], 2)
+        self.assertEqual(order['items_total'], '20.00')
+        self.assertNotIn('items', order)
+        self.assertNotIn('user', order)
+
+        order = self.client.get('/api/orders/?expand=items,addresses').json()['results'][0]
+        self.assertEqual(len(order['items']), 2)
+        self.assertIn('shipping_address', order)
+        self.assertNotIn('user', order)
+
+    def test_admin_order_list(self):
+        self.client.force_authenticate(self.admin)
+        self.assertQueryBudget('/api/admin/orders/', 4, grow=self.grow)
+
+    def test_payment_list(self):
+        self.client.force_authenticate(self.customer)
+        self.assertQueryBudget('/api/payments/', 4, grow=self.grow)
+
+    def test_admin_user_list(self):
+        self.client.force_authenticate(self.admin)
+        self.assertQueryBudget('/api/admin/users/', 3, grow=self.grow)
+
+    def test_my_cart(self):
+        self.client.force_authenticate(self.customer)
+        self.assertQueryBudget('/api/cart/my_cart/', 3, grow=self.grow)
+
+    def test_dashboard_stats(self):
+        refresh_rollups()
+        self.client.force_authenticate(self.admin)
+        self.assertQueryBudget('/api/admin/dashboard_stats/?expand=user', 6, grow=self.grow)
+
+
+class RollupTests(APITestCase):
+    """
+    The dashboard reads totals from rollups; refreshes recompute only the
+    days that changed and must agree with the source tables.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        category = Category.objects.create(name='Rollups')
+        cls.product = Product.objects.create(
+            name='Lamp', slug='lamp', description='A lamp', price=Decimal('30.00'),
+            category=category, inventory=5,
+        )
+        Product.objects.create(
+            name='Shade', slug='shade', description='A shade', price=Decimal('10.00'),
+            category=category, inventory=0,
+        )
+        cls.delivered = cls.add_order('delivered', Decimal('60.00'), 2)
+        cls.pending = cls.add_order('pending', Decimal('30.00'), 1)
+
+    @classmethod
+    def add_order(cls, status, total, quantity):
+        order = Order.objects.create(user=cls.admin, status=status, total_amount=total)
+        OrderItem.objects.create(order=order, product=cls.product, quantity=quantity, price=cls.product.price)
+        return order
+
+    def dashboard(self):
+        self.client.force_authenticate(self.admin)
+        response = self.client.get('/api/admin/dashboard_stats/')
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_first_load_builds_the_rollups(self):
+        data = self.dashboard()
+        self.assertEqual(
+            (data['totalOrders'], data['totalUsers'], data['totalProducts'], data['totalRevenue']),
+            (2, 1, 2, Decimal('60.00')),
+        )
+        today = DailySalesRollup.objects.get(date=timezone.localdate(self.delivered.created_at), status='delivered')
+        self.assertEqual((today.order_count, today.units_sold), (1, 2))
+
+    def test_refresh_picks_up_changes(self):
+        refresh_rollups()
+        # Bulk updates skip signals; the refresh finds them through updated_at
+        Order.objects.filter(pk=self.pending.pk).update(status='processing', updated_at=timezone.now())
+        self.add_order('shipped', Decimal('15.00'), 1)
+        User.objects.create_user('newcomer', 'newcomer@example.com', 'password')
+        self.assertEqual(self.dashboard()['totalOrders'], 2)
+
+        refresh_rollups()
+        data = self.dashboard()
+        self.assertEqual((data['totalOrders'], data['totalUsers']), (3, 2))
+        self.assertEqual(data['totalRevenue'], Decimal('105.00'))
+
+    def test_deleted_orders_leave_the_rollups(self):
+        refresh_rollups()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.delivered.delete()
+        data = self.dashboard()
+        self.assertEqual((data['totalOrders'], data['totalRevenue']), (1, 0))
+
+    def test_cascading_delete_rebuilds_once(self):
+        refresh_rollups()
+        customer = User.objects.create_user('leaving', 'leaving@example.com', 'password')
+        for _ in range(3):
+            Order.objects.create(user=customer, status='delivered', total_amount=Decimal('5.00'))
+        with mock.patch.object(rollups, 'rebuild_deleted', wraps=rollups.rebuild_deleted) as rebuild:
+            with self.captureOnCommitCallbacks(execute=True):
+                customer.delete()
+        rebuild.assert_called_once()
+        self.assertEqual(rebuild.call_args.kwargs['sales_days'], {timezone.localdate()})
+        self.assertEqual(self.dashboard()['totalOrders'], 2)
+
+
+@override_settings(CACHES=LOCAL_CACHES, ANALYTICS_CACHE_TIMEOUT=None)
+class SalesAnalyticsTests(APITestCase):
+    """
+    Sales series bucket revenue-status orders by creation time; closed
+    buckets are cached until the rollup refresh recomputes their day.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('analyst', 'analyst@example.com', 'password')
+        category = Category.objects.create(name='Analytics')
+        cls.product = Product.objects.create(
+            name='Kettle', slug='kettle', description='A kettle', price=Decimal('25.00'),
+            category=category, inventory=50,
+        )
+        cls.today = timezone.localdate()
+        cls.add_order(2, 'delivered', Decimal('50.00'), 2)
+        cls.add_order(2, 'shipped', Decimal('25.00'), 1)
+        cls.add_order(2, 'pending', Decimal('99.00'), 3)
+        cls.cancelled_later = cls.add_order(1, 'processing', Decimal('40.00'), 4)
+        cls.add_order(0, 'processing', Decimal('10.00'), 1)
+
+    @classmethod
+    def add_order(cls, days_ago, status, total, quantity):
+        order = Order.objects.create(user=cls.admin, status=status, total_amount=total)
+        OrderItem.objects.create(order=order, product=cls.product, quantity=quantity, price=cls.product.price)
+        created = timezone.now() - timedelta(days=days_ago)
+        Order.objects.filter(pk=order.pk).update(created_at=created)
+        return order
+
+    def setUp(self):
+        for cache in caches.all():
+            cache.clear()
+        self.client.force_authenticate(self.admin)
+
+    def series(self, **params):
+        params.setdefault('start', (self.today - timedelta(days=2)).isoformat())
+        params.setdefault('end', self.today.isoformat())
+        response = self.client.get('/api/admin/analytics/sales/', params)
+        self.assertEqual(response.status_code, 200, response.data)
+        return {row['bucket']: row for row in response.data['results']}
+
+    def test_daily_series(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            refresh_rollups()
+        series = self.series()
+        self.assertEqual(len(series), 3)
+        two_days_ago = series[(self.today - timedelta(days=2)).isoformat()]
+        self.assertEqual(
+            (two_days_ago['revenue'], two_days_ago['orders'], two_days_ago['average_order_value'],
+             two_days_ago['units_sold'], two_days_ago['complete']),
+            ('75.00', 2, '37.50', 3, True),
+        )
+        today = series[self.today.isoformat()]
+        self.assertEqual((today['revenue'], today['complete']), ('10.00', False))
+
+    def test_closed_buckets_are_cached_until_their_day_is_refreshed(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            refresh_rollups()
+        yesterday = (self.today - timedelta(days=1)).isoformat()
+        self.assertEqual(self.series()[yesterday]['revenue'], '40.00')
+
+        Order.objects.filter(pk=self.cancelled_later.pk).update(status='cancelled', updated_at=timezone.now())
+        self.assertEqual(self.series()[yesterday]['revenue'], '40.00')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            refresh_rollups()
+        self.assertEqual(self.series()[yesterday]['orders'], 0)
+
+    def test_hourly_series_comes_from_orders(self):
+        series = self.series(interval='hour', start=(timezone.now() - timedelta(hours=3)).isoformat(), end='')
+        self.assertEqual(sum(row['orders'] for row in series.values()), 1)
+        self.assertEqual(sum(row['units_sold'] for row in series.values()), 1)
+
+    def test_rejects_bad_parameters(self):
+        response = self.client.get('/api/admin/analytics/sales/', {'interval': 'minute'})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get('/api/admin/analytics/sales/', {'interval': 'hour', 'start': '2000-01-01'})
+        self.assertEqual(response.status_code, 400)
+
+
+class CartTotalsTests(APITestCase):
+    """
+    Cart and order totals agree whether they come from with_totals(),
+    prefetched items or the fallback aggregate, which costs one query.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('shopper', 'shopper@example.com', 'password')
+        category = Category.objects.create(name='Totals')
+        cheap = Product.objects.create(
+            name='Cheap', slug='cheap', description='A product', price=Decimal('4.50'),
+            category=category, inventory=10,
+        )
+        discounted = Product.objects.create(
+            name='Discounted', slug='discounted', description='A product', price=Decimal('20.00'),
+            discount_price=Decimal('15.25'), category=category, inventory=10,
+        )
+        cls.cart = Cart.objects.create(user=cls.user)
+        CartItem.objects.create(cart=cls.cart, product=cheap, quantity=2)
+        CartItem.objects.create(cart=cls.cart, product=discounted, quantity=3)
+        cls.order = Order.objects.create(user=cls.user, total_amount=Decimal('54.75'), shipping_cost=Decimal('5.00'))
+        OrderItem.objects.create(order=cls.order, product=cheap, quantity=2, price=Decimal('4.50'))
+        OrderItem.objects.create(order=cls.order, product=discounted, quantity=3, price=Decimal('15.25'))
+
+    def test_cart_totals(self):
+        carts = [
+            Cart.objects.get(pk=self.cart.pk),
+            Cart.objects.with_totals().get(pk=self.cart.pk),
+            Cart.objects.prefetch_related('items__product').get(pk=self.cart.pk),
+        ]
+        for cart in carts:
+            with self.assertNumQueries(1 if cart is carts[0] else 0):
+                self.assertEqual(cart.total_price, Decimal('54.75'))
+                self.assertEqual(cart.total_items, 5)
+
+    def test_empty_cart_totals(self):
+        cart = Cart.objects.with_totals().get(pk=Cart.objects.create(user=User.objects.create_user('empty')).pk)
+        self.assertEqual(cart.total_price, Decimal('0'))
+        self.assertEqual(cart.total_items, 0)
+
+    def test_order_totals(self):
+        orders = [
+            Order.objects.get(pk=self.order.pk),
+            Order.objects.with_totals().get(pk=self.order.pk),
+            Order.objects.prefetch_related('items').get(pk=self.order.pk),
+        ]
+        for order in orders:
+            with self.assertNumQueries(1 if order is orders[0] else 0):
+                self.assertEqual(order.items_total, Decimal('54.75'))
+                self.assertEqual(order.final_total, Decimal('59.75'))
+
+
+class IdempotencyTests(APITestCase):
+    """
+    Retrying checkout with the same Idempotency-Key returns the first
+    response instead of creating another order.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('buyer', 'buyer@example.com', 'password')
+        cls.address = Address.objects.create(
+            user=cls.user, address_type='shipping', street_address='1 Main St',
+            city='Springfield', state='IL', country='US', zip_code='62701', default=True,
+        )
+        product = Product.objects.create(
+            name='Lamp', slug='lamp', description='A lamp', price=Decimal('30.00'),
+            category=Category.objects.create(name='Lighting'), inventory=5,
+        )
+        CartItem.objects.create(cart=Cart.objects.create(user=cls.user), product=product, quantity=1)
+
+    def checkout(self, key, address=None):
+        address = address or self.address.id
+        return self.client.post(
+            '/api/orders/create_from_cart/',
+            {'shipping_address_id': address, 'billing_address_id': address},
+            format='json',
+            HTTP_IDEMPOTENCY_KEY=key,
+        )
+
+    def test_retry_replays_original_response(self):
+        self.client.force_authenticate(self.user)
+        first = self.checkout('checkout-1')
+        self.assertEqual(first.status_code, 201)
+
+        retry = self.checkout('checkout-1')
+        self.assertEqual(retry.status_code, 201)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(retry.json()['id'], first.json()['id'])
+        self.assertEqual(Order.objects.filter(user=self.user).count(), 1)
+
+    def test_key_reused_for_different_request(self):
+        self.client.force_authenticate(self.user)
+        self.checkout('checkout-2')
+        response = self.checkout('checkout-2', address=self.address.id + 1000)
+        self.assertEqual(response.status_code, 422)
+
+
+class KeysetPaginationTests(APITestCase):
+    """
+    Cursor pages walk every row exactly once in both directions, also across
+    rows with equal sort values, and tampered cursors are a 404.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('pager', 'pager@example.com', 'password')
+        orders = Order.objects.bulk_create([Order(user=cls.user, total_amount=Decimal('1.00')) for _ in range(25)])
+        now = timezone.now()
+        # The first 15 orders share a timestamp, so only the id tie-breaker orders them
+        for index, order in enumerate(orders):
+            order.created_at = now if index < 15 else now - timedelta(minutes=index)
+        Order.objects.bulk_update(orders, ['created_at'])
+        cls.expected = list(Order.objects.order_by('-created_at', '-id').values_list('id', flat=True))
+
+    def setUp(self):
+        self.client.force_authenticate(self.user)
+
+    def walk(self, url, link):
+        ids = []
+        while url:
+            data = self.client.get(url).json()
+            ids.extend(order['id'] for order in data['results'])
+            url = data[link]
+        return ids, data
+
+    def test_next_and_previous_pages_cover_every_row_once(self):
+        ids, last_page = self.walk('/api/orders/?pagination=cursor', 'next')
+        self.assertEqual(ids, self.expected)
+        self.assertEqual(len(last_page['results']), 5)
+
+        pages = []
+        url = last_page['previous']
+        while url:
+            data = self.client.get(url).json()
+            pages.insert(0, [order['id'] for order in data['results']])
+            url = data['previous']
+        self.assertEqual([order_id for page in pages for order_id in page], self.expected[:20])
+
+    def test_tampered_cursors_are_not_found(self):
+        next_url = self.client.get('/api/orders/?pagination=cursor').json()['next']
+        cursor = parse_qs(urlparse(next_url).query)['cursor'][0]
+        payload = json.loads(base64.urlsafe_b64decode(cursor))
+
+        tampered = []
+        for position in (['not-a-date', payload['p'][1]], [payload['p'][0], 'x'], [payload['p'][0], None], [{}, 1]):
+            data = dict(payload, p=position)
+            tampered.append(base64.urlsafe_b64encode(json.dumps(data).encode()).decode())
+        for cursor in tampered + ['garbage']:
+            with self.subTest(cursor=cursor):
+                self.assertEqual(self.client.get('/api/orders/', {'cursor': cursor}).status_code, 404)
+
+    def test_models_without_created_at_fall_back_to_the_pk(self):
+        self.assertEqual(KeysetPagination().get_ordering(Category.objects.all(), view=None), ['id'])
+
+        for cache in caches.all():
+            cache.clear()
+        Category.objects.bulk_create([Category(name=f'Category {i:02}', slug=f'category-{i}') for i in range(25)])
+        expected = list(Category.objects.order_by('name', 'id').values_list('id', flat=True))
+        ids, _ = self.walk('/api/categories/?pagination=cursor', 'next')
+        self.assertEqual(ids, expected)
+
+        self.client.force_authenticate(User.objects.create_superuser('pager-admin', 'pa@example.com', 'password'))
+        ids, _ = self.walk('/api/admin/categories/?pagination=cursor', 'next')
+        self.assertEqual(ids, expected)
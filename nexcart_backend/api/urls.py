@@ -3,10 +3,11 @@ from rest_framework.routers import DefaultRouter
 from users.views import UserViewSet, AddressViewSet
 from products.views import CategoryViewSet, ProductViewSet
 from orders.views import CartViewSet, OrderViewSet
-from payments.views import PaymentViewSet
+from payments.views import PaymentViewSet, StripeWebhookView
 from .admin_views import (
     check_admin_status,
     dashboard_stats,
+    sales_analytics,
     AdminProductViewSet,
     AdminCategoryViewSet,
     AdminOrderViewSet,
@@ -32,6 +33,8 @@ admin_router.register(r'users', AdminUserViewSet)
 
 # The API URLs are now determined automatically by the router
 urlpatterns = [
+    # Before the router, whose payments/<pk>/ route would match it
+    path('payments/webhook/', StripeWebhookView.as_view(), name='stripe_webhook'),
     path('', include(router.urls)),
     path('auth/', include('rest_framework.urls')),
 
@@ -39,4 +42,5 @@ urlpatterns = [
     path('admin/', include(admin_router.urls)),
     path('users/check_admin/', check_admin_status),
     path('admin/dashboard_stats/', dashboard_stats),
+    path('admin/analytics/sales/', sales_analytics),
 ]
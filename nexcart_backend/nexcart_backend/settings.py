@@ -56,6 +56,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
 
     # Third-party apps
     'rest_framework',
@@ -125,6 +126,57 @@ if os.environ.get('DATABASE_URL'):
     DATABASES['default'] = dj_database_url.parse(os.environ.get('DATABASE_URL'))
 
 
+# Caches
+# Local memory by default (tests, single process); set REDIS_URL to share the
+# catalog cache and its version counter across all gunicorn workers.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'nexcart-default',
+    },
+}
+
+if os.environ.get('REDIS_URL'):
+    CACHES['default'] = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ.get('REDIS_URL'),
+    }
+
+# Active carts. They need a cache shared by every worker, so without Redis the
+# cart store gets a dummy cache and reads and writes carts straight through
+# to the database. Anonymous carts cannot be kept that way, so the cart
+# endpoints then require a logged-in customer.
+CACHES['carts'] = dict(CACHES['default']) if os.environ.get('REDIS_URL') else {
+    'BACKEND': 'django.core.cache.backends.dummy.DummyCache',
+}
+CART_CACHE_ALIAS = os.environ.get('CART_CACHE_ALIAS', 'carts')
+CART_CACHE_TIMEOUT = int(os.environ.get('CART_CACHE_TIMEOUT', 60 * 60 * 24 * 14))
+# 'async' writes carts back to the database from a thread pool, 'sync' inline
+CART_PERSIST_MODE = os.environ.get('CART_PERSIST_MODE', 'async' if os.environ.get('REDIS_URL') else 'sync')
+CART_PERSIST_WORKERS = int(os.environ.get('CART_PERSIST_WORKERS', 2))
+
+# Versioned catalog responses. Writes bump a version counter kept in the
+# cache, which only reaches every worker through a shared cache, so response
+# caching is off unless Redis is configured.
+CATALOG_CACHE_ENABLED = os.environ.get(
+    'CATALOG_CACHE_ENABLED', 'True' if os.environ.get('REDIS_URL') else 'False'
+) == 'True'
+CATALOG_CACHE_ALIAS = os.environ.get('CATALOG_CACHE_ALIAS', 'default')
+CATALOG_CACHE_TIMEOUT = int(os.environ.get('CATALOG_CACHE_TIMEOUT', 300))
+
+# Cached closed buckets of the sales analytics. They are invalidated when the
+# rollup refresh recomputes their day, which only reaches web workers through a
+# shared cache, so without Redis they expire after a few minutes instead.
+ANALYTICS_CACHE_ALIAS = os.environ.get('ANALYTICS_CACHE_ALIAS', 'default')
+ANALYTICS_CACHE_TIMEOUT = None if os.environ.get('REDIS_URL') else 300
+
+# Optional in-process catalog snapshot answering product listings without the
+# database; refreshed incrementally every few seconds and fully rebuilt periodically
+CATALOG_SNAPSHOT_ENABLED = os.environ.get('CATALOG_SNAPSHOT_ENABLED', 'False') == 'True'
+CATALOG_SNAPSHOT_REFRESH_SECONDS = int(os.environ.get('CATALOG_SNAPSHOT_REFRESH_SECONDS', 5))
+CATALOG_SNAPSHOT_REBUILD_SECONDS = int(os.environ.get('CATALOG_SNAPSHOT_REBUILD_SECONDS', 600))
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
 
@@ -182,6 +234,14 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Named image size variants as Cloudinary transformations; other storages
+# serve the original image for every variant
+IMAGE_VARIANTS = {
+    'thumbnail': 'c_fill,w_150,h_150',
+    'medium': 'c_limit,w_600',
+    'large': 'c_limit,w_1200',
+}
+
 # REST Framework settings
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
@@ -193,7 +253,7 @@ REST_FRAMEWORK = {
     'DEFAULT_FILTER_BACKENDS': [
         'django_filters.rest_framework.DjangoFilterBackend',
     ],
-    'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
+    'DEFAULT_PAGINATION_CLASS': 'api.pagination.StandardResultsPagination',
     'PAGE_SIZE': 10,
 }
 
@@ -228,11 +288,37 @@ CORS_ALLOW_HEADERS = [
     'cache-control',
     'pragma',
     'expires',
+    'x-cart-token',
+    'idempotency-key',
 ]
+CORS_EXPOSE_HEADERS = ['x-cart-token', 'idempotent-replayed']
+
+# How long an Idempotency-Key and its stored response are honoured (seconds)
+IDEMPOTENCY_KEY_TTL = int(os.environ.get('IDEMPOTENCY_KEY_TTL', 60 * 60 * 24))
 
 # Stripe settings
 STRIPE_PUBLIC_KEY = os.environ.get('STRIPE_PUBLIC_KEY', '')
 STRIPE_SECRET_KEY = os.environ.get('STRIPE_SECRET_KEY', '')
+STRIPE_WEBHOOK_SECRET = os.environ.get('STRIPE_WEBHOOK_SECRET', '')
+# Webhook events applied per transaction, and attempts before an event is set aside
+STRIPE_EVENT_BATCH_SIZE = int(os.environ.get('STRIPE_EVENT_BATCH_SIZE', 200))
+STRIPE_EVENT_MAX_ATTEMPTS = int(os.environ.get('STRIPE_EVENT_MAX_ATTEMPTS', 5))
+# Timeout for one HTTP request to Stripe (seconds)
+STRIPE_TIMEOUT = float(os.environ.get('STRIPE_TIMEOUT', 5))
+
+# Payment gateway: 'stripe', or 'fake' for local development, tests and benchmarks
+PAYMENT_GATEWAY = os.environ.get('PAYMENT_GATEWAY', 'stripe')
+# Longest a request waits on the provider, retries included (seconds)
+PAYMENT_GATEWAY_DEADLINE = float(os.environ.get('PAYMENT_GATEWAY_DEADLINE', 8))
+PAYMENT_GATEWAY_MAX_RETRIES = int(os.environ.get('PAYMENT_GATEWAY_MAX_RETRIES', 2))
+# Provider calls in flight per process; requests beyond this get a 503 at once
+PAYMENT_GATEWAY_MAX_CONCURRENCY = int(os.environ.get('PAYMENT_GATEWAY_MAX_CONCURRENCY', 4))
+# Consecutive failures that open the circuit, and how long it stays open (seconds)
+PAYMENT_GATEWAY_FAILURE_THRESHOLD = int(os.environ.get('PAYMENT_GATEWAY_FAILURE_THRESHOLD', 5))
+PAYMENT_GATEWAY_RESET_TIMEOUT = int(os.environ.get('PAYMENT_GATEWAY_RESET_TIMEOUT', 30))
+# Simulated latency (seconds) and transient failure rate (0-1) of the fake gateway
+PAYMENT_GATEWAY_FAKE_LATENCY = float(os.environ.get('PAYMENT_GATEWAY_FAKE_LATENCY', 0))
+PAYMENT_GATEWAY_FAKE_FAILURE_RATE = float(os.environ.get('PAYMENT_GATEWAY_FAKE_FAILURE_RATE', 0))
 
 # Custom User model
 AUTH_USER_MODEL = 'users.User'
@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'nexcart_backend.settings')
 
 application = get_wsgi_application()
+
+# Build the catalog snapshot before gunicorn forks (--preload) so workers share it
+from products.snapshot import warm_catalog_snapshot  # noqa: E402
+
+warm_catalog_snapshot()
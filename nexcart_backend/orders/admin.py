@@ -14,6 +14,10 @@ class CartAdmin(admin.ModelAdmin):
     readonly_fields = ('total_price', 'total_items')
     inlines = [CartItemInline]
     date_hierarchy = 'created_at'
+    list_select_related = ('user',)
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).with_totals()
 
 class OrderItemInline(admin.TabularInline):
     model = OrderItem
@@ -29,3 +33,6 @@ class OrderAdmin(admin.ModelAdmin):
     inlines = [OrderItemInline]
     date_hierarchy = 'created_at'
     list_select_related = ('user',)
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).with_totals()
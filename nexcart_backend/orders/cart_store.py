@@ -0,0 +1,374 @@
+"""
+Cache-backed storage for active carts.
+
+A cart is cached as a small dict (``new_entry``) under its owner: ``user:<id>``
+for customers or ``anon:<token>`` for anonymous visitors. Reads and mutations
+only touch the cache; customer carts are written back to Cart/CartItem in a
+background thread (CART_PERSIST_MODE = 'async') or inline ('sync'), and always
+flushed before checkout, which holds the cart lock until the order is placed.
+Anonymous carts live in the cache only and are merged into the customer's
+cart when they log in.
+
+Line ids are taken from the CartItem id sequence when a line is added, so the
+``cart_item_id`` clients send back stays valid once the line is persisted.
+"""
+
+import copy
+import secrets
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.db import connection, connections, transaction
+from django.db.models.functions import Now
+from django.utils import timezone
+
+from products.models import Product
+from .models import Cart, CartItem
+
+
+LOCK_TIMEOUT = 5
+
+
+def get_cart_cache():
+    return caches[settings.CART_CACHE_ALIAS]
+
+
+def user_owner(user):
+    return f'user:{user.pk}'
+
+
+def anonymous_owner(token):
+    return f'anon:{token}'
+
+
+def new_cart_token():
+    return secrets.token_urlsafe(24)
+
+
+def cart_key(owner):
+    return f'cart:{owner}'
+
+
+def new_entry(cart_id=None):
+    now = timezone.now()
+    return {
+        'cart_id': cart_id,
+        'version': 0,
+        'dirty': False,
+        'lines': [],  # [cart_item_id, product_id, quantity]
+        'created_at': now,
+        'updated_at': now,
+    }
+
+
+class CartLocked(Exception):
+    """The cart lock could not be taken within LOCK_TIMEOUT"""
+
+
+@contextmanager
+def cart_lock(owner):
+    """
+    Serialize read-modify-write cycles on one cart across workers. Raises
+    CartLocked if another holder keeps the lock for LOCK_TIMEOUT seconds.
+    """
+    cache = get_cart_cache()
+    key = f'{cart_key(owner)}:lock'
+    token = secrets.token_hex(16)
+    deadline = time.monotonic() + LOCK_TIMEOUT
+    # add() is atomic; a holder that died releases the lock when it expires
+    while not cache.add(key, token, LOCK_TIMEOUT):
+        if time.monotonic() >= deadline:
+            raise CartLocked(owner)
+        time.sleep(0.01)
+    try:
+        yield
+    finally:
+        # Our lock may have expired and been taken by another worker; leave theirs alone
+        if cache.get(key) == token:
+            cache.delete(key)
+
+
+def read_cart(user):
+    """Load a customer's cart from the database. Returns (entry, products by id)."""
+    cart = Cart.objects.filter(user=user).first()
+    if cart is None:
+        return new_entry(), {}
+    items = list(CartItem.objects.filter(cart=cart).select_related('product__category').order_by('id'))
+    entry = new_entry(cart.pk)
+    entry['lines'] = [[item.id, item.product_id, item.quantity] for item in items]
+    entry['created_at'] = cart.created_at
+    entry['updated_at'] = cart.updated_at
+    return entry, {item.product_id: item.product for item in items}
+
+
+def load_cart(owner, user=None):
+    """
+    Return (entry, products) for a cart. ``products`` is only filled when the
+    cart had to be read from the database, and is None on a cache hit.
+    """
+    cache = get_cart_cache()
+    entry = cache.get(cart_key(owner))
+    if entry is not None:
+        return entry, None
+    if user is None:
+        return new_entry(), {}
+    entry, products = read_cart(user)
+    cache.set(cart_key(owner), entry, settings.CART_CACHE_TIMEOUT)
+    return entry, products
+
+
+def load_products(entry):
+    """Products shown by the cart lines, with their categories, in one query"""
+    return Product.objects.select_related('category').in_bulk([product_id for _, product_id, _ in entry['lines']])
+
+
+def build_cart(entry, products, user=None):
+    """
+    An unsaved-looking Cart whose prefetched items come from the entry,
+    ready for CartSerializer without further queries.
+    """
+    cart = Cart(id=entry['cart_id'], created_at=entry['created_at'], updated_at=entry['updated_at'])
+    if user is not None:
+        cart.user = user
+    cart._prefetched_objects_cache = {'items': [
+        CartItem(id=item_id, cart=cart, product=products[product_id], quantity=quantity)
+        for item_id, product_id, quantity in entry['lines']
+        if product_id in products
+    ]}
+    return cart
+
+
+def allocate_item_ids(count):
+    """Reserve ``count`` CartItem ids from the table's sequence in one query"""
+    if not count:
+        return []
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT nextval(pg_get_serial_sequence(%s, %s)) FROM generate_series(1, %s)',
+            [CartItem._meta.db_table, 'id', count],
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def find_line(lines, item_id=None, product_id=None):
+    for line in lines:
+        if (item_id is not None and line[0] == item_id) or (product_id is not None and line[1] == product_id):
+            return line
+    return None
+
+
+def add_line(entry, product_id, quantity):
+    line = find_line(entry['lines'], product_id=product_id)
+    if line is not None:
+        line[2] += quantity
+    else:
+        entry['lines'].append([allocate_item_ids(1)[0], product_id, quantity])
+
+
+class CartLineNotFound(Exception):
+    """A batch operation referenced a line that is not in the cart"""
+    def __init__(self, index):
+        super().__init__(index)
+        self.index = index
+
+
+def apply_operations(entry, operations):
+    """
+    Apply validated add/update/remove operations to an entry, all or nothing.
+    Raises CartLineNotFound with the index of the first operation whose line
+    does not exist; the entry is then left untouched.
+    """
+    lines = copy.deepcopy(entry['lines'])
+    for index, operation in enumerate(operations):
+        if operation['op'] == 'add':
+            line = find_line(lines, product_id=operation['product_id'])
+        else:
+            line = find_line(lines, operation.get('cart_item_id'), operation.get('product_id'))
+        if operation['op'] == 'add':
+            if line is not None:
+                line[2] += operation.get('quantity', 1)
+            else:
+                lines.append([None, operation['product_id'], operation.get('quantity', 1)])
+        elif line is None:
+            raise CartLineNotFound(index)
+        elif operation['op'] == 'remove' or operation['quantity'] == 0:
+            lines.remove(line)
+        else:
+            line[2] = operation['quantity']
+
+    new_lines = [line for line in lines if line[0] is None]
+    for line, item_id in zip(new_lines, allocate_item_ids(len(new_lines))):
+        line[0] = item_id
+    entry['lines'] = lines
+
+
+def store_entry(owner, entry, dirty):
+    entry['version'] += 1
+    entry['dirty'] = dirty
+    entry['updated_at'] = timezone.now()
+    get_cart_cache().set(cart_key(owner), entry, settings.CART_CACHE_TIMEOUT)
+
+
+@contextmanager
+def mutate_cart(owner, user=None):
+    """
+    Yield a cart entry to change in place under the cart lock. A changed entry
+    is stored back in the cache and, for customer carts, scheduled for
+    write-back once the lock is released.
+    """
+    with cart_lock(owner):
+        entry, _ = load_cart(owner, user)
+        before = copy.deepcopy(entry['lines'])
+        yield entry
+        changed = entry['lines'] != before
+        if changed:
+            store_entry(owner, entry, dirty=user is not None)
+    if changed and user is not None:
+        schedule_persist(user.pk, entry)
+
+
+def persist_entry(user_id, entry):
+    """
+    Write one cart entry to Cart/CartItem, replacing the stored lines.
+    Cart.updated_at records the time of the stored state, so an entry no
+    newer than it, e.g. a write-back queued before the cart was checked out,
+    is dropped.
+    """
+    lines = entry['lines']
+    with transaction.atomic():
+        cart, created = Cart.objects.select_for_update().get_or_create(user_id=user_id)
+        if not created and cart.updated_at >= entry['updated_at']:
+            return cart.pk
+        existing = set(Product.objects.filter(id__in=[line[1] for line in lines]).values_list('id', flat=True))
+        lines = [line for line in lines if line[1] in existing]
+        CartItem.objects.filter(cart=cart).exclude(id__in=[line[0] for line in lines]).delete()
+        # A line keeps its product for life, so the row with its id is the
+        # row for (cart, product) and only the quantity needs updating
+        CartItem.objects.bulk_create(
+            [CartItem(id=item_id, cart=cart, product_id=product_id, quantity=quantity)
+             for item_id, product_id, quantity in lines],
+            update_conflicts=True,
+            unique_fields=['cart', 'product'],
+            update_fields=['quantity'],
+        )
+        Cart.objects.filter(pk=cart.pk).update(updated_at=entry['updated_at'])
+    return cart.pk
+
+
+def mark_clean(owner, persisted, cart_id):
+    """Mark the cached cart clean after a write-back, unless it changed meanwhile. Needs the cart lock."""
+    cache = get_cart_cache()
+    latest = cache.get(cart_key(owner))
+    if latest is not None and latest['version'] == persisted['version']:
+        latest['dirty'] = False
+        latest['cart_id'] = cart_id
+        cache.set(cart_key(owner), latest, settings.CART_CACHE_TIMEOUT)
+
+
+def persist_cart(user_id, entry=None):
+    """
+    Persist the newest cached state of a customer's cart if it is dirty,
+    falling back to ``entry`` when the cache no longer holds it.
+    """
+    owner = f'user:{user_id}'
+    # Write-backs of one cart run one at a time, so an older state can never
+    # land after a newer one
+    with cart_lock(f'{owner}:persist'):
+        current = get_cart_cache().get(cart_key(owner)) or entry
+        if current is None or not current['dirty']:
+            return
+        cart_id = persist_entry(user_id, current)
+        with cart_lock(owner):
+            mark_clean(owner, current, cart_id)
+
+
+_executor = None
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=settings.CART_PERSIST_WORKERS, thread_name_prefix='cart-persist')
+    return _executor
+
+
+def run_persist(user_id, entry):
+    try:
+        persist_cart(user_id, entry)
+    finally:
+        # Threads get their own connections; don't leave them open
+        connections.close_all()
+
+
+def schedule_persist(user_id, entry):
+    if settings.CART_PERSIST_MODE == 'sync':
+        try:
+            persist_cart(user_id, entry)
+        except CartLocked:
+            pass  # the entry stays dirty; the write-back holding the lock or a later one stores it
+        return
+    # A failed write-back leaves the entry dirty; the next mutation or the
+    # flush before checkout retries it
+    transaction.on_commit(lambda: get_executor().submit(run_persist, user_id, copy.deepcopy(entry)))
+
+
+def flush_cart(user):
+    """Synchronously persist a customer's cart"""
+    persist_cart(user.pk)
+
+
+@contextmanager
+def checkout_lock(user):
+    """
+    Flush a customer's cart to the database and keep it locked until the
+    block exits, so no mutation or write-back runs while it is checked out.
+    Takes the write-back lock before the cart lock, like persist_cart.
+    """
+    owner = user_owner(user)
+    with cart_lock(f'{owner}:persist'), cart_lock(owner):
+        current = get_cart_cache().get(cart_key(owner))
+        if current is not None and current['dirty']:
+            mark_clean(owner, current, persist_entry(user.pk, current))
+        yield
+
+
+def forget_cart(user):
+    """Drop the cached cart so the next read reloads it from the database"""
+    get_cart_cache().delete(cart_key(user_owner(user)))
+
+
+def merge_anonymous_cart(token, user):
+    """
+    Move the lines of an anonymous cart into the customer's cart, adding
+    quantities for products present in both. Returns True if anything merged.
+    """
+    if not token:
+        return False
+    cache = get_cart_cache()
+    anonymous = anonymous_owner(token)
+    if cache.get(cart_key(anonymous)) is None:
+        return False
+
+    # The anonymous cart is only removed once the customer's cart is locked,
+    # so a busy customer cart can't make its lines disappear
+    with mutate_cart(user_owner(user), user) as entry:
+        with cart_lock(anonymous):
+            source = cache.get(cart_key(anonymous))
+            cache.delete(cart_key(anonymous))
+        lines = source['lines'] if source else []
+        for item_id, product_id, quantity in lines:
+            line = find_line(entry['lines'], product_id=product_id)
+            if line is not None:
+                line[2] += quantity
+            else:
+                entry['lines'].append([item_id, product_id, quantity])
+    return bool(lines)
+
+
+def can_store_anonymous_carts():
+    """Anonymous carts live in the cache only, so they need a cache that keeps what it is given"""
+    return not isinstance(get_cart_cache(), DummyCache)
@@ -0,0 +1,138 @@
+from django.db import transaction
+from django.db.models import Case, DecimalField, F, Q, Sum, When
+from django.db.models.functions import Now
+from django.utils import timezone
+from rest_framework import status
+
+from products.models import Product
+from .models import Cart, CartItem, Order, OrderItem
+
+
+class CheckoutError(Exception):
+    """
+    Raised when a cart cannot be turned into an order.
+    Carries the HTTP status and payload the view should respond with.
+    """
+    def __init__(self, detail, status_code=status.HTTP_400_BAD_REQUEST, items=None):
+        super().__init__(detail)
+        self.detail = detail
+        self.status_code = status_code
+        self.items = items or []
+
+    def as_response_data(self):
+        data = {'detail': self.detail}
+        if self.items:
+            data['items'] = self.items
+        return data
+
+
+def checkout_cart(user, shipping_address, billing_address, shipping_cost=0):
+    """
+    Turn the user's cart into an order in a single transaction.
+
+    The cart and its products are locked in primary-key order so concurrent
+    checkouts cannot deadlock or oversell; inventory is decremented with one
+    conditional UPDATE, order items are bulk inserted and the total is summed
+    in SQL. Raises CheckoutError if the cart is missing, empty or cannot be
+    fulfilled, in which case nothing is written.
+    """
+    with transaction.atomic():
+        try:
+            cart = Cart.objects.select_for_update().get(user=user)
+        except Cart.DoesNotExist:
+            raise CheckoutError("Cart not found.", status.HTTP_404_NOT_FOUND)
+
+        lines = list(
+            CartItem.objects.filter(cart=cart)
+            .order_by('product_id')
+            .values_list('product_id', 'quantity')
+        )
+        if not lines:
+            raise CheckoutError("Cannot create order from empty cart.")
+
+        products = {
+            product['id']: product
+            for product in Product.objects.select_for_update()
+            .filter(id__in=[product_id for product_id, _ in lines])
+            .order_by('id')
+            .values('id', 'name', 'effective_price', 'inventory', 'is_active')
+        }
+
+        unavailable = []
+        for product_id, quantity in lines:
+            product = products.get(product_id)
+            if product is None or not product['is_active'] or product['inventory'] < quantity:
+                unavailable.append({
+                    'product_id': product_id,
+                    'name': product['name'] if product else None,
+                    'requested': quantity,
+                    'available': product['inventory'] if product and product['is_active'] else 0,
+                })
+        if unavailable:
+            raise CheckoutError(
+                "Some items are no longer available in the requested quantity.",
+                status.HTTP_409_CONFLICT,
+                items=unavailable,
+            )
+
+        # Conditional decrement: every row must still have enough stock. Cached
+        # catalog pages are not invalidated here; their stock figures may lag
+        # by CATALOG_CACHE_TIMEOUT, but checkout itself never oversells.
+        in_stock = Q()
+        decrement = []
+        for product_id, quantity in lines:
+            in_stock |= Q(id=product_id, inventory__gte=quantity)
+            decrement.append(When(id=product_id, then=F('inventory') - quantity))
+        updated = Product.objects.filter(in_stock).update(inventory=Case(*decrement), updated_at=Now())
+        if updated != len(lines):
+            raise CheckoutError(
+                "Some items are no longer available in the requested quantity.",
+                status.HTTP_409_CONFLICT,
+            )
+
+        items_total = CartItem.objects.filter(cart=cart).aggregate(
+            total=Sum(F('quantity') * F('product__effective_price'), output_field=DecimalField(max_digits=10, decimal_places=2))
+        )['total'] or 0
+
+        order = Order.objects.create(
+            user=user,
+            shipping_address=shipping_address,
+            billing_address=billing_address,
+            total_amount=items_total,
+            shipping_cost=shipping_cost,
+        )
+
+        OrderItem.objects.bulk_create([
+            OrderItem(
+                order=order,
+                product_id=product_id,
+                quantity=quantity,
+                price=products[product_id]['effective_price'],
+            )
+            for product_id, quantity in lines
+        ])
+
+        CartItem.objects.filter(cart=cart).delete()
+        # App clock, like the cart store's entries: write-backs queued before
+        # this point are older and get dropped (see cart_store.persist_entry)
+        Cart.objects.filter(pk=cart.pk).update(updated_at=timezone.now())
+
+    return order
+
+
+def restock_order(order):
+    """
+    Put the items of an order back into stock, e.g. when it is cancelled.
+    Call inside a transaction; products are locked in primary-key order,
+    like checkout does, and incremented in one UPDATE.
+    """
+    quantities = {}
+    for product_id, quantity in OrderItem.objects.filter(order=order).values_list('product_id', 'quantity'):
+        quantities[product_id] = quantities.get(product_id, 0) + quantity
+    if not quantities:
+        return
+    list(Product.objects.select_for_update().filter(id__in=quantities).order_by('id').values_list('id', flat=True))
+    Product.objects.filter(id__in=quantities).update(
+        inventory=Case(*[When(id=product_id, then=F('inventory') + quantity) for product_id, quantity in quantities.items()]),
+        updated_at=Now(),
+    )
@@ -1,7 +1,46 @@
+from decimal import Decimal
+
 from django.db import models
+from django.db.models import Count, DecimalField, F, Sum, Value
+from django.db.models.functions import Coalesce
 from django.conf import settings
 from products.models import Product
 
+MONEY_FIELD = DecimalField(max_digits=12, decimal_places=2)
+
+
+def money_sum(expression):
+    """SUM of a price expression as a decimal, 0 rather than NULL when there are no rows"""
+    return Coalesce(Sum(expression, output_field=MONEY_FIELD), Value(Decimal('0')), output_field=MONEY_FIELD)
+
+
+def quantity_sum(expression):
+    return Coalesce(Sum(expression), Value(0))
+
+
+def prefetched(instance, name):
+    """The prefetched rows of a relation, or None when it was not prefetched"""
+    return getattr(instance, '_prefetched_objects_cache', {}).get(name)
+
+
+class CartQuerySet(models.QuerySet):
+    def with_totals(self):
+        """Annotate each cart with its price and item totals in the same query"""
+        return self.annotate(
+            annotated_total_price=money_sum(F('items__quantity') * F('items__product__effective_price')),
+            annotated_total_items=quantity_sum('items__quantity'),
+        )
+
+
+class OrderQuerySet(models.QuerySet):
+    def with_totals(self):
+        """Annotate each order with the sum of its line totals and its line count in the same query"""
+        return self.annotate(
+            annotated_items_total=money_sum(F('items__quantity') * F('items__price')),
+            annotated_item_count=Count('items'),
+        )
+
+
 class Cart(models.Model):
     """
     Cart model for storing user's shopping cart
@@ -10,19 +49,42 @@ class Cart(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = CartQuerySet.as_manager()
+
     def __str__(self):
         username = self.user.username if self.user else "Unknown User"
         return f"{username}'s cart"
 
+    @property
+    def totals(self):
+        """
+        Price and item totals, from with_totals() annotations, prefetched
+        items, or else one aggregate query whose result is kept on the instance
+        """
+        if hasattr(self, 'annotated_total_price'):
+            return {'total_price': self.annotated_total_price, 'total_items': self.annotated_total_items}
+        items = prefetched(self, 'items')
+        if items is not None:
+            return {
+                'total_price': sum((item.total_price for item in items), Decimal('0')),
+                'total_items': sum(item.quantity for item in items),
+            }
+        if not hasattr(self, '_totals'):
+            self._totals = self.items.aggregate(
+                total_price=money_sum(F('quantity') * F('product__effective_price')),
+                total_items=quantity_sum('quantity'),
+            )
+        return self._totals
+
     @property
     def total_price(self):
         """Calculate total price of all items in cart"""
-        return sum(item.total_price for item in self.items.all())
+        return self.totals['total_price']
 
     @property
     def total_items(self):
         """Calculate total number of items in cart"""
-        return sum(item.quantity for item in self.items.all())
+        return self.totals['total_items']
 
 class CartItem(models.Model):
     """
@@ -42,9 +104,9 @@ class CartItem(models.Model):
     @property
     def total_price(self):
         """Calculate total price for this cart item"""
-        if self.product is None or self.product.price is None or self.quantity is None:
+        if self.product is None or self.product.effective_price is None or self.quantity is None:
             return 0
-        return self.product.price * self.quantity
+        return self.product.effective_price * self.quantity
 
 class Order(models.Model):
     """
@@ -69,14 +131,45 @@ class Order(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = OrderQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Keyset pagination over (created_at, id) for admin and per-user listings
+            models.Index(fields=['-created_at', '-id'], name='order_created_id_idx'),
+            models.Index(fields=['user', '-created_at', '-id'], name='order_user_created_id_idx'),
+            # Incremental refresh of the sales rollups
+            models.Index(fields=['updated_at'], name='order_updated_idx'),
+        ]
+
     def __str__(self):
         username = self.user.username if self.user else "Unknown User"
         return f"Order {self.id} by {username}"
 
     @property
     def items_total(self):
-        """Calculate total price of all items in order"""
-        return sum(item.total_price for item in self.items.all())
+        """
+        Calculate total price of all items in order, from with_totals(),
+        prefetched items, or else one aggregate query kept on the instance
+        """
+        if hasattr(self, 'annotated_items_total'):
+            return self.annotated_items_total
+        items = prefetched(self, 'items')
+        if items is not None:
+            return sum((item.total_price for item in items), Decimal('0'))
+        if not hasattr(self, '_items_total'):
+            self._items_total = self.items.aggregate(total=money_sum(F('quantity') * F('price')))['total']
+        return self._items_total
+
+    @property
+    def item_count(self):
+        """Number of lines in the order"""
+        if hasattr(self, 'annotated_item_count'):
+            return self.annotated_item_count
+        items = prefetched(self, 'items')
+        if items is not None:
+            return len(items)
+        return self.items.count()
 
     @property
     def final_total(self):
@@ -1,4 +1,6 @@
+from django.db.models import Prefetch
 from rest_framework import serializers
+from api.querysets import eager_load
 from .models import Cart, CartItem, Order, OrderItem
 from products.models import Product
 from products.serializers import ProductListSerializer
@@ -41,6 +43,41 @@ class CartSerializer(serializers.ModelSerializer):
         fields = ['id', 'items', 'total_price', 'total_items', 'created_at', 'updated_at']
         read_only_fields = ['created_at', 'updated_at']
 
+class CartOperationSerializer(serializers.Serializer):
+    """
+    One operation of a batch cart update. Lines are addressed by
+    cart_item_id or product_id; updating to quantity 0 removes the line.
+    """
+    op = serializers.ChoiceField(choices=['add', 'update', 'remove'])
+    product_id = serializers.IntegerField(required=False, min_value=1)
+    cart_item_id = serializers.IntegerField(required=False, min_value=1)
+    quantity = serializers.IntegerField(required=False, min_value=0)
+
+    def validate(self, attrs):
+        if attrs['op'] == 'add':
+            if 'product_id' not in attrs:
+                raise serializers.ValidationError("Product ID is required.")
+            if attrs.get('quantity') == 0:
+                raise serializers.ValidationError("Quantity must be at least 1.")
+        elif 'product_id' not in attrs and 'cart_item_id' not in attrs:
+            raise serializers.ValidationError("Cart item ID or product ID is required.")
+        if attrs['op'] == 'update' and 'quantity' not in attrs:
+            raise serializers.ValidationError("Quantity is required.")
+        return attrs
+
+class CartBatchSerializer(serializers.Serializer):
+    """
+    Validates the body of a batch cart update
+    """
+    MAX_OPERATIONS = 100
+
+    operations = CartOperationSerializer(many=True, allow_empty=False)
+
+    def validate_operations(self, value):
+        if len(value) > self.MAX_OPERATIONS:
+            raise serializers.ValidationError(f"At most {self.MAX_OPERATIONS} operations are allowed.")
+        return value
+
 class OrderItemSerializer(serializers.ModelSerializer):
     """
     Serializer for the OrderItem model
@@ -83,3 +120,77 @@ class OrderSerializer(serializers.ModelSerializer):
                   'tracking_number', 'items', 'items_total', 'final_total',
                   'created_at', 'updated_at']
         read_only_fields = ['total_amount', 'created_at', 'updated_at']
+
+class OrderListSerializer(serializers.ModelSerializer):
+    """
+    Compact serializer for order lists. Totals and item_count come from
+    Order.objects.with_totals(); ``?expand=items,user,addresses`` adds the
+    nested representations OrderSerializer always includes
+    """
+    user_id = serializers.IntegerField(read_only=True)
+    items_total = serializers.DecimalField(max_digits=10, decimal_places=2, read_only=True)
+    final_total = serializers.DecimalField(max_digits=10, decimal_places=2, read_only=True)
+    item_count = serializers.IntegerField(read_only=True)
+    items = OrderItemSerializer(many=True, read_only=True)
+    user = UserSerializer(read_only=True)
+    shipping_address = AddressSerializer(read_only=True)
+    billing_address = AddressSerializer(read_only=True)
+
+    class Meta:
+        model = Order
+        fields = ['id', 'user_id', 'status', 'payment_status', 'shipping_cost', 'total_amount',
+                  'items_total', 'final_total', 'item_count', 'tracking_number',
+                  'created_at', 'updated_at', 'items', 'user', 'shipping_address', 'billing_address']
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        expand = get_order_expansions(self.context.get('request'))
+        for name, (fields, _, _) in ORDER_EXPANSIONS.items():
+            if name not in expand:
+                for field in fields:
+                    self.fields.pop(field)
+
+# Relations read by OrderSerializer, for use with api.querysets.eager_load
+ORDER_SELECT_RELATED = ('user', 'shipping_address', 'billing_address')
+ORDER_PREFETCH_RELATED = (
+    'user__addresses',
+    Prefetch('items', queryset=OrderItem.objects.select_related('product__category')),
+)
+
+# ?expand= values accepted by OrderListSerializer:
+# name -> (serializer fields, select_related, prefetch_related)
+ORDER_EXPANSIONS = {
+    'items': (
+        ('items',),
+        (),
+        (Prefetch('items', queryset=OrderItem.objects.select_related('product__category')),),
+    ),
+    'user': (('user',), ('user',), ('user__addresses',)),
+    'addresses': (('shipping_address', 'billing_address'), ('shipping_address', 'billing_address'), ()),
+}
+ORDER_EXPAND_PARAM = 'expand'
+
+
+def get_order_expansions(request):
+    """The known relations named in the request's ?expand= parameter"""
+    if request is None:
+        return set()
+    params = getattr(request, 'query_params', request.GET)
+    names = {name.strip() for value in params.getlist(ORDER_EXPAND_PARAM) for name in value.split(',')}
+    return names & ORDER_EXPANSIONS.keys()
+
+
+def order_expansion_lookups(request):
+    """select_related and prefetch_related lookups for the requested expansions"""
+    select_related, prefetch_related = [], []
+    for name in get_order_expansions(request):
+        _, select, prefetch = ORDER_EXPANSIONS[name]
+        select_related.extend(select)
+        prefetch_related.extend(prefetch)
+    return tuple(select_related), tuple(prefetch_related)
+
+
+def order_list_queryset(queryset, request):
+    """Annotate totals and load only the relations OrderListSerializer will render"""
+    select_related, prefetch_related = order_expansion_lookups(request)
+    return eager_load(queryset.with_totals(), select_related, prefetch_related)
@@ -1,3 +1,306 @@
-from django.test import TestCase
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.test import override_settings
+from django.utils import timezone
+from rest_framework.test import APITestCase
+
+from products.models import Category, Product
+from users.models import Address
+from . import cart_store
+from .models import Cart, CartItem, Order, OrderItem
+
+User = get_user_model()
+
+LOCAL_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'test-default'},
+    'carts': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'test-carts'},
+}
+
+
+@override_settings(CACHES=LOCAL_CACHES, CART_PERSIST_MODE='async')
+class CartStoreTests(APITestCase):
+    """
+    Cart actions work against the cache; customer carts reach the database
+    on write-back, and anonymous carts merge into the account on login.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('shopper', 'shopper@example.com', 'password')
+        category = Category.objects.create(name='Carts')
+        cls.product = Product.objects.create(
+            name='Mug', slug='mug', description='A mug', price=Decimal('8.00'),
+            category=category, inventory=10,
+        )
+        cls.other = Product.objects.create(
+            name='Cup', slug='cup', description='A cup', price=Decimal('5.00'),
+            category=category, inventory=10,
+        )
+        cls.address = Address.objects.create(
+            user=cls.user, address_type='shipping', street_address='1 Main St',
+            city='Springfield', state='IL', country='US', zip_code='62701',
+        )
+
+    def setUp(self):
+        for cache in caches.all():
+            cache.clear()
+
+    def test_mutations_write_back_asynchronously(self):
+        self.client.force_authenticate(self.user)
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.client.post('/api/cart/add_item/', {'product_id': self.product.id, 'quantity': 2})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['total_items'], 2)
+        self.assertEqual(len(callbacks), 1)
+        self.assertFalse(CartItem.objects.exists())
+
+        item_id = response.data['items'][0]['id']
+        response = self.client.post('/api/cart/update_item/', {'cart_item_id': item_id, 'quantity': 5})
+        self.assertEqual(response.data['total_price'], '40.00')
+
+        cart_store.flush_cart(self.user)
+        item = CartItem.objects.get()
+        self.assertEqual((item.id, item.product_id, item.quantity), (item_id, self.product.id, 5))
+
+    def test_anonymous_cart_merges_on_login(self):
+        response = self.client.post('/api/cart/add_item/', {'product_id': self.product.id})
+        self.assertEqual(response.status_code, 200)
+        token = response['X-Cart-Token']
+        response = self.client.post(
+            '/api/cart/add_item/', {'product_id': self.other.id, 'quantity': 3}, HTTP_X_CART_TOKEN=token,
+        )
+        self.assertEqual(response.data['total_items'], 4)
+
+        self.client.force_authenticate(self.user)
+        self.client.post('/api/cart/add_item/', {'product_id': self.product.id, 'quantity': 1})
+        response = self.client.post('/api/token/', {
+            'username': 'shopper', 'password': 'password', 'cart_token': token,
+        })
+        self.assertEqual(response.status_code, 200)
+
+        response = self.client.get('/api/cart/my_cart/')
+        quantities = {item['product']['id']: item['quantity'] for item in response.data['items']}
+        self.assertEqual(quantities, {self.product.id: 2, self.other.id: 3})
+        self.assertIsNone(caches['carts'].get(cart_store.cart_key(cart_store.anonymous_owner(token))))
+
+    def test_unknown_line_is_not_found(self):
+        self.client.force_authenticate(self.user)
+        response = self.client.post('/api/cart/remove_item/', {'cart_item_id': 999999})
+        self.assertEqual(response.status_code, 404)
+
+    def test_invalid_quantities_are_rejected(self):
+        self.client.force_authenticate(self.user)
+        for data in [{'quantity': 'two'}, {'quantity': 0}, {'quantity': -3}, {'product_id': 'x', 'quantity': 1}]:
+            with self.subTest(data=data):
+                response = self.client.post('/api/cart/add_item/', {'product_id': self.product.id, **data})
+                self.assertEqual(response.status_code, 400)
+
+        item_id = self.client.post('/api/cart/add_item/', {'product_id': self.product.id}).data['items'][0]['id']
+        for quantity in ['many', -1]:
+            with self.subTest(quantity=quantity):
+                response = self.client.post('/api/cart/update_item/', {'cart_item_id': item_id, 'quantity': quantity})
+                self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.post('/api/cart/remove_item/', {'cart_item_id': 'abc'}).status_code, 400)
+
+        response = self.client.post('/api/cart/update_item/', {'cart_item_id': item_id, 'quantity': 0})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['items'], [])
+
+    def test_batch_applies_all_operations_in_one_render(self):
+        self.client.force_authenticate(self.user)
+        response = self.client.post('/api/cart/add_item/', {'product_id': self.product.id, 'quantity': 2})
+        item_id = response.data['items'][0]['id']
+
+        response = self.client.post('/api/cart/batch/', {'operations': [
+            {'op': 'update', 'cart_item_id': item_id, 'quantity': 4},
+            {'op': 'add', 'product_id': self.other.id, 'quantity': 1},
+            {'op': 'add', 'product_id': self.other.id},
+        ]}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['total_items'], 6)
+        self.assertEqual(response.data['total_price'], '42.00')
+
+        cart_store.flush_cart(self.user)
+        self.assertEqual(
+            dict(CartItem.objects.values_list('product_id', 'quantity')),
+            {self.product.id: 4, self.other.id: 2},
+        )
+
+    def test_batch_is_all_or_nothing(self):
+        self.client.force_authenticate(self.user)
+        self.client.post('/api/cart/add_item/', {'product_id': self.product.id})
+        response = self.client.post('/api/cart/batch/', {'operations': [
+            {'op': 'update', 'product_id': self.product.id, 'quantity': 0},
+            {'op': 'remove', 'cart_item_id': 999999},
+        ]}, format='json')
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.data['operations'], [1])
+        self.assertEqual(self.client.get('/api/cart/my_cart/').data['total_items'], 1)
+
+    def test_busy_cart_is_a_conflict(self):
+        self.client.force_authenticate(self.user)
+        lock = f'{cart_store.cart_key(cart_store.user_owner(self.user))}:lock'
+        caches['carts'].set(lock, 'other-worker', 60)
+        with mock.patch.object(cart_store, 'LOCK_TIMEOUT', 0.05):
+            response = self.client.post('/api/cart/add_item/', {'product_id': self.product.id})
+        self.assertEqual(response.status_code, 409)
+        self.assertIn('Retry-After', response)
+        # Someone else's lock is never released by the request that gave up
+        self.assertEqual(caches['carts'].get(lock), 'other-worker')
+
+    def test_write_back_queued_before_checkout_is_dropped(self):
+        self.client.force_authenticate(self.user)
+        self.client.post('/api/cart/add_item/', {'product_id': self.product.id, 'quantity': 2})
+        stale = caches['carts'].get(cart_store.cart_key(cart_store.user_owner(self.user)))
+
+        response = self.client.post('/api/orders/create_from_cart/', {
+            'shipping_address_id': self.address.id, 'billing_address_id': self.address.id,
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertFalse(CartItem.objects.exists())
+
+        # The write-back that add_item queued runs late, with the cache already cleared
+        cart_store.persist_cart(self.user.pk, stale)
+        self.assertFalse(CartItem.objects.exists())
+        self.assertEqual(self.client.get('/api/cart/my_cart/').data['total_items'], 0)
+
+    def test_anonymous_carts_need_a_cart_cache(self):
+        caches_without_carts = dict(LOCAL_CACHES, carts={'BACKEND': 'django.core.cache.backends.dummy.DummyCache'})
+        with self.settings(CACHES=caches_without_carts):
+            response = self.client.post('/api/cart/add_item/', {'product_id': self.product.id})
+            self.assertEqual(response.status_code, 401)
+
+            self.client.force_authenticate(self.user)
+            response = self.client.post('/api/cart/add_item/', {'product_id': self.product.id})
+            self.assertEqual(response.status_code, 200)
+
+
+@override_settings(CACHES=LOCAL_CACHES)
+class CheckoutTests(APITestCase):
+    """
+    Checkout decrements stock or refuses the whole order, empties the cart,
+    and cancelling puts the stock back exactly once.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('buyer', 'buyer@example.com', 'password')
+        cls.address = Address.objects.create(
+            user=cls.user, address_type='shipping', street_address='1 Main St',
+            city='Springfield', state='IL', country='US', zip_code='62701',
+        )
+        category = Category.objects.create(name='Checkout')
+        cls.mug = Product.objects.create(
+            name='Mug', slug='mug', description='A mug', price=Decimal('8.00'),
+            category=category, inventory=5,
+        )
+        cls.cup = Product.objects.create(
+            name='Cup', slug='cup', description='A cup', price=Decimal('5.00'),
+            category=category, inventory=1,
+        )
+
+    def setUp(self):
+        for cache in caches.all():
+            cache.clear()
+        self.client.force_authenticate(self.user)
+
+    def fill_cart(self, quantities):
+        cart, _ = Cart.objects.get_or_create(user=self.user)
+        for product, quantity in quantities.items():
+            CartItem.objects.create(cart=cart, product=product, quantity=quantity)
+
+    def checkout(self):
+        return self.client.post('/api/orders/create_from_cart/', {
+            'shipping_address_id': self.address.id, 'billing_address_id': self.address.id,
+        }, format='json')
+
+    def inventory(self):
+        return dict(Product.objects.values_list('id', 'inventory'))
+
+    def test_checkout_decrements_stock_and_clears_the_cart(self):
+        self.fill_cart({self.mug: 2, self.cup: 1})
+        response = self.checkout()
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Decimal(response.data['total_amount']), Decimal('21.00'))
+        self.assertEqual(self.inventory(), {self.mug.id: 3, self.cup.id: 0})
+        self.assertFalse(CartItem.objects.exists())
+        self.assertEqual(self.client.get('/api/cart/my_cart/').data['total_items'], 0)
+
+    def test_oversold_cart_is_refused_whole(self):
+        self.fill_cart({self.mug: 2, self.cup: 2})
+        response = self.checkout()
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(
+            [(item['product_id'], item['available']) for item in response.data['items']],
+            [(self.cup.id, 1)],
+        )
+        self.assertEqual(self.inventory(), {self.mug.id: 5, self.cup.id: 1})
+        self.assertEqual(CartItem.objects.count(), 2)
+        self.assertFalse(Order.objects.exists())
+
+    def test_cancel_restocks_once(self):
+        self.fill_cart({self.mug: 2, self.cup: 1})
+        order_id = self.checkout().data['id']
+        url = f'/api/orders/{order_id}/cancel_order/'
+
+        response = self.client.post(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['status'], 'cancelled')
+        self.assertEqual(self.inventory(), {self.mug.id: 5, self.cup.id: 1})
+
+        response = self.client.post(url)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.inventory(), {self.mug.id: 5, self.cup.id: 1})
+
+
+class OrderValidatorTests(APITestCase):
+    """
+    Order ETags change with the nested product, user and address data the
+    response renders, not only with the order row.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('etags', 'etags@example.com', 'password')
+        category = Category.objects.create(name='Lamps', slug='lamps')
+        cls.product = Product.objects.create(
+            name='Lamp', slug='lamp', description='A lamp', price=Decimal('10.00'), category=category,
+        )
+        cls.address = Address.objects.create(
+            user=cls.user, address_type='shipping', street_address='1 Main St',
+            city='Springfield', state='IL', country='US', zip_code='62701',
+        )
+        cls.order = Order.objects.create(user=cls.user, shipping_address=cls.address, total_amount=Decimal('10.00'))
+        OrderItem.objects.create(order=cls.order, product=cls.product, quantity=1, price=Decimal('10.00'))
+
+    def setUp(self):
+        self.client.force_authenticate(self.user)
+
+    def etag(self, url):
+        return self.client.get(url)['ETag']
+
+    def test_detail_etag_follows_nested_data(self):
+        url = f'/api/orders/{self.order.id}/'
+        etag = self.etag(url)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        for change in [
+            lambda: Product.objects.filter(pk=self.product.pk).update(name='Desk lamp', updated_at=timezone.now()),
+            lambda: Address.objects.filter(pk=self.address.pk).update(city='Shelbyville'),
+            lambda: User.objects.filter(pk=self.user.pk).update(first_name='Etta'),
+        ]:
+            change()
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+            etag = response['ETag']
+
+    def test_expanded_list_etag_follows_products(self):
+        etag = self.etag('/api/orders/?expand=items')
+        Product.objects.filter(pk=self.product.pk).update(inventory=0, updated_at=timezone.now())
+        self.assertNotEqual(self.etag('/api/orders/?expand=items'), etag)
+
+        self.assertNotIn('ETag', self.client.get('/api/orders/?expand=user'))
+        self.assertIn('ETag', self.client.get('/api/orders/'))
@@ -1,144 +1,333 @@
 from rest_framework import viewsets, permissions, status, filters
 from rest_framework.decorators import action
 from rest_framework.response import Response
+from django.db import transaction
+from django.db.models import Count, Max, Q
 from django.shortcuts import get_object_or_404
+from api.conditional import conditional_get
+from api.idempotency import idempotent
+from api.querysets import EagerLoadingMixin
 from products.models import Product
-from users.models import Address
+from users.models import Address, User
+from . import cart_store
+from .checkout import CheckoutError, checkout_cart, restock_order
 from .models import Cart, CartItem, Order, OrderItem
-from .serializers import CartSerializer, CartItemSerializer, OrderSerializer, OrderItemSerializer
+from .serializers import (
+    CartSerializer,
+    CartBatchSerializer,
+    CartItemSerializer,
+    CartOperationSerializer,
+    OrderSerializer,
+    OrderItemSerializer,
+    OrderListSerializer,
+    get_order_expansions,
+    order_expansion_lookups,
+    ORDER_SELECT_RELATED,
+    ORDER_PREFETCH_RELATED,
+)
+
+def cart_validator(view, request, *args, **kwargs):
+    """Cart version and the modification time of the products it shows"""
+    entry, products = view.get_cart_state()
+    rows = [
+        (item_id, quantity, products[product_id].updated_at)
+        for item_id, product_id, quantity in entry['lines'] if product_id in products
+    ]
+    return ('cart', view.get_cart_owner(), rows), None
+
+
+# Modification times of the products and categories order items render
+ITEM_TIMESTAMPS = {
+    'products_updated': Max('items__product__updated_at'),
+    'categories_updated': Max('items__product__category__updated_at'),
+}
+
+# User values OrderSerializer renders; users and addresses have no
+# modification time, so their values take part in the detail ETag instead
+ORDER_USER_FIELDS = ('id', 'username', 'email', 'first_name', 'last_name', 'phone_number',
+                     'date_joined', 'avatar', 'cached_avatar_url')
+
+
+def order_list_validator(view, request, *args, **kwargs):
+    expand = get_order_expansions(request)
+    if expand & {'user', 'addresses'}:
+        # Too many users and addresses to fold in; serve these expansions unconditionally
+        return None, None
+    aggregates = {'updated': Max('updated_at'), 'count': Count('id', distinct=True)}
+    if 'items' in expand:
+        aggregates.update(ITEM_TIMESTAMPS)
+    stats = view.filter_queryset(view.get_queryset()).aggregate(**aggregates)
+    return ('orders', request.user.pk, sorted(expand), sorted(stats.items())), None
+
+
+def order_detail_validator(view, request, *args, **kwargs):
+    order = view.get_queryset().filter(pk=kwargs.get('pk')).values(
+        'updated_at', 'user_id', 'shipping_address_id', 'billing_address_id',
+    ).first()
+    if order is None:
+        return None, None
+    items = OrderItem.objects.filter(order_id=kwargs.get('pk')).aggregate(
+        products_updated=Max('product__updated_at'),
+        categories_updated=Max('product__category__updated_at'),
+    )
+    user = User.objects.filter(pk=order['user_id']).values_list(*ORDER_USER_FIELDS).first()
+    addresses = list(
+        Address.objects.filter(
+            Q(user_id=order['user_id']) | Q(pk__in=[order['shipping_address_id'], order['billing_address_id']])
+        ).order_by('pk').values_list()
+    )
+    parts = ('order', request.user.pk, kwargs.get('pk'), order['updated_at'],
+             items['products_updated'], items['categories_updated'], user, addresses)
+    return parts, None
+
+
+def cart_locked_response():
+    response = Response(
+        {"detail": "The cart is being updated by another request. Try again."},
+        status=status.HTTP_409_CONFLICT
+    )
+    response['Retry-After'] = '1'
+    return response
+
 
 class CartViewSet(viewsets.ModelViewSet):
     """
     ViewSet for Cart model
+
+    The cart actions read and write through orders.cart_store. Anonymous
+    visitors get a cart token in the X-Cart-Token response header and send it
+    back on later requests; once they are authenticated the anonymous cart is
+    merged into theirs. Without a cart cache that can hold anonymous carts
+    (no Redis), the cart actions require authentication.
     """
     serializer_class = CartSerializer
     permission_classes = [permissions.IsAuthenticated]
+    cart_actions = ['my_cart', 'add_item', 'remove_item', 'update_item', 'batch', 'clear']
+    cart_token_header = 'X-Cart-Token'
+
+    def get_permissions(self):
+        if self.action in self.cart_actions and cart_store.can_store_anonymous_carts():
+            return [permissions.AllowAny()]
+        return super().get_permissions()
+
+    def handle_exception(self, exc):
+        if isinstance(exc, cart_store.CartLocked):
+            return cart_locked_response()
+        return super().handle_exception(exc)
 
     def get_queryset(self):
         return Cart.objects.filter(user=self.request.user)
 
+    def get_cart_user(self):
+        user = self.request.user
+        return user if user.is_authenticated else None
+
+    def get_cart_owner(self):
+        """Cache owner of the current cart, merging any anonymous cart into a customer's"""
+        if not hasattr(self, '_cart_owner'):
+            user = self.get_cart_user()
+            token = self.request.headers.get(self.cart_token_header)
+            if user is not None:
+                cart_store.merge_anonymous_cart(token, user)
+                self._cart_owner = cart_store.user_owner(user)
+            else:
+                self.cart_token = token or cart_store.new_cart_token()
+                self._cart_owner = cart_store.anonymous_owner(self.cart_token)
+        return self._cart_owner
+
+    def get_cart_state(self):
+        """The cart entry and its products, loaded once per request"""
+        if not hasattr(self, '_cart_state'):
+            entry, products = cart_store.load_cart(self.get_cart_owner(), self.get_cart_user())
+            if products is None:
+                products = cart_store.load_products(entry)
+            self._cart_state = entry, products
+        return self._cart_state
+
     def get_object(self):
         """
-        Get or create a cart for the current user
+        Get the current visitor's cart
         """
-        cart, created = Cart.objects.get_or_create(user=self.request.user)
-        return cart
+        entry, products = self.get_cart_state()
+        return cart_store.build_cart(entry, products, self.get_cart_user())
+
+    def cart_response(self, entry=None):
+        """Render the cart, after a mutation from the stored entry"""
+        if entry is not None:
+            self._cart_state = entry, cart_store.load_products(entry)
+        response = Response(self.get_serializer(self.get_object()).data)
+        if getattr(self, 'cart_token', None):
+            response[self.cart_token_header] = self.cart_token
+        return response
+
+    def mutate_cart(self):
+        return cart_store.mutate_cart(self.get_cart_owner(), self.get_cart_user())
+
+    def validate_operation(self, op, request):
+        """Check a single-line cart action with the rules of a batch operation"""
+        data = {'op': op}
+        for name in ['product_id', 'cart_item_id', 'quantity']:
+            if name in request.data:
+                data[name] = request.data[name]
+        serializer = CartOperationSerializer(data=data)
+        serializer.is_valid(raise_exception=True)
+        return serializer.validated_data
 
     @action(detail=False, methods=['get'])
+    @conditional_get(cart_validator, private=True)
     def my_cart(self, request):
         """
         Get the current user's cart
         """
-        cart = self.get_object()
-        serializer = self.get_serializer(cart)
-        return Response(serializer.data)
+        return self.cart_response()
 
     @action(detail=False, methods=['post'])
     def add_item(self, request):
         """
         Add an item to the cart
         """
-        cart = self.get_object()
-        product_id = request.data.get('product_id')
-        quantity = int(request.data.get('quantity', 1))
-
-        if not product_id:
+        if not request.data.get('product_id'):
             return Response(
                 {"detail": "Product ID is required."},
                 status=status.HTTP_400_BAD_REQUEST
             )
+        operation = self.validate_operation('add', request)
 
-        try:
-            product = Product.objects.get(id=product_id)
-        except Product.DoesNotExist:
+        if not Product.objects.filter(id=operation['product_id']).exists():
             return Response(
                 {"detail": "Product not found."},
                 status=status.HTTP_404_NOT_FOUND
             )
 
-        # Check if the product is already in the cart
-        cart_item, created = CartItem.objects.get_or_create(
-            cart=cart,
-            product=product,
-            defaults={'quantity': quantity}
-        )
-
-        if not created:
-            # Update quantity if the item already exists
-            cart_item.quantity += quantity
-            cart_item.save()
-
-        serializer = CartSerializer(cart)
-        return Response(serializer.data)
+        with self.mutate_cart() as entry:
+            cart_store.add_line(entry, operation['product_id'], operation.get('quantity', 1))
+        return self.cart_response(entry)
 
     @action(detail=False, methods=['post'])
     def remove_item(self, request):
         """
         Remove an item from the cart
         """
-        cart = self.get_object()
-        cart_item_id = request.data.get('cart_item_id')
-
-        if not cart_item_id:
+        if not request.data.get('cart_item_id'):
             return Response(
                 {"detail": "Cart item ID is required."},
                 status=status.HTTP_400_BAD_REQUEST
             )
+        operation = self.validate_operation('remove', request)
 
-        try:
-            cart_item = CartItem.objects.get(id=cart_item_id, cart=cart)
-            cart_item.delete()
-            serializer = CartSerializer(cart)
-            return Response(serializer.data)
-        except CartItem.DoesNotExist:
+        with self.mutate_cart() as entry:
+            line = cart_store.find_line(entry['lines'], item_id=operation['cart_item_id'])
+            if line is not None:
+                entry['lines'].remove(line)
+        if line is None:
             return Response(
                 {"detail": "Cart item not found."},
                 status=status.HTTP_404_NOT_FOUND
             )
+        return self.cart_response(entry)
 
     @action(detail=False, methods=['post'])
     def update_item(self, request):
         """
-        Update the quantity of an item in the cart
+        Update the quantity of an item in the cart; quantity 0 removes it
         """
-        cart = self.get_object()
-        cart_item_id = request.data.get('cart_item_id')
-        quantity = request.data.get('quantity')
-
-        if not cart_item_id or not quantity:
+        if not request.data.get('cart_item_id') or request.data.get('quantity') in (None, ''):
             return Response(
                 {"detail": "Cart item ID and quantity are required."},
                 status=status.HTTP_400_BAD_REQUEST
             )
+        operation = self.validate_operation('update', request)
+
+        with self.mutate_cart() as entry:
+            line = cart_store.find_line(entry['lines'], item_id=operation['cart_item_id'])
+            if line is not None and operation['quantity'] == 0:
+                entry['lines'].remove(line)
+            elif line is not None:
+                line[2] = operation['quantity']
+        if line is None:
+            return Response(
+                {"detail": "Cart item not found."},
+                status=status.HTTP_404_NOT_FOUND
+            )
+        return self.cart_response(entry)
+
+    @action(detail=False, methods=['post'])
+    def batch(self, request):
+        """
+        Apply a list of add/update/remove operations to the cart at once:
+        {"operations": [{"op": "add", "product_id": 1, "quantity": 2},
+                        {"op": "update", "cart_item_id": 7, "quantity": 3},
+                        {"op": "remove", "product_id": 4}]}
+        Either every operation applies or none does.
+        """
+        serializer = CartBatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        operations = serializer.validated_data['operations']
+
+        added = {op['product_id'] for op in operations if op['op'] == 'add'}
+        known = set(Product.objects.filter(id__in=added).values_list('id', flat=True))
+        missing = [index for index, op in enumerate(operations) if op['op'] == 'add' and op['product_id'] not in known]
+        if missing:
+            return Response(
+                {"detail": "Product not found.", "operations": missing},
+                status=status.HTTP_404_NOT_FOUND
+            )
 
         try:
-            cart_item = CartItem.objects.get(id=cart_item_id, cart=cart)
-            cart_item.quantity = int(quantity)
-            cart_item.save()
-            serializer = CartSerializer(cart)
-            return Response(serializer.data)
-        except CartItem.DoesNotExist:
+            with self.mutate_cart() as entry:
+                cart_store.apply_operations(entry, operations)
+        except cart_store.CartLineNotFound as e:
             return Response(
-                {"detail": "Cart item not found."},
+                {"detail": "Cart item not found.", "operations": [e.index]},
                 status=status.HTTP_404_NOT_FOUND
             )
+        return self.cart_response(entry)
 
     @action(detail=False, methods=['post'])
     def clear(self, request):
         """
         Clear all items from the cart
         """
-        cart = self.get_object()
-        cart.items.all().delete()
-        serializer = CartSerializer(cart)
-        return Response(serializer.data)
+        with self.mutate_cart() as entry:
+            entry['lines'] = []
+        return self.cart_response(entry)
 
-class OrderViewSet(viewsets.ModelViewSet):
+class OrderListMixin:
+    """
+    Viewset mixin serving the list action with the compact OrderListSerializer:
+    totals come from annotations and relations are only loaded when the
+    client asks for them with ``?expand=``. Goes before EagerLoadingMixin.
+    """
+
+    def get_serializer_class(self):
+        if self.action == 'list':
+            return OrderListSerializer
+        return super().get_serializer_class()
+
+    def get_select_related_fields(self):
+        if self.action == 'list':
+            return order_expansion_lookups(self.request)[0]
+        return super().get_select_related_fields()
+
+    def get_prefetch_related_fields(self):
+        if self.action == 'list':
+            return order_expansion_lookups(self.request)[1]
+        return super().get_prefetch_related_fields()
+
+    def paginate_queryset(self, queryset):
+        if self.action == 'list':
+            queryset = queryset.with_totals()
+        return super().paginate_queryset(queryset)
+
+
+class OrderViewSet(OrderListMixin, EagerLoadingMixin, viewsets.ModelViewSet):
     """
     ViewSet for Order model
     """
     serializer_class = OrderSerializer
     permission_classes = [permissions.IsAuthenticated]
+    select_related_fields = ORDER_SELECT_RELATED
+    prefetch_related_fields = ORDER_PREFETCH_RELATED
     filter_backends = [filters.OrderingFilter]
     ordering_fields = ['created_at', 'status']
     ordering = ['-created_at']
@@ -157,29 +346,27 @@ class OrderViewSet(viewsets.ModelViewSet):
             return Order.objects.all()
         return Order.objects.filter(user=user)
 
+    def handle_exception(self, exc):
+        if isinstance(exc, cart_store.CartLocked):
+            return cart_locked_response()
+        return super().handle_exception(exc)
+
+    @conditional_get(order_list_validator, private=True)
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @conditional_get(order_detail_validator, private=True)
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
     @action(detail=False, methods=['post'])
+    @idempotent('checkout')
     def create_from_cart(self, request):
         """
         Create a new order from the user's cart
         """
         user = request.user
 
-        # Get the user's cart
-        try:
-            cart = Cart.objects.get(user=user)
-        except Cart.DoesNotExist:
-            return Response(
-                {"detail": "Cart not found."},
-                status=status.HTTP_404_NOT_FOUND
-            )
-
-        # Check if the cart is empty
-        if cart.items.count() == 0:
-            return Response(
-                {"detail": "Cannot create order from empty cart."},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-
         # Get shipping and billing addresses
         shipping_address_id = request.data.get('shipping_address_id')
         billing_address_id = request.data.get('billing_address_id')
@@ -193,30 +380,21 @@ class OrderViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_404_NOT_FOUND
             )
 
-        # Calculate total amount
-        total_amount = cart.total_price
-
-        # Create the order
-        order = Order.objects.create(
-            user=user,
-            shipping_address=shipping_address,
-            billing_address=billing_address,
-            total_amount=total_amount,
-            shipping_cost=0  # You can calculate shipping cost based on your business logic
-        )
-
-        # Create order items from cart items
-        for cart_item in cart.items.all():
-            OrderItem.objects.create(
-                order=order,
-                product=cart_item.product,
-                quantity=cart_item.quantity,
-                price=cart_item.product.price
-            )
-
-        # Clear the cart
-        cart.items.all().delete()
-
+        # Checkout reads the cart from the database; the cart stays locked
+        # until it is cleared, so no mutation or write-back can slip in
+        with cart_store.checkout_lock(user):
+            try:
+                order = checkout_cart(
+                    user,
+                    shipping_address,
+                    billing_address,
+                    shipping_cost=0  # You can calculate shipping cost based on your business logic
+                )
+            except CheckoutError as e:
+                return Response(e.as_response_data(), status=e.status_code)
+            cart_store.forget_cart(user)
+
+        order = self.eager_load(Order.objects.filter(pk=order.pk)).get()
         serializer = OrderSerializer(order, context={'request': request})
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
@@ -227,16 +405,21 @@ class OrderViewSet(viewsets.ModelViewSet):
         """
         order = self.get_object()
 
-        # Check if the order can be cancelled
-        if order.status in ['delivered', 'cancelled']:
-            return Response(
-                {"detail": f"Cannot cancel order with status '{order.status}'."},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-
-        # Update order status to cancelled
-        order.status = 'cancelled'
-        order.save()
+        with transaction.atomic():
+            # Re-read the status under lock, so two cancellations can't both restock
+            current = Order.objects.select_for_update().filter(pk=order.pk).values_list('status', flat=True).get()
+
+            # Check if the order can be cancelled
+            if current in ['delivered', 'cancelled']:
+                return Response(
+                    {"detail": f"Cannot cancel order with status '{current}'."},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+
+            # Update order status to cancelled and return its items to stock
+            restock_order(order)
+            order.status = 'cancelled'
+            order.save()
 
         serializer = self.get_serializer(order, context={'request': request})
         return Response(serializer.data)
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Payment, StripePayment
+from .models import Payment, StripeEvent, StripePayment
 
 class StripePaymentInline(admin.StackedInline):
     model = StripePayment
@@ -13,3 +13,10 @@ class PaymentAdmin(admin.ModelAdmin):
     date_hierarchy = 'created_at'
     inlines = [StripePaymentInline]
     list_select_related = ('user', 'order')
+
+@admin.register(StripeEvent)
+class StripeEventAdmin(admin.ModelAdmin):
+    list_display = ('event_id', 'event_type', 'created', 'received_at', 'processed_at', 'attempts')
+    list_filter = ('event_type', 'processed_at')
+    search_fields = ('event_id',)
+    readonly_fields = ('event_id', 'event_type', 'payload', 'created', 'received_at')
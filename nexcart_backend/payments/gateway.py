@@ -0,0 +1,291 @@
+import random
+import threading
+import time
+import uuid
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+from django.conf import settings
+
+PaymentIntent = namedtuple('PaymentIntent', ['id', 'client_secret', 'status', 'amount'])
+
+
+class PaymentGatewayError(Exception):
+    """The provider rejected the request (bad request, card error, ...)"""
+
+
+class PaymentGatewayUnavailable(PaymentGatewayError):
+    """
+    The provider could not be reached in time: the circuit is open, every
+    provider slot is busy, or the deadline passed. Safe to retry later.
+    """
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TransientGatewayError(Exception):
+    """Raised by gateway backends for failures worth retrying (timeouts, 5xx, rate limits)"""
+
+
+class CircuitBreaker:
+    """
+    Per-process circuit breaker. After ``failure_threshold`` consecutive
+    transient failures the circuit opens and calls fail fast for
+    ``reset_timeout`` seconds; then a single trial call is let through and
+    its outcome closes or re-opens the circuit.
+    """
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+        self.lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return 'half-open'
+        return 'open'
+
+    def retry_after(self):
+        if self.opened_at is None:
+            return 0
+        return max(0, int(self.reset_timeout - (time.monotonic() - self.opened_at)) + 1)
+
+    def allow(self):
+        with self.lock:
+            state = self.state
+            if state == 'closed':
+                return True
+            if state == 'half-open' and not self.trial_running:
+                self.trial_running = True
+                return True
+            return False
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_running = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.trial_running or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+            self.trial_running = False
+
+
+class PaymentGateway:
+    """
+    Base class for payment providers. Public methods run the backend call on a
+    bounded thread pool and wait at most ``deadline`` seconds for it, retrying
+    transient failures with jittered exponential backoff behind a circuit
+    breaker. A slow provider therefore costs a request at most the deadline,
+    and at most ``max_concurrency`` requests per process wait on it at once.
+
+    Subclasses implement the ``_create_payment_intent`` style backend methods
+    and raise TransientGatewayError for failures worth retrying.
+    """
+    backoff_base = 0.2
+
+    def __init__(self, deadline=None, max_retries=None, max_concurrency=None,
+                 failure_threshold=None, reset_timeout=None):
+        self.deadline = deadline if deadline is not None else settings.PAYMENT_GATEWAY_DEADLINE
+        self.max_retries = max_retries if max_retries is not None else settings.PAYMENT_GATEWAY_MAX_RETRIES
+        max_concurrency = max_concurrency or settings.PAYMENT_GATEWAY_MAX_CONCURRENCY
+        self.breaker = CircuitBreaker(
+            failure_threshold or settings.PAYMENT_GATEWAY_FAILURE_THRESHOLD,
+            reset_timeout or settings.PAYMENT_GATEWAY_RESET_TIMEOUT,
+        )
+        self.slots = threading.BoundedSemaphore(max_concurrency)
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix='payment-gateway')
+
+    def create_payment_intent(self, amount, currency, metadata=None, idempotency_key=None):
+        """Create a payment intent for ``amount`` in the currency's smallest unit"""
+        return self.call(self._create_payment_intent, amount, currency, metadata or {}, idempotency_key)
+
+    def retrieve_payment_intent(self, intent_id):
+        return self.call(self._retrieve_payment_intent, intent_id)
+
+    def retrieve_payment_intents(self, intent_ids):
+        """
+        Look up many intents at once, for batch jobs. The calls run on the same
+        bounded pool but queue for a free thread instead of failing fast.
+        Returns {intent_id: PaymentIntent or PaymentGatewayError}.
+        """
+        futures = {
+            intent_id: self.executor.submit(self.run_batch_call, self._retrieve_payment_intent, (intent_id,))
+            for intent_id in intent_ids
+        }
+        results = {}
+        for intent_id, future in futures.items():
+            try:
+                results[intent_id] = future.result()
+            except PaymentGatewayError as e:
+                results[intent_id] = e
+        return results
+
+    def _create_payment_intent(self, amount, currency, metadata, idempotency_key):
+        raise NotImplementedError
+
+    def _retrieve_payment_intent(self, intent_id):
+        raise NotImplementedError
+
+    def call(self, method, *args):
+        # Take a slot first: a half-open trial let through by the breaker
+        # must reach run_with_retries, which always reports its outcome
+        if not self.slots.acquire(blocking=False):
+            raise PaymentGatewayUnavailable("Payment provider is busy, please retry shortly.", 1)
+        if not self.breaker.allow():
+            self.slots.release()
+            raise PaymentGatewayUnavailable(
+                "Payment provider is unavailable, please retry shortly.", self.breaker.retry_after()
+            )
+
+        deadline = time.monotonic() + self.deadline
+        future = self.executor.submit(self.run_with_retries, method, args, deadline)
+        future.add_done_callback(lambda _: self.slots.release())
+        try:
+            return future.result(timeout=self.deadline)
+        except FutureTimeoutError:
+            # The call finishes in the background; idempotency keys make the retry safe
+            raise PaymentGatewayUnavailable("Payment provider timed out, please retry.", 1)
+
+    def run_batch_call(self, method, args):
+        if not self.breaker.allow():
+            raise PaymentGatewayUnavailable("Payment provider is unavailable.", self.breaker.retry_after())
+        return self.run_with_retries(method, args, time.monotonic() + self.deadline)
+
+    def run_with_retries(self, method, args, deadline):
+        attempt = 0
+        while True:
+            try:
+                result = method(*args)
+            except TransientGatewayError as e:
+                self.breaker.record_failure()
+                delay = self.backoff_base * (2 ** attempt) * (0.5 + random.random())
+                attempt += 1
+                if (attempt > self.max_retries or time.monotonic() + delay >= deadline
+                        or not self.breaker.allow()):
+                    raise PaymentGatewayUnavailable(str(e) or "Payment provider error, please retry.", 1)
+                time.sleep(delay)
+            except PaymentGatewayError:
+                # The provider answered, it just said no
+                self.breaker.record_success()
+                raise
+            except Exception:
+                # Unknown errors count as failures, which also ends a half-open trial
+                self.breaker.record_failure()
+                raise
+            else:
+                self.breaker.record_success()
+                return result
+
+
+class StripeGateway(PaymentGateway):
+    """Stripe backend with a per-request HTTP timeout; retries are ours, not the SDK's"""
+
+    def __init__(self, **kwargs):
+        import stripe
+
+        super().__init__(**kwargs)
+        self.stripe = stripe
+        stripe.api_key = settings.STRIPE_SECRET_KEY
+        stripe.max_network_retries = 0
+        stripe.default_http_client = stripe.http_client.RequestsClient(timeout=settings.STRIPE_TIMEOUT)
+
+    def translate(self, error):
+        stripe = self.stripe
+        transient = (stripe.error.APIConnectionError, stripe.error.RateLimitError, stripe.error.APIError)
+        if isinstance(error, transient):
+            return TransientGatewayError(str(error))
+        return PaymentGatewayError(str(error))
+
+    def intent(self, payment_intent):
+        return PaymentIntent(
+            payment_intent.id, payment_intent.client_secret, payment_intent.status, payment_intent.amount
+        )
+
+    def _create_payment_intent(self, amount, currency, metadata, idempotency_key):
+        try:
+            return self.intent(self.stripe.PaymentIntent.create(
+                amount=amount,
+                currency=currency,
+                metadata=metadata,
+                idempotency_key=idempotency_key,
+            ))
+        except self.stripe.error.StripeError as e:
+            raise self.translate(e) from e
+
+    def _retrieve_payment_intent(self, intent_id):
+        try:
+            return self.intent(self.stripe.PaymentIntent.retrieve(intent_id))
+        except self.stripe.error.StripeError as e:
+            raise self.translate(e) from e
+
+
+class FakeGateway(PaymentGateway):
+    """
+    In-memory gateway for tests, local development and benchmarks. ``latency``
+    (seconds) and ``failure_rate`` (0-1, transient failures) simulate a
+    degraded provider; created intents are kept in ``intents``.
+    """
+
+    def __init__(self, latency=None, failure_rate=None, **kwargs):
+        super().__init__(**kwargs)
+        self.latency = latency if latency is not None else settings.PAYMENT_GATEWAY_FAKE_LATENCY
+        self.failure_rate = failure_rate if failure_rate is not None else settings.PAYMENT_GATEWAY_FAKE_FAILURE_RATE
+        self.intents = {}
+        self.keys = {}
+        self.lock = threading.Lock()
+
+    def simulate(self):
+        if self.latency:
+            time.sleep(self.latency)
+        if self.failure_rate and random.random() < self.failure_rate:
+            raise TransientGatewayError("Simulated provider failure.")
+
+    def _create_payment_intent(self, amount, currency, metadata, idempotency_key):
+        self.simulate()
+        with self.lock:
+            if idempotency_key in self.keys:
+                return self.intents[self.keys[idempotency_key]]
+            intent_id = f'pi_fake_{uuid.uuid4().hex[:24]}'
+            intent = PaymentIntent(intent_id, f'{intent_id}_secret_{uuid.uuid4().hex[:12]}', 'requires_payment_method', amount)
+            self.intents[intent_id] = intent
+            if idempotency_key:
+                self.keys[idempotency_key] = intent_id
+            return intent
+
+    def _retrieve_payment_intent(self, intent_id):
+        self.simulate()
+        try:
+            return self.intents[intent_id]
+        except KeyError:
+            raise PaymentGatewayError(f"No such payment_intent: '{intent_id}'")
+
+
+GATEWAYS = {
+    'stripe': StripeGateway,
+    'fake': FakeGateway,
+}
+
+_gateways = {}
+_gateways_lock = threading.Lock()
+
+
+def get_payment_gateway():
+    """The process-wide gateway selected by settings.PAYMENT_GATEWAY"""
+    name = settings.PAYMENT_GATEWAY
+    gateway = _gateways.get(name)
+    if gateway is None:
+        with _gateways_lock:
+            gateway = _gateways.get(name)
+            if gateway is None:
+                gateway = _gateways[name] = GATEWAYS[name]()
+    return gateway
@@ -0,0 +1,32 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from payments.webhooks import process_pending_events
+
+
+class Command(BaseCommand):
+    help = 'Apply pending Stripe webhook events to payments and orders in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help='Events per transaction (default: STRIPE_EVENT_BATCH_SIZE)')
+        parser.add_argument('--loop', action='store_true',
+                            help='Keep running, polling for new events')
+        parser.add_argument('--interval', type=float, default=1.0,
+                            help='Seconds to wait when the inbox is empty (with --loop)')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        total = 0
+        while True:
+            processed = process_pending_events(batch_size)
+            total += processed
+            if processed:
+                continue
+            if not options['loop']:
+                break
+            close_old_connections()
+            time.sleep(options['interval'])
+        self.stdout.write(f'{total} Stripe events processed')
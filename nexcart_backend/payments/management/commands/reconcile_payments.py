@@ -0,0 +1,50 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+
+from payments.gateway import PaymentGatewayUnavailable, get_payment_gateway
+from payments.reconciliation import pending_lag, reconcile_pending_payments
+
+
+class Command(BaseCommand):
+    help = 'Settle pending payments by checking their intents with the payment provider'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=200,
+                            help='Payments checked and updated per chunk')
+        parser.add_argument('--min-age', type=int, default=30,
+                            help='Only check payments older than this many minutes')
+        parser.add_argument('--abandon-after', type=int, default=24,
+                            help='Fail payments whose checkout is still open after this many hours')
+
+    def handle(self, *args, **options):
+        gateway = get_payment_gateway()
+        started = time.monotonic()
+
+        def report(counts):
+            elapsed = time.monotonic() - started
+            self.stdout.write(
+                f"checked {counts['checked']}: {counts['completed']} completed, {counts['failed']} failed, "
+                f"{counts['unchanged']} unchanged, {counts['errors']} errors ({elapsed:.1f}s elapsed)"
+            )
+
+        try:
+            totals = reconcile_pending_payments(
+                gateway,
+                chunk_size=options['chunk_size'],
+                min_age=timedelta(minutes=options['min_age']),
+                abandon_after=timedelta(hours=options['abandon_after']),
+                on_chunk=report,
+            )
+        except PaymentGatewayUnavailable as e:
+            raise CommandError(f'Payment provider unavailable, stopping: {e}')
+
+        elapsed = time.monotonic() - started
+        rate = totals['checked'] / elapsed if elapsed else 0
+        self.stdout.write(self.style.SUCCESS(
+            f"{totals['checked']} pending payments checked in {elapsed:.1f}s ({rate:.1f}/s): "
+            f"{totals['completed']} completed, {totals['failed']} failed, "
+            f"{totals['unchanged']} unchanged, {totals['errors']} errors"
+        ))
+        self.stdout.write(f'Oldest pending payment: {pending_lag().total_seconds() / 60:.0f} minutes old')
@@ -28,6 +28,12 @@ class Payment(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            # Keeps the reconciliation scan proportional to the pending backlog
+            models.Index(fields=['id'], name='payment_pending_idx', condition=models.Q(status='pending')),
+        ]
+
     def __str__(self):
         return f"Payment {self.id} for Order {self.order.id}"
 
@@ -42,3 +48,29 @@ class StripePayment(models.Model):
 
     def __str__(self):
         return f"Stripe Payment for {self.payment}"
+
+class StripeEvent(models.Model):
+    """
+    Append-only inbox of verified Stripe webhook events. The webhook only
+    inserts (dropping redeliveries on the unique event id); the
+    process_stripe_events worker applies pending events in batches.
+    """
+    event_id = models.CharField(max_length=255, unique=True)
+    event_type = models.CharField(max_length=100)
+    payload = models.JSONField()
+    created = models.DateTimeField(help_text='When Stripe created the event')
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['created', 'id'], name='stripe_event_pending_idx',
+                condition=models.Q(processed_at__isnull=True),
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.event_type} {self.event_id}"
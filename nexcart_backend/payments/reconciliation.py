@@ -0,0 +1,131 @@
+"""
+Reconciliation of pending payments against the payment provider.
+
+Pending payments are scanned in id order with keyset pagination over the
+partial ``payment_pending_idx`` index. Each chunk's intents are looked up
+concurrently on the gateway's bounded pool, then the resulting status
+changes are applied in one short transaction with bulk updates.
+"""
+
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from orders.models import Order
+from .gateway import PaymentGatewayUnavailable
+from .models import Payment
+from .webhooks import set_payment_status
+
+# Intent statuses that settle a pending payment
+SETTLED_STATUSES = {
+    'succeeded': 'completed',
+    'canceled': 'failed',
+}
+
+# Intent statuses of a checkout the customer may still finish
+OPEN_STATUSES = {'requires_payment_method', 'requires_confirmation', 'requires_action'}
+
+
+def pending_payments(after_id, chunk_size, older_than):
+    return list(
+        Payment.objects
+        .filter(status='pending', id__gt=after_id, created_at__lt=older_than)
+        .select_related('stripe_payment')
+        .order_by('id')[:chunk_size]
+    )
+
+
+def target_status(payment, intent, abandoned_before):
+    """The status a pending payment should move to, or None to leave it"""
+    if intent.status in SETTLED_STATUSES:
+        return SETTLED_STATUSES[intent.status]
+    if intent.status in OPEN_STATUSES and payment.created_at < abandoned_before:
+        # If the customer pays after all, the succeeded webhook completes it
+        return 'failed'
+    return None
+
+
+def apply_statuses(statuses):
+    """
+    Apply {payment_id: status} in one transaction. Rows are re-read under
+    lock, so a payment the webhook worker settled meanwhile is left alone.
+    Returns the updated payments.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        payments = list(
+            Payment.objects.select_for_update().select_related('order')
+            .filter(id__in=statuses, status='pending').order_by('id')
+        )
+        changed = []
+        for payment in payments:
+            changed.extend(set_payment_status(payment, statuses[payment.id], now))
+        updated = [obj for obj in changed if isinstance(obj, Payment)]
+        Payment.objects.bulk_update(updated, ['status', 'updated_at'])
+        Order.objects.bulk_update([obj for obj in changed if isinstance(obj, Order)], ['payment_status', 'updated_at'])
+    return updated
+
+
+def reconcile_chunk(gateway, payments, abandoned_before):
+    """
+    Check one chunk of pending payments with the provider and apply the
+    outcome. Returns counts by outcome; raises PaymentGatewayUnavailable when
+    the provider is down, since the rest of the run would fail the same way.
+    """
+    by_intent = {
+        payment.stripe_payment.stripe_payment_intent_id: payment
+        for payment in payments
+        if hasattr(payment, 'stripe_payment') and payment.stripe_payment.stripe_payment_intent_id
+    }
+    counts = {'checked': len(payments), 'completed': 0, 'failed': 0, 'unchanged': 0, 'errors': 0}
+    counts['unchanged'] = len(payments) - len(by_intent)
+
+    statuses = {}
+    for intent_id, result in gateway.retrieve_payment_intents(list(by_intent)).items():
+        if isinstance(result, PaymentGatewayUnavailable):
+            raise result
+        if isinstance(result, Exception):
+            counts['errors'] += 1
+            continue
+        payment = by_intent[intent_id]
+        status = target_status(payment, result, abandoned_before)
+        if status is None:
+            counts['unchanged'] += 1
+        else:
+            statuses[payment.id] = status
+
+    for payment in apply_statuses(statuses):
+        counts[payment.status] += 1
+    counts['unchanged'] += len(statuses) - counts['completed'] - counts['failed']
+    return counts
+
+
+def reconcile_pending_payments(gateway, chunk_size, min_age, abandon_after, on_chunk=None):
+    """
+    Walk every pending payment older than ``min_age`` in chunks of
+    ``chunk_size``; payments whose checkout is still open are failed once
+    older than ``abandon_after``. ``on_chunk(counts)`` is called after each
+    chunk. Returns the totals.
+    """
+    now = timezone.now()
+    older_than = now - min_age
+    abandoned_before = now - abandon_after
+    totals = {'checked': 0, 'completed': 0, 'failed': 0, 'unchanged': 0, 'errors': 0}
+    after_id = 0
+    while True:
+        payments = pending_payments(after_id, chunk_size, older_than)
+        if not payments:
+            return totals
+        counts = reconcile_chunk(gateway, payments, abandoned_before)
+        for name, value in counts.items():
+            totals[name] += value
+        if on_chunk is not None:
+            on_chunk(counts)
+        after_id = payments[-1].id
+
+
+def pending_lag():
+    """Age of the oldest pending payment (zero when there is none)"""
+    oldest = Payment.objects.filter(status='pending').order_by('id').values_list('created_at', flat=True).first()
+    return timezone.now() - oldest if oldest else timedelta(0)
@@ -1,3 +1,270 @@
-from django.test import TestCase
+import hashlib
+import hmac
+import json
+import time
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import SimpleTestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APITestCase
+
+from orders.models import Order
+from . import gateway
+from .gateway import FakeGateway, PaymentGatewayError, PaymentGatewayUnavailable
+from .models import Payment, StripeEvent, StripePayment
+from .webhooks import process_pending_events
+
+User = get_user_model()
+
+
+class PaymentGatewayTests(SimpleTestCase):
+    """
+    Provider calls are retried, bounded by a deadline, and short-circuited
+    while the provider keeps failing.
+    """
+
+    def gateway(self, **options):
+        options.setdefault('deadline', 2)
+        options.setdefault('max_retries', 2)
+        options.setdefault('failure_threshold', 3)
+        options.setdefault('reset_timeout', 30)
+        fake = FakeGateway(**options)
+        fake.backoff_base = 0
+        return fake
+
+    def test_idempotency_key_returns_the_same_intent(self):
+        fake = self.gateway()
+        first = fake.create_payment_intent(1000, 'usd', idempotency_key='order-1')
+        second = fake.create_payment_intent(1000, 'usd', idempotency_key='order-1')
+        self.assertEqual(first, second)
+        self.assertEqual(fake.retrieve_payment_intent(first.id).amount, 1000)
+
+    def test_transient_failures_are_retried(self):
+        fake = self.gateway()
+        with mock.patch.object(fake, 'simulate', side_effect=[gateway.TransientGatewayError('down'), None]):
+            intent = fake.create_payment_intent(1000, 'usd')
+        self.assertTrue(intent.id.startswith('pi_fake_'))
+        self.assertEqual(fake.breaker.state, 'closed')
+
+    def test_circuit_opens_and_fails_fast(self):
+        fake = self.gateway(failure_rate=1)
+        with self.assertRaises(PaymentGatewayUnavailable):
+            fake.create_payment_intent(1000, 'usd')
+        self.assertEqual(fake.breaker.state, 'open')
+
+        fake.failure_rate = 0
+        with mock.patch.object(fake, 'simulate') as simulate:
+            with self.assertRaises(PaymentGatewayUnavailable) as raised:
+                fake.create_payment_intent(1000, 'usd')
+        simulate.assert_not_called()
+        self.assertGreater(raised.exception.retry_after, 0)
+
+        fake.breaker.opened_at -= 30
+        self.assertTrue(fake.create_payment_intent(1000, 'usd').id)
+        self.assertEqual(fake.breaker.state, 'closed')
+
+    def test_unexpected_errors_end_the_half_open_trial(self):
+        fake = self.gateway(failure_rate=1)
+        with self.assertRaises(PaymentGatewayUnavailable):
+            fake.create_payment_intent(1000, 'usd')
+        fake.failure_rate = 0
+
+        fake.breaker.opened_at -= 30
+        with mock.patch.object(fake, 'simulate', side_effect=RuntimeError('bug')):
+            with self.assertRaises(RuntimeError):
+                fake.create_payment_intent(1000, 'usd')
+        self.assertEqual(fake.breaker.state, 'open')
+        self.assertFalse(fake.breaker.trial_running)
+
+        fake.breaker.opened_at -= 30
+        self.assertTrue(fake.create_payment_intent(1000, 'usd').id)
+        self.assertEqual(fake.breaker.state, 'closed')
+
+    def test_busy_bulkhead_does_not_take_the_trial(self):
+        fake = self.gateway(failure_rate=1, max_concurrency=1)
+        with self.assertRaises(PaymentGatewayUnavailable):
+            fake.create_payment_intent(1000, 'usd')
+        fake.failure_rate = 0
+        fake.breaker.opened_at -= 30
+
+        fake.slots.acquire()
+        with self.assertRaises(PaymentGatewayUnavailable):
+            fake.create_payment_intent(1000, 'usd')
+        fake.slots.release()
+        self.assertFalse(fake.breaker.trial_running)
+        self.assertTrue(fake.create_payment_intent(1000, 'usd').id)
+
+    def test_slow_provider_is_cut_off_at_the_deadline(self):
+        fake = self.gateway(latency=0.5, deadline=0.1)
+        with self.assertRaises(PaymentGatewayUnavailable):
+            fake.create_payment_intent(1000, 'usd')
+
+    def test_rejections_do_not_trip_the_circuit(self):
+        fake = self.gateway(failure_threshold=1)
+        with self.assertRaises(PaymentGatewayError):
+            fake.retrieve_payment_intent('pi_missing')
+        self.assertEqual(fake.breaker.state, 'closed')
+
+
+@override_settings(PAYMENT_GATEWAY='fake')
+class CreatePaymentIntentTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('payer', 'payer@example.com', 'password')
+        cls.order = Order.objects.create(user=cls.user, total_amount=Decimal('20.00'))
+
+    def setUp(self):
+        gateway._gateways.clear()
+        self.client.force_authenticate(self.user)
+
+    def test_creates_intent_and_payment(self):
+        response = self.client.post('/api/payments/create_payment_intent/', {'order_id': self.order.id})
+        self.assertEqual(response.status_code, 200)
+        payment = Payment.objects.get(pk=response.data['payment_id'])
+        intent = gateway.get_payment_gateway().intents[payment.transaction_id]
+        self.assertEqual(response.data['client_secret'], intent.client_secret)
+        self.assertEqual(intent.amount, int(self.order.final_total * 100))
+
+    def test_unavailable_provider_is_a_503(self):
+        gateway.get_payment_gateway().breaker.opened_at = time.monotonic()
+        response = self.client.post('/api/payments/create_payment_intent/', {'order_id': self.order.id})
+        self.assertEqual(response.status_code, 503)
+        self.assertIn('Retry-After', response)
+        self.assertFalse(Payment.objects.exists())
+
+    def test_confirm_checks_the_intent_with_the_provider(self):
+        response = self.client.post('/api/payments/create_payment_intent/', {'order_id': self.order.id})
+        payment = Payment.objects.get(pk=response.data['payment_id'])
+        url = f'/api/payments/{payment.id}/confirm_payment/'
+
+        response = self.client.post(url)
+        self.assertEqual(response.status_code, 400)
+
+        fake = gateway.get_payment_gateway()
+        fake.intents[payment.transaction_id] = fake.intents[payment.transaction_id]._replace(status='succeeded')
+        response = self.client.post(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['status'], 'completed')
+        self.assertTrue(Order.objects.get(pk=self.order.pk).payment_status)
+
+
+WEBHOOK_SECRET = 'whsec_test'
+
+
+@override_settings(STRIPE_WEBHOOK_SECRET=WEBHOOK_SECRET)
+class StripeWebhookTests(APITestCase):
+    """
+    Webhooks only append to the inbox; the worker applies the events in
+    order, and redelivered or out-of-order events change nothing.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('payer', 'payer@example.com', 'password')
+        cls.order = Order.objects.create(user=cls.user, total_amount=Decimal('20.00'))
+        cls.payment = Payment.objects.create(
+            user=cls.user, order=cls.order, payment_method='stripe',
+            amount=Decimal('20.00'), transaction_id='pi_123',
+        )
+        StripePayment.objects.create(payment=cls.payment, stripe_charge_id='', stripe_payment_intent_id='pi_123')
+
+    def deliver(self, event_id, event_type, obj, created=None, secret=WEBHOOK_SECRET):
+        payload = json.dumps({
+            'id': event_id, 'type': event_type, 'created': created or int(time.time()),
+            'data': {'object': obj},
+        })
+        timestamp = int(time.time())
+        signature = hmac.new(secret.encode(), f'{timestamp}.{payload}'.encode(), hashlib.sha256).hexdigest()
+        return self.client.post(
+            '/api/payments/webhook/', payload, content_type='application/json',
+            HTTP_STRIPE_SIGNATURE=f't={timestamp},v1={signature}',
+        )
+
+    def test_rejects_bad_signatures(self):
+        response = self.deliver('evt_1', 'payment_intent.succeeded', {'id': 'pi_123'}, secret='whsec_other')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(StripeEvent.objects.exists())
+
+    def test_rejects_everything_without_a_secret(self):
+        with self.settings(STRIPE_WEBHOOK_SECRET=''):
+            response = self.deliver('evt_1', 'payment_intent.succeeded', {'id': 'pi_123'}, secret='')
+        self.assertEqual(response.status_code, 503)
+        self.assertFalse(StripeEvent.objects.exists())
+
+    def test_duplicates_are_dropped_and_events_applied_in_batches(self):
+        succeeded = {'id': 'pi_123', 'latest_charge': 'ch_1', 'customer': 'cus_1'}
+        now = int(time.time())
+        for _ in range(2):
+            response = self.deliver('evt_1', 'payment_intent.succeeded', succeeded, created=now)
+            self.assertEqual(response.status_code, 200)
+        # Delivered late, but older than the success
+        self.deliver('evt_2', 'payment_intent.payment_failed', {'id': 'pi_123'}, created=now - 10)
+        self.deliver('evt_3', 'customer.created', {'id': 'cus_1'}, created=now)
+        self.assertEqual(StripeEvent.objects.count(), 3)
+        self.assertEqual(Payment.objects.get(pk=self.payment.pk).status, 'pending')
+
+        self.assertEqual(process_pending_events(), 3)
+        payment = Payment.objects.select_related('order', 'stripe_payment').get(pk=self.payment.pk)
+        self.assertEqual(payment.status, 'completed')
+        self.assertTrue(payment.order.payment_status)
+        self.assertEqual(payment.stripe_payment.stripe_charge_id, 'ch_1')
+        self.assertFalse(StripeEvent.objects.filter(processed_at__isnull=True).exists())
+        self.assertEqual(process_pending_events(), 0)
+
+    def test_full_refund(self):
+        self.deliver('evt_1', 'payment_intent.succeeded', {'id': 'pi_123'})
+        self.deliver('evt_2', 'charge.refunded', {'id': 'ch_1', 'payment_intent': 'pi_123', 'refunded': True})
+        process_pending_events()
+        payment = Payment.objects.select_related('order').get(pk=self.payment.pk)
+        self.assertEqual(payment.status, 'refunded')
+        self.assertFalse(payment.order.payment_status)
+
+
+@override_settings(PAYMENT_GATEWAY='fake')
+class ReconciliationTests(APITestCase):
+    """Pending payments are settled from the provider's view of their intents"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('payer', 'payer@example.com', 'password')
+
+    def setUp(self):
+        gateway._gateways.clear()
+
+    def add_payment(self, intent_status, age):
+        fake = gateway.get_payment_gateway()
+        intent = fake.create_payment_intent(2000, 'usd')
+        fake.intents[intent.id] = intent._replace(status=intent_status)
+        order = Order.objects.create(user=self.user, total_amount=Decimal('20.00'))
+        payment = Payment.objects.create(
+            user=self.user, order=order, payment_method='stripe',
+            amount=Decimal('20.00'), transaction_id=intent.id,
+        )
+        StripePayment.objects.create(payment=payment, stripe_charge_id='', stripe_payment_intent_id=intent.id)
+        Payment.objects.filter(pk=payment.pk).update(created_at=timezone.now() - age)
+        return payment
+
+    def test_settles_pending_payments_in_chunks(self):
+        succeeded = self.add_payment('succeeded', timedelta(hours=1))
+        canceled = self.add_payment('canceled', timedelta(hours=1))
+        abandoned = self.add_payment('requires_payment_method', timedelta(days=2))
+        open_checkout = self.add_payment('requires_payment_method', timedelta(hours=1))
+        recent = self.add_payment('succeeded', timedelta(minutes=1))
+
+        out = StringIO()
+        call_command('reconcile_payments', '--chunk-size', '2', stdout=out)
+        self.assertIn('4 pending payments checked', out.getvalue())
+
+        statuses = dict(Payment.objects.values_list('id', 'status'))
+        self.assertEqual(statuses[succeeded.id], 'completed')
+        self.assertEqual(statuses[canceled.id], 'failed')
+        self.assertEqual(statuses[abandoned.id], 'failed')
+        self.assertEqual(statuses[open_checkout.id], 'pending')
+        self.assertEqual(statuses[recent.id], 'pending')
+        self.assertTrue(Order.objects.get(payment=succeeded).payment_status)
@@ -1,22 +1,51 @@
-import stripe
-from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db.models import Prefetch
 from django.shortcuts import get_object_or_404
 from rest_framework import viewsets, permissions, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
-from orders.models import Order
+from rest_framework.views import APIView
+from api.idempotency import idempotent
+from api.querysets import EagerLoadingMixin
+from orders.models import Order, OrderItem
+from .gateway import PaymentGatewayError, PaymentGatewayUnavailable, get_payment_gateway
 from .models import Payment, StripePayment
 from .serializers import PaymentSerializer, PaymentCreateSerializer
-
-# Configure Stripe API key
-stripe.api_key = settings.STRIPE_SECRET_KEY
-
-class PaymentViewSet(viewsets.ModelViewSet):
+from .webhooks import InvalidWebhook, complete_payment, record_event, verify_event
+
+
+def gateway_error_response(error):
+    """503 with Retry-After while the provider is unavailable, 400 when it refused"""
+    if isinstance(error, PaymentGatewayUnavailable):
+        response = Response(
+            {"detail": str(error)},
+            status=status.HTTP_503_SERVICE_UNAVAILABLE
+        )
+        if error.retry_after:
+            response['Retry-After'] = str(error.retry_after)
+        return response
+    return Response(
+        {"detail": str(error)},
+        status=status.HTTP_400_BAD_REQUEST
+    )
+
+
+class PaymentViewSet(EagerLoadingMixin, viewsets.ModelViewSet):
     """
     ViewSet for Payment model
     """
     serializer_class = PaymentSerializer
     permission_classes = [permissions.IsAuthenticated]
+    select_related_fields = (
+        'stripe_payment',
+        'order__user',
+        'order__shipping_address',
+        'order__billing_address',
+    )
+    prefetch_related_fields = (
+        'order__user__addresses',
+        Prefetch('order__items', queryset=OrderItem.objects.select_related('product__category')),
+    )
 
     def get_queryset(self):
         user = self.request.user
@@ -30,6 +59,7 @@ class PaymentViewSet(viewsets.ModelViewSet):
         return PaymentSerializer
 
     @action(detail=False, methods=['post'])
+    @idempotent('payment_intent')
     def create_payment_intent(self, request):
         """
         Create a Stripe payment intent
@@ -56,51 +86,50 @@ class PaymentViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        # Create a payment intent with Stripe
+        # Create a payment intent with the payment provider
+        amount = int(order.final_total * 100)  # Convert to cents
         try:
-            amount = int(order.final_total * 100)  # Convert to cents
-
-            payment_intent = stripe.PaymentIntent.create(
+            payment_intent = get_payment_gateway().create_payment_intent(
                 amount=amount,
                 currency='usd',
                 metadata={
                     'order_id': order.id,
                     'user_id': request.user.id
-                }
-            )
-
-            # Create a payment record
-            payment = Payment.objects.create(
-                user=request.user,
-                order=order,
-                payment_method='stripe',
-                amount=order.final_total,
-                status='pending',
-                transaction_id=payment_intent.id
-            )
-
-            # Create a Stripe payment record
-            StripePayment.objects.create(
-                payment=payment,
-                stripe_charge_id='',  # Will be updated after payment is completed
-                stripe_payment_intent_id=payment_intent.id
-            )
-
-            return Response({
-                'client_secret': payment_intent.client_secret,
-                'payment_id': payment.id
-            })
-
-        except stripe.error.StripeError as e:
-            return Response(
-                {"detail": str(e)},
-                status=status.HTTP_400_BAD_REQUEST
+                },
+                # A retry after a timeout gets the intent created by the first attempt
+                idempotency_key=f'order-{order.id}-payment-intent'
             )
+        except PaymentGatewayError as e:
+            return gateway_error_response(e)
+
+        # Create a payment record
+        payment = Payment.objects.create(
+            user=request.user,
+            order=order,
+            payment_method='stripe',
+            amount=order.final_total,
+            status='pending',
+            transaction_id=payment_intent.id
+        )
+
+        # Create a Stripe payment record
+        StripePayment.objects.create(
+            payment=payment,
+            stripe_charge_id='',  # Will be updated after payment is completed
+            stripe_payment_intent_id=payment_intent.id
+        )
+
+        return Response({
+            'client_secret': payment_intent.client_secret,
+            'payment_id': payment.id
+        })
 
     @action(detail=True, methods=['post'])
     def confirm_payment(self, request, pk=None):
         """
-        Confirm a payment after Stripe payment is completed
+        Confirm a payment after Stripe payment is completed. The intent is
+        checked with the provider; the payment_intent.succeeded webhook
+        completes it too if the client never calls this.
         """
         payment = self.get_object()
 
@@ -110,14 +139,18 @@ class PaymentViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        # Update payment status
-        payment.status = 'completed'
-        payment.save()
+        try:
+            payment_intent = get_payment_gateway().retrieve_payment_intent(payment.transaction_id)
+        except PaymentGatewayError as e:
+            return gateway_error_response(e)
 
-        # Update order payment status
-        order = payment.order
-        order.payment_status = True
-        order.save()
+        if payment_intent.status != 'succeeded':
+            return Response(
+                {"detail": "Payment has not been completed."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        complete_payment(payment)
 
         serializer = self.get_serializer(payment)
         return Response(serializer.data)
@@ -141,3 +174,29 @@ class PaymentViewSet(viewsets.ModelViewSet):
 
         serializer = self.get_serializer(payment)
         return Response(serializer.data)
+
+
+class StripeWebhookView(APIView):
+    """
+    Receives Stripe webhooks. Verified events are appended to the StripeEvent
+    inbox and acknowledged straight away; the process_stripe_events worker
+    applies them to payments and orders.
+    """
+    authentication_classes = []
+    permission_classes = [permissions.AllowAny]
+
+    def post(self, request):
+        try:
+            event = verify_event(request.body, request.headers.get('Stripe-Signature', ''))
+        except InvalidWebhook as e:
+            return Response(
+                {"detail": str(e)},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        except ImproperlyConfigured:
+            return Response(
+                {"detail": "Webhooks are not configured."},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE
+            )
+        record_event(event)
+        return Response({"received": True})
@@ -0,0 +1,180 @@
+"""
+Stripe webhook inbox.
+
+The webhook view verifies the signature, appends the event to StripeEvent
+and returns at once; redeliveries hit the unique event id and are dropped
+by the same INSERT. ``process_pending_events`` (run by the
+process_stripe_events command) then applies pending events in batches: one
+query for the events, one for the payments they touch, and one bulk update
+per table.
+"""
+
+import json
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.utils import timezone
+
+from orders.models import Order
+from .models import Payment, StripeEvent, StripePayment
+
+# Payment status each handled event type moves a payment to
+EVENT_STATUSES = {
+    'payment_intent.succeeded': 'completed',
+    'payment_intent.payment_failed': 'failed',
+    'payment_intent.canceled': 'failed',
+    'charge.refunded': 'refunded',
+}
+
+# Allowed payment status changes. Events can arrive out of order, so e.g. a
+# late payment_failed must not undo a success.
+TRANSITIONS = {
+    'pending': {'completed', 'failed'},
+    'failed': {'completed'},
+    'completed': {'refunded'},
+    'refunded': set(),
+}
+
+
+class InvalidWebhook(Exception):
+    """The request is not a correctly signed Stripe event"""
+
+
+def verify_event(payload, signature):
+    """Check the Stripe-Signature header and return the decoded event"""
+    import stripe
+
+    # Anyone can sign with an empty secret, so never accept events without one
+    if not settings.STRIPE_WEBHOOK_SECRET:
+        raise ImproperlyConfigured("STRIPE_WEBHOOK_SECRET is not set.")
+    try:
+        stripe.WebhookSignature.verify_header(
+            payload.decode('utf-8'), signature, settings.STRIPE_WEBHOOK_SECRET,
+            stripe.Webhook.DEFAULT_TOLERANCE,
+        )
+        event = json.loads(payload)
+    except (stripe.error.SignatureVerificationError, UnicodeDecodeError, ValueError) as e:
+        raise InvalidWebhook(str(e))
+    if (not isinstance(event, dict) or not event.get('id') or not event.get('type')
+            or not isinstance(event.get('created'), int)):
+        raise InvalidWebhook("Not a Stripe event.")
+    return event
+
+
+def record_event(event):
+    """Append an event to the inbox; a redelivered event is dropped by the same INSERT"""
+    created = datetime.fromtimestamp(event['created'], tz=dt_timezone.utc)
+    StripeEvent.objects.bulk_create(
+        [StripeEvent(event_id=event['id'], event_type=event['type'], payload=event, created=created)],
+        ignore_conflicts=True,
+    )
+
+
+def event_intent_id(event):
+    obj = event.payload['data']['object']
+    if event.event_type.startswith('charge.'):
+        return obj.get('payment_intent')
+    return obj.get('id')
+
+
+def set_payment_status(payment, status, now=None):
+    """
+    Move a payment (and its order's payment flag) to ``status`` if that is an
+    allowed transition. Returns the changed objects, without saving them.
+    """
+    if status not in TRANSITIONS.get(payment.status, set()):
+        return []
+    now = now or timezone.now()
+    payment.status = status
+    payment.updated_at = now
+    order = payment.order
+    order.payment_status = status == 'completed'
+    order.updated_at = now
+    return [payment, order]
+
+
+def complete_payment(payment):
+    """Mark a payment completed after the provider confirmed it"""
+    changed = set_payment_status(payment, 'completed')
+    if changed:
+        with transaction.atomic():
+            payment.save(update_fields=['status', 'updated_at'])
+            payment.order.save(update_fields=['payment_status', 'updated_at'])
+    return bool(changed)
+
+
+def apply_event(event, stripe_payments, now):
+    """Apply one event to the loaded StripePayments; returns the changed objects"""
+    status = EVENT_STATUSES.get(event.event_type)
+    if status is None:
+        return []
+    obj = event.payload['data']['object']
+    if event.event_type == 'charge.refunded' and not obj.get('refunded'):
+        return []  # partial refund
+    stripe_payment = stripe_payments.get(event_intent_id(event))
+    if stripe_payment is None:
+        return []  # not an intent this shop created
+    changed = set_payment_status(stripe_payment.payment, status, now)
+    if event.event_type == 'payment_intent.succeeded':
+        stripe_payment.stripe_charge_id = obj.get('latest_charge') or stripe_payment.stripe_charge_id
+        stripe_payment.stripe_customer_id = obj.get('customer') or stripe_payment.stripe_customer_id
+        changed.append(stripe_payment)
+    return changed
+
+
+def process_pending_events(batch_size=None):
+    """
+    Apply up to ``batch_size`` pending events in one transaction and return
+    how many were taken. Rows are locked with SKIP LOCKED, so several
+    workers can drain the inbox side by side.
+    """
+    batch_size = batch_size or settings.STRIPE_EVENT_BATCH_SIZE
+    now = timezone.now()
+    with transaction.atomic():
+        events = list(
+            StripeEvent.objects
+            .filter(processed_at__isnull=True, attempts__lt=settings.STRIPE_EVENT_MAX_ATTEMPTS)
+            .order_by('created', 'id')
+            .select_for_update(skip_locked=True)[:batch_size]
+        )
+        if not events:
+            return 0
+
+        intent_ids = set()
+        for event in events:
+            try:
+                intent_ids.add(event_intent_id(event))
+            except (KeyError, TypeError, AttributeError):
+                pass
+        stripe_payments = {
+            stripe_payment.stripe_payment_intent_id: stripe_payment
+            for stripe_payment in StripePayment.objects
+            .filter(stripe_payment_intent_id__in=intent_ids - {None})
+            .select_related('payment__order')
+        }
+
+        changed = {}
+        processed, failed = [], []
+        for event in events:
+            try:
+                for obj in apply_event(event, stripe_payments, now):
+                    changed[(type(obj), obj.pk)] = obj
+            except (KeyError, TypeError, AttributeError) as e:
+                event.attempts += 1
+                event.last_error = f'{type(e).__name__}: {e}'
+                failed.append(event)
+            else:
+                processed.append(event.pk)
+
+        objects = changed.values()
+        Payment.objects.bulk_update(
+            [obj for obj in objects if isinstance(obj, Payment)], ['status', 'updated_at'])
+        Order.objects.bulk_update(
+            [obj for obj in objects if isinstance(obj, Order)], ['payment_status', 'updated_at'])
+        StripePayment.objects.bulk_update(
+            [obj for obj in objects if isinstance(obj, StripePayment)], ['stripe_charge_id', 'stripe_customer_id'])
+        StripeEvent.objects.filter(pk__in=processed).update(processed_at=now)
+        StripeEvent.objects.bulk_update(failed, ['attempts', 'last_error'])
+    return len(events)
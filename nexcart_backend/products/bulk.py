@@ -0,0 +1,263 @@
+import codecs
+import csv
+import json
+
+from django.db import connection, transaction
+from django.utils.text import slugify
+
+from .cache import bump_catalog_version
+from .models import Category, Product
+from .serializers import ProductImportSerializer
+
+IMPORT_FORMATS = ('csv', 'ndjson')
+
+# (queryset field, column name); columns match what the importer accepts
+EXPORT_COLUMNS = [
+    ('id', 'id'),
+    ('name', 'name'),
+    ('slug', 'slug'),
+    ('description', 'description'),
+    ('price', 'price'),
+    ('discount_price', 'discount_price'),
+    ('effective_price', 'effective_price'),
+    ('category_id', 'category_id'),
+    ('category__slug', 'category'),
+    ('inventory', 'inventory'),
+    ('is_active', 'is_active'),
+    ('created_at', 'created_at'),
+    ('updated_at', 'updated_at'),
+]
+
+# Columns written on conflict; created_at keeps its original value
+UPSERT_FIELDS = [
+    'name', 'description', 'price', 'discount_price',
+    'category', 'inventory', 'is_active', 'updated_at',
+]
+
+MAX_REPORTED_ERRORS = 100
+
+
+def detect_format(upload, requested=None):
+    file_format = (requested or '').lower()
+    if not file_format:
+        name = (getattr(upload, 'name', '') or '').lower()
+        file_format = 'ndjson' if name.endswith(('.ndjson', '.jsonl')) else 'csv'
+    if file_format not in IMPORT_FORMATS:
+        raise ValueError(f"Unsupported format '{file_format}'. Use one of: {', '.join(IMPORT_FORMATS)}.")
+    return file_format
+
+
+def iter_rows(upload, file_format):
+    """
+    Yield (line_number, row_dict) from an uploaded file without reading it
+    into memory. Malformed NDJSON lines are yielded as (line_number, None).
+    """
+    lines = codecs.iterdecode(upload.chunks(), 'utf-8-sig') if hasattr(upload, 'chunks') else upload
+    if file_format == 'csv':
+        reader = csv.DictReader(line_stream(lines))
+        for row in reader:
+            yield reader.line_num, row
+    else:
+        for number, line in enumerate(line_stream(lines), start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                row = None
+            yield number, row if isinstance(row, dict) else None
+
+
+def line_stream(chunks):
+    """Re-split decoded chunks into lines, keeping line endings for the csv module"""
+    pending = ''
+    for chunk in chunks:
+        pending += chunk
+        lines = pending.splitlines(keepends=True)
+        pending = lines.pop() if lines and not lines[-1].endswith(('\n', '\r')) else ''
+        yield from lines
+    if pending:
+        yield pending
+
+
+def batched(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def upsert_batch(rows):
+    """
+    Validate a batch of rows and upsert the valid ones keyed on slug in one
+    transaction. Returns (upserted_count, errors).
+    """
+    errors = []
+    valid = []
+    for line, row in rows:
+        if row is None:
+            errors.append({'line': line, 'errors': {'non_field_errors': ['Malformed row.']}})
+            continue
+        serializer = ProductImportSerializer(data=row)
+        if serializer.is_valid():
+            valid.append((line, serializer.validated_data))
+        else:
+            errors.append({'line': line, 'errors': serializer.errors})
+
+    category_ids = {data['category_id'] for _, data in valid if data['category_id']}
+    category_slugs = {data['category'] for _, data in valid if not data['category_id']}
+    known_ids = set(Category.objects.filter(id__in=category_ids).values_list('id', flat=True))
+    ids_by_slug = dict(Category.objects.filter(slug__in=category_slugs).values_list('slug', 'id'))
+
+    products = {}
+    for line, data in valid:
+        category_id = data['category_id'] if data['category_id'] in known_ids else ids_by_slug.get(data['category'])
+        if category_id is None:
+            errors.append({'line': line, 'errors': {'category': ['Category not found.']}})
+            continue
+        slug = data.get('slug') or slugify(data['name'])
+        # Later rows for the same slug win, as they would row by row
+        products[slug] = Product(
+            name=data['name'],
+            slug=slug,
+            description=data['description'],
+            price=data['price'],
+            discount_price=data['discount_price'],
+            category_id=category_id,
+            inventory=data['inventory'],
+            is_active=data['is_active'],
+        )
+
+    if products:
+        with transaction.atomic():
+            Product.objects.bulk_create(
+                list(products.values()),
+                update_conflicts=True,
+                unique_fields=['slug'],
+                update_fields=UPSERT_FIELDS,
+            )
+            # bulk_create skips post_save, so invalidate cached catalog pages here
+            transaction.on_commit(bump_catalog_version)
+
+    return len(products), errors
+
+
+def import_products(upload, file_format, batch_size=1000):
+    """
+    Stream rows from an uploaded CSV/NDJSON file and upsert them in
+    independently committed batches. Invalid rows are reported, not fatal.
+    """
+    summary = {'processed': 0, 'upserted': 0, 'failed': 0, 'errors': []}
+    for batch in batched(iter_rows(upload, file_format), batch_size):
+        upserted, errors = upsert_batch(batch)
+        summary['processed'] += len(batch)
+        summary['upserted'] += upserted
+        summary['failed'] += len(errors)
+        room = MAX_REPORTED_ERRORS - len(summary['errors'])
+        if room > 0:
+            summary['errors'].extend(errors[:room])
+    return summary
+
+
+class Echo:
+    """File-like object whose write() just returns the value, for streaming csv.writer output"""
+    def write(self, value):
+        return value
+
+
+def export_products(queryset, file_format, chunk_size=2000):
+    """
+    Yield the products of a queryset as CSV or NDJSON lines, reading them
+    through a server-side cursor so the catalog is never held in memory.
+    """
+    fields = [field for field, _ in EXPORT_COLUMNS]
+    header = [column for _, column in EXPORT_COLUMNS]
+    rows = queryset.order_by('id').values_list(*fields).iterator(chunk_size=chunk_size)
+    if file_format == 'csv':
+        writer = csv.writer(Echo())
+        yield writer.writerow(header)
+        for row in rows:
+            yield writer.writerow(row)
+    else:
+        for row in rows:
+            yield json.dumps(dict(zip(header, row)), default=str) + '\n'
+
+
+STOCK_UPDATE_SQL = """
+UPDATE products_product AS p SET
+    inventory = COALESCE(v.inventory, p.inventory + v.inventory_delta, p.inventory),
+    price = COALESCE(v.price, p.price),
+    discount_price = CASE WHEN v.set_discount THEN v.discount_price ELSE p.discount_price END,
+    updated_at = now()
+FROM (VALUES {values}) AS v(id, inventory, inventory_delta, expected_inventory, price, set_discount, discount_price)
+WHERE p.id = v.id
+    AND (v.expected_inventory IS NULL OR p.inventory = v.expected_inventory)
+    AND (v.inventory_delta IS NULL OR p.inventory + v.inventory_delta >= 0)
+RETURNING p.id, p.inventory, p.price, p.discount_price, p.effective_price
+"""
+
+STOCK_UPDATE_ROW = '(%s::bigint, %s::integer, %s::integer, %s::integer, %s::numeric, %s::boolean, %s::numeric)'
+
+
+def apply_stock_updates(updates, chunk_size=1000):
+    """
+    Apply validated stock/price updates with set-based
+    UPDATE ... FROM (VALUES ...) statements in one transaction.
+
+    Slugs are resolved to ids with one query. Rows are locked in id order
+    before each chunk is updated. Relative inventory deltas are applied
+    against the current row value and never drive it below zero.
+    Returns one compact status dict per input row, in input order.
+    """
+    slugs = {update['slug'] for update in updates if 'id' not in update}
+    ids_by_slug = dict(Product.objects.filter(slug__in=slugs).values_list('slug', 'id'))
+
+    results = []
+    rows = {}
+    for index, update in enumerate(updates):
+        product_id = update['id'] if 'id' in update else ids_by_slug.get(update['slug'])
+        result = {'index': index, 'id': product_id, 'status': 'not_found'}
+        if product_id is not None and product_id in rows:
+            result['status'] = 'duplicate'
+        elif product_id is not None:
+            rows[product_id] = (
+                product_id,
+                update.get('inventory'),
+                update.get('inventory_delta'),
+                update.get('expected_inventory'),
+                update.get('price'),
+                'discount_price' in update,
+                update.get('discount_price'),
+            )
+            result['status'] = 'conflict'  # until the UPDATE reports the row
+        results.append(result)
+
+    applied = {}
+    with transaction.atomic(), connection.cursor() as cursor:
+        # The UPDATE's join order decides the order it locks rows in, so lock
+        # them by id first, the order checkout uses, to rule out deadlocks
+        for chunk in batched(sorted(rows.values()), chunk_size):
+            list(Product.objects.select_for_update().filter(id__in=[row[0] for row in chunk])
+                 .order_by('id').values_list('id', flat=True))
+            sql = STOCK_UPDATE_SQL.format(values=', '.join([STOCK_UPDATE_ROW] * len(chunk)))
+            cursor.execute(sql, [value for row in chunk for value in row])
+            for product_id, inventory, price, discount_price, effective_price in cursor.fetchall():
+                applied[product_id] = {
+                    'inventory': inventory,
+                    'price': price,
+                    'discount_price': discount_price,
+                    'effective_price': effective_price,
+                }
+        if applied:
+            # Raw UPDATEs skip post_save, so invalidate cached catalog pages here
+            transaction.on_commit(bump_catalog_version)
+
+    for result in results:
+        if result['status'] == 'conflict' and result['id'] in applied:
+            result['status'] = 'updated'
+            result.update(applied[result['id']])
+    return results
@@ -0,0 +1,121 @@
+import hashlib
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.response import Response
+
+CATALOG_VERSION_KEY = 'catalog:version'
+
+
+def get_catalog_cache():
+    """Return the cache backend configured for catalog responses"""
+    return caches[settings.CATALOG_CACHE_ALIAS]
+
+
+def get_catalog_version():
+    """Return the current catalog version, initialising it on first use"""
+    cache = get_catalog_cache()
+    version = cache.get(CATALOG_VERSION_KEY)
+    if version is None:
+        cache.add(CATALOG_VERSION_KEY, 1, timeout=None)
+        version = cache.get(CATALOG_VERSION_KEY, 1)
+    return version
+
+
+def bump_catalog_version():
+    """Invalidate every cached catalog response by moving to a new version"""
+    cache = get_catalog_cache()
+    try:
+        return cache.incr(CATALOG_VERSION_KEY)
+    except ValueError:
+        # Key missing (first write or evicted): any fresh value works as long
+        # as it differs from what readers may still hold
+        cache.add(CATALOG_VERSION_KEY, 1, timeout=None)
+        return cache.incr(CATALOG_VERSION_KEY)
+
+
+# Cache-busting parameters clients append that never change the response
+IGNORED_QUERY_PARAMS = {'_'}
+
+
+def normalize_query_string(query_params):
+    """Sort parameters and values and drop empty ones so equivalent URLs share a key"""
+    pairs = []
+    for key in sorted(query_params.keys()):
+        if key in IGNORED_QUERY_PARAMS:
+            continue
+        for value in sorted(query_params.getlist(key)):
+            if value != '':
+                pairs.append(f'{key}={value}')
+    return '&'.join(pairs)
+
+
+def build_cache_key(request, prefix='catalog'):
+    raw = f'{request.get_host()}{request.path}?{normalize_query_string(request.query_params)}'
+    digest = hashlib.sha1(raw.encode('utf-8')).hexdigest()
+    return f'{prefix}:v{get_catalog_version()}:{digest}'
+
+
+def catalog_cache_active(request):
+    """Whether a request is answered through the catalog cache"""
+    return (
+        settings.CATALOG_CACHE_ENABLED
+        and request.method in ('GET', 'HEAD')
+        and not request.user.is_staff
+    )
+
+
+def cache_catalog_response(view_method):
+    """
+    Cache successful GET responses of a catalog view, keyed on the normalized
+    query string and the catalog version. Staff requests always bypass the
+    cache, and nothing is cached unless CATALOG_CACHE_ENABLED is set.
+    """
+    @wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        if not catalog_cache_active(request):
+            return view_method(self, request, *args, **kwargs)
+
+        cache = get_catalog_cache()
+        key = build_cache_key(request)
+        cached = cache.get(key)
+        if cached is not None:
+            response = Response(cached)
+            response['X-Cache'] = 'HIT'
+            return response
+
+        response = view_method(self, request, *args, **kwargs)
+        if response.status_code == 200:
+            cache.set(key, response.data, settings.CATALOG_CACHE_TIMEOUT)
+        response['X-Cache'] = 'MISS'
+        return response
+
+    return wrapper
+
+
+def catalog_etag_parts(request):
+    """
+    ETag parts for a request answered through the catalog cache, computed
+    without a query: the versioned cache key plus the current cache timeout
+    window. Product and category writes bump the version; stock changes that
+    don't (checkout) reach the ETag within about the time they reach the
+    cached body.
+    """
+    return ('catalog', build_cache_key(request), int(time.time() // settings.CATALOG_CACHE_TIMEOUT))
+
+
+def versioned_validator(validator):
+    """
+    Wrap a conditional_get validator so requests answered through the catalog
+    cache are validated against the catalog version instead of the database.
+    Other requests (staff, or caching disabled) still run ``validator``.
+    """
+    @wraps(validator)
+    def wrapper(view, request, *args, **kwargs):
+        if catalog_cache_active(request):
+            return catalog_etag_parts(request), None
+        return validator(view, request, *args, **kwargs)
+
+    return wrapper
@@ -0,0 +1,69 @@
+from django.db.models import Count, Q
+
+# Default price bands as (min, max) with inclusive min and exclusive max
+DEFAULT_PRICE_BANDS = (
+    (None, 25),
+    (25, 50),
+    (50, 100),
+    (100, 250),
+    (250, None),
+)
+
+
+def price_band_filter(low, high, field='price'):
+    condition = Q()
+    if low is not None:
+        condition &= Q(**{f'{field}__gte': low})
+    if high is not None:
+        condition &= Q(**{f'{field}__lt': high})
+    return condition
+
+
+def compute_facets(queryset, price_bands=DEFAULT_PRICE_BANDS, price_field='price'):
+    """
+    Compute category, price band, stock and discount facet counts for a
+    filtered product queryset with one GROUP BY category query. The per-band
+    and per-state counts are conditional aggregates summed across categories.
+    """
+    aggregates = {
+        'total': Count('id'),
+        'in_stock': Count('id', filter=Q(inventory__gt=0)),
+        'discounted': Count('id', filter=Q(discount_price__isnull=False)),
+    }
+    for index, (low, high) in enumerate(price_bands):
+        aggregates[f'band_{index}'] = Count('id', filter=price_band_filter(low, high, price_field))
+
+    rows = list(
+        queryset.order_by()
+        .values('category_id', 'category__name')
+        .annotate(**aggregates)
+        .order_by('-total', 'category__name')
+    )
+
+    total = sum(row['total'] for row in rows)
+    in_stock = sum(row['in_stock'] for row in rows)
+    discounted = sum(row['discounted'] for row in rows)
+
+    return {
+        'total': total,
+        'categories': [
+            {'id': row['category_id'], 'name': row['category__name'], 'count': row['total']}
+            for row in rows
+        ],
+        'price_ranges': [
+            {
+                'min': low,
+                'max': high,
+                'count': sum(row[f'band_{index}'] for row in rows),
+            }
+            for index, (low, high) in enumerate(price_bands)
+        ],
+        'availability': {
+            'in_stock': in_stock,
+            'out_of_stock': total - in_stock,
+        },
+        'discount': {
+            'discounted': discounted,
+            'full_price': total - discounted,
+        },
+    }
@@ -0,0 +1,23 @@
+from rest_framework import filters
+
+
+class ProductOrderingFilter(filters.OrderingFilter):
+    """
+    OrderingFilter that sorts ``price`` by what the customer actually pays
+    (``effective_price``) and appends ``id`` so equal values page stably.
+    """
+    ordering_aliases = {'price': 'effective_price'}
+
+    def get_ordering(self, request, queryset, view):
+        ordering = super().get_ordering(request, queryset, view)
+        if not ordering:
+            return ordering
+
+        ordering = [self.resolve_alias(field) for field in ordering]
+        if not {'id', 'pk'} & {field.lstrip('-') for field in ordering}:
+            ordering.append('-id' if ordering[0].startswith('-') else 'id')
+        return ordering
+
+    def resolve_alias(self, field):
+        prefix = '-' if field.startswith('-') else ''
+        return prefix + self.ordering_aliases.get(field.lstrip('-'), field.lstrip('-'))
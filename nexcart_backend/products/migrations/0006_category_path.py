@@ -0,0 +1,50 @@
+# Generated by Django 5.0 on 2026-10-18 10:00
+
+from django.db import migrations, models
+
+
+def build_paths(apps, schema_editor):
+    """
+    Populate path/depth for existing categories, walking the tree top-down
+    """
+    Category = apps.get_model('products', 'Category')
+    categories = list(Category.objects.all())
+    children = {}
+    for category in categories:
+        children.setdefault(category.parent_id, []).append(category)
+
+    stack = [(category, '/', 0) for category in children.get(None, [])]
+    updated = []
+    while stack:
+        category, parent_path, depth = stack.pop()
+        category.path = f'{parent_path}{category.pk}/'
+        category.depth = depth
+        updated.append(category)
+        stack.extend((child, category.path, depth + 1) for child in children.get(category.pk, []))
+
+    Category.objects.bulk_update(updated, ['path', 'depth'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0005_product_search_vector'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='path',
+            field=models.CharField(blank=True, default='', editable=False, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='depth',
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(build_paths, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='category',
+            index=models.Index(fields=['path'], name='category_path_idx', opclasses=['varchar_pattern_ops']),
+        ),
+    ]
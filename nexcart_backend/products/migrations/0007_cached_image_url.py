@@ -0,0 +1,23 @@
+# Generated by Django 5.0 on 2026-10-18 10:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0006_category_path'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='cached_image_url',
+            field=models.CharField(blank=True, default='', editable=False, max_length=500),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='cached_image_url',
+            field=models.CharField(blank=True, default='', editable=False, max_length=500),
+        ),
+    ]
@@ -1,5 +1,10 @@
-from django.db import models
+from django.contrib.postgres.indexes import GinIndex, OpClass
+from django.contrib.postgres.search import SearchVectorField
+from django.db import models, transaction
+from django.db.models import F, Value
+from django.db.models.functions import Coalesce, Concat, Now, Substr, Upper
 from django.utils.text import slugify
+from api.images import refresh_image_url
 
 # Import CloudinaryField for cloud storage
 try:
@@ -22,17 +27,58 @@ class Category(models.Model):
         image = models.ImageField(upload_to='categories/', blank=True, null=True)
     parent = models.ForeignKey('self', on_delete=models.CASCADE, blank=True, null=True, related_name='children')
     is_active = models.BooleanField(default=True)
+    # Canonical image URL, recomputed whenever the category is saved
+    cached_image_url = models.CharField(max_length=500, blank=True, default='', editable=False)
+    # Materialized path of ancestor ids, e.g. "/1/5/12/", maintained in save()
+    path = models.CharField(max_length=255, blank=True, default='', editable=False)
+    depth = models.PositiveSmallIntegerField(default=0, editable=False)
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         verbose_name_plural = 'Categories'
+        indexes = [
+            models.Index(fields=['path'], name='category_path_idx', opclasses=['varchar_pattern_ops']),
+            # Serves the UPPER(name) LIKE ... that name__icontains compiles to
+            GinIndex(OpClass(Upper('name'), name='gin_trgm_ops'), name='category_name_trgm_gin'),
+        ]
 
     def __str__(self):
         return self.name
 
+    def get_descendants(self, include_self=True):
+        """Return the whole subtree rooted at this category with a single prefix query"""
+        queryset = Category.objects.filter(path__startswith=self.path)
+        if not include_self:
+            queryset = queryset.exclude(pk=self.pk)
+        return queryset
+
     def save(self, *args, **kwargs):
         if not self.slug:
             self.slug = slugify(self.name)
-        super().save(*args, **kwargs)
+
+        old_path, old_depth = self.path, self.depth
+        parent_path = self.parent.path if self.parent_id else '/'
+        if self.pk and old_path and parent_path.startswith(old_path):
+            raise ValueError("A category cannot be moved under itself or one of its subcategories.")
+
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            refresh_image_url(self)
+
+            new_path = f'{parent_path}{self.pk}/'
+            if new_path == old_path:
+                return
+            self.path = new_path
+            self.depth = new_path.count('/') - 2
+            Category.objects.filter(pk=self.pk).update(path=self.path, depth=self.depth)
+
+            # Re-root the subtree when the category moved
+            if old_path:
+                Category.objects.filter(path__startswith=old_path).exclude(pk=self.pk).update(
+                    path=Concat(Value(new_path), Substr('path', len(old_path) + 1)),
+                    depth=F('depth') + (self.depth - old_depth),
+                    updated_at=Now(),
+                )
 
 class Product(models.Model):
     """
@@ -43,16 +89,45 @@ class Product(models.Model):
     description = models.TextField()
     price = models.DecimalField(max_digits=10, decimal_places=2)
     discount_price = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True)
+    # What the customer pays, computed and stored by the database so saves,
+    # bulk upserts and raw UPDATEs all keep it current
+    effective_price = models.GeneratedField(
+        expression=Coalesce('discount_price', 'price'),
+        output_field=models.DecimalField(max_digits=10, decimal_places=2),
+        db_persist=True,
+    )
     category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='products')
     # Use CloudinaryField for permanent cloud storage
     if CLOUDINARY_AVAILABLE:
         image = CloudinaryField('image', blank=True, null=True, folder='nexcart/products')
     else:
         image = models.ImageField(upload_to='products/', blank=True, null=True)
+    # Canonical image URL, recomputed whenever the product is saved
+    cached_image_url = models.CharField(max_length=500, blank=True, default='', editable=False)
     inventory = models.PositiveIntegerField(default=0)
     is_active = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # Weighted name/description vector, maintained by a database trigger
+    search_vector = SearchVectorField(blank=True, null=True, editable=False)
+
+    class Meta:
+        indexes = [
+            GinIndex(fields=['search_vector'], name='product_search_vector_gin'),
+            GinIndex(OpClass(Upper('name'), name='gin_trgm_ops'), name='product_name_trgm_gin'),
+            # Listing hot path: category pages filtered/sorted by effective price,
+            # and the catalog-wide price, recency and name orderings (id breaks
+            # ties for keyset pagination)
+            models.Index(fields=['category', 'effective_price', 'id'], name='product_category_eprice_idx'),
+            models.Index(fields=['effective_price', 'id'], name='product_eprice_idx'),
+            models.Index(fields=['-created_at', '-id'], name='product_created_idx'),
+            models.Index(fields=['name', 'id'], name='product_name_idx'),
+            # Storefront views restricted to ?is_active=true
+            models.Index(fields=['category', 'effective_price'], name='product_active_cat_eprice_idx',
+                         condition=models.Q(is_active=True)),
+            models.Index(fields=['-created_at'], name='product_active_created_idx',
+                         condition=models.Q(is_active=True)),
+        ]
 
     def __str__(self):
         return self.name
@@ -61,5 +136,8 @@ class Product(models.Model):
         if not self.slug:
             self.slug = slugify(self.name)
         super().save(*args, **kwargs)
+        # Mirror the generated column so the saved instance can be serialized without a reload
+        self.effective_price = self.discount_price if self.discount_price is not None else self.price
+        refresh_image_url(self)
 
 # ProductImage model has been removed and images are now stored directly in the Product model
@@ -0,0 +1,131 @@
+import re
+import time
+from functools import lru_cache
+
+from django.contrib.postgres.search import (
+    SearchHeadline,
+    SearchQuery,
+    SearchRank,
+    SearchVector,
+    TrigramSimilarity,
+)
+from rest_framework import filters
+
+from .cache import get_catalog_version
+from .models import Category, Product
+
+# Text search configuration used for both the stored vectors and the queries
+SEARCH_CONFIG = 'english'
+
+# Weights applied to search fields in order of importance (name > description)
+SEARCH_WEIGHTS = ('A', 'B', 'C', 'D')
+
+TERM_RE = re.compile(r'\w+')
+
+
+def build_search_query(text):
+    """
+    Build a prefix-matching tsquery from free text, e.g. "blue sho" -> "blue:* & sho:*".
+    Returns None when the text contains no searchable terms.
+    """
+    terms = TERM_RE.findall(text or '')
+    if not terms:
+        return None
+    raw = ' & '.join(f'{term}:*' for term in terms)
+    return SearchQuery(raw, search_type='raw', config=SEARCH_CONFIG)
+
+
+class FullTextSearchFilter(filters.SearchFilter):
+    """
+    Ranked PostgreSQL full-text search behind the standard ``?search=`` parameter.
+
+    Views can set ``search_vector_field`` to a maintained, GIN-indexed
+    ``SearchVectorField``; otherwise a weighted vector is built on the fly from
+    ``search_fields``. Passing ``?highlight=true`` annotates ``search_headline``
+    with the matched terms wrapped in ``<mark>`` tags.
+    """
+    highlight_param = 'highlight'
+
+    def get_search_vector(self, view, request):
+        field = getattr(view, 'search_vector_field', None)
+        if field:
+            return field
+        search_fields = self.get_search_fields(view, request) or []
+        vectors = [
+            SearchVector(name, weight=weight, config=SEARCH_CONFIG)
+            for name, weight in zip(search_fields, SEARCH_WEIGHTS)
+        ]
+        if not vectors:
+            return None
+        vector = vectors[0]
+        for extra in vectors[1:]:
+            vector = vector + extra
+        return vector
+
+    def filter_queryset(self, request, queryset, view):
+        query = build_search_query(request.query_params.get(self.search_param, ''))
+        vector = self.get_search_vector(view, request)
+        if query is None or vector is None:
+            return queryset
+
+        if isinstance(vector, str):
+            queryset = queryset.filter(**{vector: query})
+        else:
+            queryset = queryset.annotate(search_document=vector).filter(search_document=query)
+            vector = 'search_document'
+
+        queryset = queryset.annotate(search_rank=SearchRank(vector, query))
+
+        if request.query_params.get(self.highlight_param, '').lower() in ['true', '1', 'yes']:
+            headline_field = getattr(view, 'search_headline_field', None) or self.get_search_fields(view, request)[0]
+            queryset = queryset.annotate(search_headline=SearchHeadline(
+                headline_field,
+                query,
+                config=SEARCH_CONFIG,
+                start_sel='<mark>',
+                stop_sel='</mark>',
+            ))
+
+        return queryset.order_by('-search_rank', 'pk')
+
+
+SUGGEST_MAX_LIMIT = 20
+SUGGEST_TTL = 60
+
+
+def find_suggestions(prefix, limit):
+    """
+    Return the top ``limit`` active products and categories whose name
+    contains ``prefix``, best trigram match first. ``name__icontains``
+    compiles to ``UPPER(name) LIKE UPPER(...)``, which the gin_trgm_ops
+    indexes on ``UPPER(name)`` serve.
+    """
+    products = (
+        Product.objects.filter(is_active=True, name__icontains=prefix)
+        .annotate(similarity=TrigramSimilarity('name', prefix))
+        .order_by('-similarity', 'name')
+        .values('id', 'name', 'slug')[:limit]
+    )
+    categories = (
+        Category.objects.filter(is_active=True, name__icontains=prefix)
+        .annotate(similarity=TrigramSimilarity('name', prefix))
+        .order_by('-similarity', 'name')
+        .values('id', 'name', 'slug')[:limit]
+    )
+    return {'products': list(products), 'categories': list(categories)}
+
+
+@lru_cache(maxsize=2048)
+def cached_suggestions(prefix, limit, version, bucket):
+    # version and bucket only take part in the key: a catalog change or the
+    # end of the TTL bucket makes older entries unreachable
+    return find_suggestions(prefix, limit)
+
+
+def suggest(text, limit=8):
+    """Typeahead suggestions for free text, memoised per process for hot prefixes"""
+    prefix = ' '.join((text or '').lower().split())
+    if not prefix:
+        return {'products': [], 'categories': []}
+    limit = max(1, min(limit, SUGGEST_MAX_LIMIT))
+    return cached_suggestions(prefix, limit, get_catalog_version(), int(time.time() // SUGGEST_TTL))
@@ -1,4 +1,5 @@
 from rest_framework import serializers
+from api.images import ImageURLField
 from .models import Category, Product
 
 # ProductImageSerializer has been removed as ProductImage model no longer exists
@@ -7,19 +8,18 @@ class CategorySerializer(serializers.ModelSerializer):
     """
     Serializer for the Category model
     """
-    image_url = serializers.SerializerMethodField()
+    image_url = ImageURLField()
 
     class Meta:
         model = Category
-        fields = ['id', 'name', 'slug', 'description', 'image', 'image_url', 'parent', 'is_active']
+        fields = ['id', 'name', 'slug', 'description', 'image', 'image_url', 'parent', 'is_active',
+                  'path', 'depth']
+        read_only_fields = ['path', 'depth']
 
-    def get_image_url(self, obj):
-        if obj.image:
-            request = self.context.get('request')
-            if request:
-                return request.build_absolute_uri(obj.image.url)
-            return obj.image.url
-        return None
+    def validate_parent(self, value):
+        if value and self.instance and self.instance.path and value.path.startswith(self.instance.path):
+            raise serializers.ValidationError("A category cannot be moved under itself or one of its subcategories.")
+        return value
 
 class ProductSerializer(serializers.ModelSerializer):
     """
@@ -31,39 +31,79 @@ class ProductSerializer(serializers.ModelSerializer):
         source='category',
         write_only=True
     )
-    image_url = serializers.SerializerMethodField()
+    image_url = ImageURLField()
+    effective_price = serializers.DecimalField(max_digits=10, decimal_places=2, read_only=True)
 
     class Meta:
         model = Product
-        fields = ['id', 'name', 'slug', 'description', 'price', 'discount_price',
+        fields = ['id', 'name', 'slug', 'description', 'price', 'discount_price', 'effective_price',
                   'category', 'category_id', 'inventory', 'is_active',
                   'created_at', 'updated_at', 'image', 'image_url']
         read_only_fields = ['created_at', 'updated_at']
 
-    def get_image_url(self, obj):
-        if obj.image:
-            request = self.context.get('request')
-            if request:
-                return request.build_absolute_uri(obj.image.url)
-            return obj.image.url
-        return None
-
 class ProductListSerializer(serializers.ModelSerializer):
     """
     Simplified serializer for listing products
     """
     category_name = serializers.CharField(source='category.name', read_only=True)
-    image_url = serializers.SerializerMethodField()
+    image_url = ImageURLField()
+    # Only present when the search filter was asked to highlight matches
+    search_headline = serializers.CharField(read_only=True)
+    effective_price = serializers.DecimalField(max_digits=10, decimal_places=2, read_only=True)
 
     class Meta:
         model = Product
-        fields = ['id', 'name', 'slug', 'price', 'discount_price',
-                  'category_name', 'image_url', 'inventory', 'is_active']
+        fields = ['id', 'name', 'slug', 'price', 'discount_price', 'effective_price',
+                  'category_name', 'image_url', 'inventory', 'is_active',
+                  'search_headline']
+
+class ProductImportSerializer(serializers.Serializer):
+    """
+    Validates one row of a bulk product import without touching the database.
+    The category is given by id or slug and resolved per batch by the importer.
+    """
+    name = serializers.CharField(max_length=255)
+    slug = serializers.SlugField(max_length=255, required=False, allow_blank=True)
+    description = serializers.CharField(required=False, allow_blank=True, default='')
+    price = serializers.DecimalField(max_digits=10, decimal_places=2, min_value=0)
+    discount_price = serializers.DecimalField(max_digits=10, decimal_places=2, min_value=0,
+                                              required=False, allow_null=True, default=None)
+    category_id = serializers.IntegerField(required=False, allow_null=True, default=None)
+    category = serializers.CharField(required=False, allow_blank=True, default='')
+    inventory = serializers.IntegerField(min_value=0, required=False, default=0)
+    is_active = serializers.BooleanField(required=False, default=True)
+
+    def to_internal_value(self, data):
+        # CSV cells arrive as strings; treat empty optional cells as missing
+        data = {key: value for key, value in data.items() if value not in ('', None) or key == 'name'}
+        return super().to_internal_value(data)
+
+    def validate(self, data):
+        if not data.get('category_id') and not data.get('category'):
+            raise serializers.ValidationError("Either category_id or category (slug) is required.")
+        return data
+
+class ProductStockUpdateSerializer(serializers.Serializer):
+    """
+    One row of a bulk inventory/price update, addressed by id or slug.
+    ``inventory`` sets an absolute level, ``inventory_delta`` adjusts it
+    relative to the current value; ``expected_inventory`` makes the write
+    conditional on the current level.
+    """
+    id = serializers.IntegerField(required=False)
+    slug = serializers.SlugField(max_length=255, required=False)
+    inventory = serializers.IntegerField(min_value=0, required=False)
+    inventory_delta = serializers.IntegerField(required=False)
+    expected_inventory = serializers.IntegerField(min_value=0, required=False)
+    price = serializers.DecimalField(max_digits=10, decimal_places=2, min_value=0, required=False)
+    discount_price = serializers.DecimalField(max_digits=10, decimal_places=2, min_value=0,
+                                              required=False, allow_null=True)
 
-    def get_image_url(self, obj):
-        if obj.image:
-            request = self.context.get('request')
-            if request:
-                return request.build_absolute_uri(obj.image.url)
-            return obj.image.url
-        return None
+    def validate(self, data):
+        if 'id' not in data and 'slug' not in data:
+            raise serializers.ValidationError("Either id or slug is required.")
+        if 'inventory' in data and 'inventory_delta' in data:
+            raise serializers.ValidationError("Use either inventory or inventory_delta, not both.")
+        if not {'inventory', 'inventory_delta', 'price', 'discount_price'} & set(data):
+            raise serializers.ValidationError("Nothing to update.")
+        return data
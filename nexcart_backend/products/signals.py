@@ -0,0 +1,16 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .cache import bump_catalog_version
+from .models import Category, Product
+
+
+@receiver([post_save, post_delete], sender=Product)
+@receiver([post_save, post_delete], sender=Category)
+def invalidate_catalog_cache(sender, **kwargs):
+    """
+    Any product or category change invalidates cached catalog responses.
+    The bump waits for commit so readers cannot cache pre-commit data under the new version.
+    """
+    transaction.on_commit(bump_catalog_version)
@@ -0,0 +1,401 @@
+import threading
+import time
+from array import array
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.db import DatabaseError, connections
+from django.db.models import Count, Max
+
+from api.images import absolute_image_url, stored_image_url, variant_url
+
+from .cache import get_catalog_version
+from .models import Category, Product
+
+# Query parameters the snapshot can answer; anything else (search, cursor
+# pagination, ...) falls back to the database
+SNAPSHOT_QUERY_PARAMS = {
+    'category', 'category_tree', 'is_active', 'min_price', 'max_price',
+    'ordering', 'page', 'no_pagination', 'image_size', 'format', '_',
+}
+
+# Same aliases and valid fields as ProductOrderingFilter / ProductViewSet.ordering_fields
+ORDERING_FIELDS = {
+    'price': 'effective_prices',
+    'effective_price': 'effective_prices',
+    'created_at': 'created',
+}
+
+# Orderings left to the database: names sort by the database collation,
+# which Python's code point order does not reproduce
+DATABASE_ORDERING_FIELDS = {'name'}
+DEFAULT_ORDERING = (('created', True), ('ids', True))
+
+# Values NullBooleanSelect understands for ?is_active=
+BOOLEAN_VALUES = {'true': True, 'True': True, '2': True, 'false': False, 'False': False, '3': False}
+
+NO_DISCOUNT = -1
+
+# Re-read rows changed slightly before the last high-water mark, so rows
+# committed late by a transaction that started earlier are not missed
+CHANGE_OVERLAP = timedelta(seconds=5)
+
+PRODUCT_FIELDS = (
+    'id', 'name', 'slug', 'price', 'discount_price', 'effective_price', 'category_id',
+    'cached_image_url', 'image', 'inventory', 'is_active', 'created_at', 'updated_at',
+)
+
+
+def to_cents(value):
+    return int(value * 100)
+
+
+def format_cents(cents):
+    # Matches DRF's DecimalField(decimal_places=2) string output
+    return str(Decimal(cents).scaleb(-2))
+
+
+class CatalogSnapshot:
+    """
+    Column-oriented, in-memory copy of the product catalog.
+
+    Numbers live in ``array`` columns (prices in cents) and text in parallel
+    lists, so tens of thousands of products cost a few megabytes. Built before
+    gunicorn forks (``--preload``), the array buffers stay shared between the
+    workers by copy-on-write. Snapshots are never mutated once published:
+    a refresh builds a new one and swaps it in.
+    """
+    def __init__(self):
+        self.ids = array('q')
+        self.category_ids = array('q')
+        self.prices = array('q')
+        self.discount_prices = array('q')
+        self.effective_prices = array('q')
+        self.inventory = array('q')
+        self.active = array('b')
+        self.created = array('d')
+        self.updated = array('d')
+        self.names = []
+        self.slugs = []
+        self.image_urls = []
+        self.rows_by_id = {}
+        self.categories = {}
+        self.rows_by_category = {}
+        self.orderings = {}
+        self.high_water = None
+        self.category_state = None
+        self.catalog_version = None
+        self.refreshed_at = 0.0
+        self.rebuilt_at = 0.0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.ids)
+
+    # Building and refreshing
+
+    @classmethod
+    def build(cls):
+        snapshot = cls()
+        snapshot.catalog_version = get_catalog_version()
+        snapshot.load_categories()
+        rows = Product.objects.order_by('id').values_list(*PRODUCT_FIELDS).iterator(chunk_size=2000)
+        for row in rows:
+            snapshot.apply(row)
+        snapshot.index()
+        snapshot.refreshed_at = snapshot.rebuilt_at = time.monotonic()
+        return snapshot
+
+    def copy(self):
+        snapshot = type(self)()
+        for name in ('ids', 'category_ids', 'prices', 'discount_prices', 'effective_prices',
+                     'inventory', 'active', 'created', 'updated'):
+            setattr(snapshot, name, array(getattr(self, name).typecode, getattr(self, name)))
+        snapshot.names = list(self.names)
+        snapshot.slugs = list(self.slugs)
+        snapshot.image_urls = list(self.image_urls)
+        snapshot.rows_by_id = dict(self.rows_by_id)
+        snapshot.categories = self.categories
+        snapshot.high_water = self.high_water
+        snapshot.category_state = self.category_state
+        snapshot.rebuilt_at = self.rebuilt_at
+        return snapshot
+
+    def load_categories(self):
+        self.category_state = self.current_category_state()
+        self.categories = {
+            category_id: (name, path)
+            for category_id, name, path in Category.objects.values_list('id', 'name', 'path')
+        }
+
+    @staticmethod
+    def current_category_state():
+        stats = Category.objects.aggregate(updated=Max('updated_at'), count=Count('id'))
+        return stats['count'], stats['updated']
+
+    def apply(self, row):
+        """Insert or overwrite one product row from PRODUCT_FIELDS"""
+        (product_id, name, slug, price, discount_price, effective_price, category_id,
+         cached_image_url, image, inventory, is_active, created_at, updated_at) = row
+        if not cached_image_url and image:
+            # Rows saved before cached_image_url existed
+            cached_image_url = stored_image_url(Product(image=image).image)
+        values = (
+            product_id, category_id, to_cents(price),
+            NO_DISCOUNT if discount_price is None else to_cents(discount_price),
+            to_cents(effective_price), inventory, is_active,
+            created_at.timestamp(), updated_at.timestamp(),
+        )
+        columns = (
+            self.ids, self.category_ids, self.prices, self.discount_prices,
+            self.effective_prices, self.inventory, self.active, self.created, self.updated,
+        )
+        position = self.rows_by_id.get(product_id)
+        if position is None:
+            self.rows_by_id[product_id] = len(self.ids)
+            for column, value in zip(columns, values):
+                column.append(value)
+            self.names.append(name)
+            self.slugs.append(slug)
+            self.image_urls.append(cached_image_url)
+        else:
+            for column, value in zip(columns, values):
+                column[position] = value
+            self.names[position] = name
+            self.slugs[position] = slug
+            self.image_urls[position] = cached_image_url
+        if self.high_water is None or updated_at > self.high_water:
+            self.high_water = updated_at
+
+    def index(self):
+        rows_by_category = {}
+        for position, category_id in enumerate(self.category_ids):
+            rows_by_category.setdefault(category_id, array('q')).append(position)
+        self.rows_by_category = rows_by_category
+        self.orderings = {}
+
+    def refreshed(self):
+        """
+        Return an up-to-date snapshot: self when nothing changed, otherwise a
+        new one with the rows whose updated_at moved past the high-water mark.
+        Deletions are not visible through updated_at, so a row count mismatch
+        or the periodic rebuild interval triggers a full rebuild.
+        """
+        if time.monotonic() - self.rebuilt_at > settings.CATALOG_SNAPSHOT_REBUILD_SECONDS:
+            return self.build()
+
+        catalog_version = get_catalog_version()
+        category_state = self.current_category_state()
+        changes = Product.objects.order_by('id').values_list(*PRODUCT_FIELDS)
+        if self.high_water is not None:
+            changes = changes.filter(updated_at__gte=self.high_water - CHANGE_OVERLAP)
+        changes = list(changes)
+        product_count = Product.objects.count()
+
+        if (category_state == self.category_state and product_count == len(self)
+                and all(self.unchanged(row) for row in changes)):
+            self.catalog_version = catalog_version
+            self.refreshed_at = time.monotonic()
+            return self
+
+        snapshot = self.copy()
+        snapshot.catalog_version = catalog_version
+        if category_state != self.category_state:
+            snapshot.load_categories()
+        for row in changes:
+            snapshot.apply(row)
+        if len(snapshot) != product_count:
+            return self.build()
+        snapshot.index()
+        snapshot.refreshed_at = time.monotonic()
+        return snapshot
+
+    def unchanged(self, row):
+        position = self.rows_by_id.get(row[0])
+        return position is not None and self.updated[position] == row[-1].timestamp()
+
+    def is_stale(self):
+        elapsed = time.monotonic() - self.refreshed_at
+        if elapsed > settings.CATALOG_SNAPSHOT_REFRESH_SECONDS:
+            return True
+        # A catalog write signalled through the cache version is picked up at once
+        return get_catalog_version() != self.catalog_version
+
+    # Querying
+
+    def query(self, query_params, request=None):
+        """
+        Apply the product list filters and ordering to the snapshot. Returns
+        SnapshotRows, or None when a parameter needs the database.
+        """
+        if not set(query_params.keys()) <= SNAPSHOT_QUERY_PARAMS:
+            return None
+
+        candidates = None
+        category = query_params.get('category')
+        if category:
+            if not category.isdigit() or int(category) not in self.categories:
+                return None  # let django-filter report the invalid choice
+            candidates = self.rows_by_category.get(int(category), array('q'))
+
+        category_tree = query_params.get('category_tree')
+        if category_tree:
+            root = self.categories.get(int(category_tree)) if category_tree.isdigit() else None
+            if root is None:
+                return SnapshotRows(self, [], request)
+            tree_rows = set()
+            for category_id, (_, path) in self.categories.items():
+                if path.startswith(root[1]):
+                    tree_rows.update(self.rows_by_category.get(category_id, ()))
+            candidates = tree_rows if candidates is None else tree_rows.intersection(candidates)
+
+        try:
+            min_price = Decimal(query_params['min_price']) * 100 if query_params.get('min_price') else None
+            max_price = Decimal(query_params['max_price']) * 100 if query_params.get('max_price') else None
+            # NaN would only fail later, in the comparisons; leave it to the database path
+            if any(price is not None and not price.is_finite() for price in (min_price, max_price)):
+                return None
+        except InvalidOperation:
+            return None
+        is_active = BOOLEAN_VALUES.get(query_params.get('is_active'))
+
+        ordering = self.get_ordering(query_params.get('ordering'))
+        if ordering is None:
+            return None
+        if candidates is None:
+            positions = self.ordered_positions(ordering)
+        else:
+            positions = self.sort(list(candidates), ordering)
+
+        prices = self.effective_prices
+        active = self.active
+        if is_active is not None:
+            positions = [p for p in positions if bool(active[p]) is is_active]
+        if min_price is not None:
+            positions = [p for p in positions if prices[p] >= min_price]
+        if max_price is not None:
+            positions = [p for p in positions if prices[p] <= max_price]
+        return SnapshotRows(self, positions, request)
+
+    def get_ordering(self, param):
+        """Sort terms for ?ordering=, or None when it needs the database"""
+        terms = []
+        for term in (param or '').split(','):
+            term = term.strip()
+            if term.lstrip('-') in DATABASE_ORDERING_FIELDS:
+                return None
+            column = ORDERING_FIELDS.get(term.lstrip('-'))
+            if column:
+                terms.append((column, term.startswith('-')))
+        if not terms:
+            return DEFAULT_ORDERING
+        terms.append(('ids', terms[0][1]))
+        return tuple(terms)
+
+    def ordered_positions(self, ordering):
+        positions = self.orderings.get(ordering)
+        if positions is None:
+            with self.lock:
+                positions = self.orderings.get(ordering)
+                if positions is None:
+                    positions = array('q', self.sort(list(range(len(self))), ordering))
+                    self.orderings[ordering] = positions
+        return positions
+
+    def sort(self, positions, ordering):
+        # Stable sorts from the last key to the first give a multi-key order
+        for column, descending in reversed(ordering):
+            positions.sort(key=getattr(self, column).__getitem__, reverse=descending)
+        return positions
+
+    def representation(self, position, request=None, variant=None):
+        """Same payload as ProductListSerializer for one row"""
+        discount = self.discount_prices[position]
+        category = self.categories.get(self.category_ids[position])
+        url = self.image_urls[position]
+        if url and variant:
+            url = variant_url(url, variant)
+        return {
+            'id': self.ids[position],
+            'name': self.names[position],
+            'slug': self.slugs[position],
+            'price': format_cents(self.prices[position]),
+            'discount_price': None if discount == NO_DISCOUNT else format_cents(discount),
+            'effective_price': format_cents(self.effective_prices[position]),
+            'category_name': category[0] if category else None,
+            'image_url': absolute_image_url(request, url),
+            'inventory': self.inventory[position],
+            'is_active': bool(self.active[position]),
+        }
+
+
+class SnapshotRows:
+    """
+    Sequence of serialized products over matching snapshot positions. Rows are
+    only rendered when sliced, so the paginator materializes one page.
+    """
+    def __init__(self, snapshot, positions, request=None):
+        self.snapshot = snapshot
+        self.positions = positions
+        self.request = request
+        self.variant = request.query_params.get('image_size') if request is not None else None
+
+    def __len__(self):
+        return len(self.positions)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.render(position) for position in self.positions[index]]
+        return self.render(self.positions[index])
+
+    def render(self, position):
+        return self.snapshot.representation(position, self.request, self.variant)
+
+    def last_modified(self):
+        updated = self.snapshot.updated
+        latest = max((updated[position] for position in self.positions), default=None)
+        return datetime.fromtimestamp(latest, tz=timezone.utc) if latest is not None else None
+
+
+_snapshot = None
+_snapshot_lock = threading.Lock()
+
+
+def get_catalog_snapshot():
+    """
+    Return the process-wide catalog snapshot, building or refreshing it as
+    needed, or None when settings.CATALOG_SNAPSHOT_ENABLED is off.
+    """
+    global _snapshot
+    if not settings.CATALOG_SNAPSHOT_ENABLED:
+        return None
+    snapshot = _snapshot
+    if snapshot is not None and not snapshot.is_stale():
+        return snapshot
+    # One thread refreshes; the others keep serving the current snapshot
+    if not _snapshot_lock.acquire(blocking=snapshot is None):
+        return snapshot
+    try:
+        if _snapshot is None:
+            _snapshot = CatalogSnapshot.build()
+        elif _snapshot.is_stale():
+            _snapshot = _snapshot.refreshed()
+        return _snapshot
+    finally:
+        _snapshot_lock.release()
+
+
+def warm_catalog_snapshot():
+    """
+    Build the snapshot at startup. With gunicorn --preload this runs once in
+    the master, and the connection used is closed so no worker inherits it.
+    """
+    if not settings.CATALOG_SNAPSHOT_ENABLED:
+        return
+    try:
+        get_catalog_snapshot()
+    except DatabaseError:
+        pass  # e.g. migrations not applied yet; the first request builds it
+    finally:
+        connections.close_all()
@@ -1,3 +1,629 @@
-from django.test import TestCase
+import json
+import re
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.contrib.postgres.search import SearchQuery
+from django.core.cache import caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.http import QueryDict
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APITestCase
+
+from api import images
+from . import bulk, search, snapshot
+from .facets import compute_facets
+from .models import Category, Product
+
+User = get_user_model()
+
+# Whole-set aggregates: the paginator's count and the listing validators
+AGGREGATE_RE = re.compile(r'SELECT (COUNT|MAX)\(')
+
+
+class ProductListingPlanTests(APITestCase):
+    """
+    Run EXPLAIN on the page queries behind the product listing and fail if
+    any of them falls back to a sequential scan of products_product.
+
+    Whole-set aggregates are left out on purpose: the paginator's COUNT(*)
+    and the ETag validator's MAX/COUNT must visit every matching row, and
+    for unselective listings such as the unfiltered catalog a sequential
+    scan is the cheapest plan for that, so asserting otherwise would fail
+    on correct plans. With the catalog cache enabled, repeat listings run
+    neither.
+    """
+    category_count = 25
+    product_count = 10000
+
+    @classmethod
+    def setUpTestData(cls):
+        categories = Category.objects.bulk_create([
+            Category(name=f'Category {i}', slug=f'category-{i}')
+            for i in range(cls.category_count)
+        ])
+        Product.objects.bulk_create([
+            Product(
+                name=f'Product {i}',
+                slug=f'product-{i}',
+                description=f'Description of product {i}',
+                price=Decimal(i % 500) + Decimal('0.99'),
+                discount_price=Decimal(i % 500) if i % 7 == 0 else None,
+                category=categories[i % cls.category_count],
+                inventory=i % 13,
+                is_active=i % 10 != 0,
+            )
+            for i in range(cls.product_count)
+        ], batch_size=2000)
+        cls.category = categories[3]
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE products_product')
+            cursor.execute('ANALYZE products_category')
+
+    def listing_urls(self):
+        category = self.category.id
+        return [
+            '/api/products/',
+            '/api/products/?ordering=price',
+            '/api/products/?ordering=-price',
+            '/api/products/?ordering=name',
+            '/api/products/?ordering=-created_at',
+            f'/api/products/?category={category}',
+            f'/api/products/?category={category}&ordering=price',
+            f'/api/products/?category={category}&min_price=100&max_price=200',
+            '/api/products/?min_price=100&max_price=120',
+            '/api/products/?is_active=true',
+            f'/api/products/?is_active=true&category={category}&ordering=price',
+            '/api/products/?search=4242',
+        ]
+
+    def page_queries(self, url):
+        for cache in caches.all():
+            cache.clear()
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, url)
+        return [
+            query['sql'] for query in context.captured_queries
+            if 'FROM "products_product"' in query['sql'] and not AGGREGATE_RE.match(query['sql'])
+        ]
+
+    def explain(self, sql):
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN ' + sql)
+            return '\n'.join(row[0] for row in cursor.fetchall())
+
+    def test_listing_queries_use_indexes(self):
+        for url in self.listing_urls():
+            with self.subTest(url=url):
+                queries = self.page_queries(url)
+                self.assertTrue(queries, f'No paged product query captured for {url}')
+                for sql in queries:
+                    plan = self.explain(sql)
+                    self.assertNotIn('Seq Scan on products_product', plan, f'{url}\n{sql}\n{plan}')
+
+
+class CatalogSnapshotTests(APITestCase):
+    """
+    The snapshot must answer product listings exactly like the database path,
+    and without querying products once it is built.
+    """
+    @classmethod
+    def setUpTestData(cls):
+        parent = Category.objects.create(name='Parent', slug='parent')
+        child = Category.objects.create(name='Child', slug='child', parent=parent)
+        other = Category.objects.create(name='Other', slug='other')
+        categories = [parent, child, other]
+        for i in range(30):
+            Product.objects.create(
+                name=f'Product {i:03d}',
+                slug=f'product-{i}',
+                description='Description',
+                price=Decimal(i * 3 % 17) + Decimal('0.50'),
+                discount_price=Decimal(i % 5) if i % 4 == 0 else None,
+                category=categories[i % 3],
+                inventory=i,
+                is_active=i % 6 != 0,
+            )
+        cls.parent = parent
+        cls.child = child
+
+    def setUp(self):
+        snapshot._snapshot = None
+        for cache in caches.all():
+            cache.clear()
+
+    def listing_urls(self):
+        return [
+            '/api/products/',
+            '/api/products/?page=2',
+            '/api/products/?ordering=price',
+            '/api/products/?ordering=-price,name',
+            '/api/products/?ordering=name',
+            '/api/products/?ordering=-created_at',
+            f'/api/products/?category={self.child.id}&ordering=-price',
+            f'/api/products/?category_tree={self.parent.id}',
+            '/api/products/?min_price=3&max_price=9.5&is_active=true',
+            '/api/products/?is_active=false&no_pagination=true',
+        ]
+
+    def get_data(self, url):
+        for cache in caches.all():
+            cache.clear()
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, url)
+        return response.json()
+
+    def test_snapshot_matches_database(self):
+        for url in self.listing_urls():
+            with self.subTest(url=url):
+                expected = self.get_data(url)
+                with override_settings(CATALOG_SNAPSHOT_ENABLED=True):
+                    self.assertEqual(self.get_data(url), expected)
+
+    @override_settings(CATALOG_SNAPSHOT_ENABLED=True, CATALOG_SNAPSHOT_REFRESH_SECONDS=3600)
+    def test_built_snapshot_serves_without_product_queries(self):
+        self.get_data('/api/products/')
+        with CaptureQueriesContext(connection) as context:
+            data = self.get_data(f'/api/products/?category={self.child.id}&ordering=price')
+        self.assertEqual(data['count'], 10)
+        self.assertFalse([q for q in context.captured_queries if 'products_product' in q['sql']])
+
+    def test_name_ordering_is_left_to_the_database(self):
+        built = snapshot.CatalogSnapshot.build()
+        for ordering in ('name', '-price,-name'):
+            with self.subTest(ordering=ordering):
+                self.assertIsNone(built.query(QueryDict(f'ordering={ordering}')))
+        self.assertIsNotNone(built.query(QueryDict('ordering=-price')))
+
+    def test_non_finite_prices_are_left_to_the_database(self):
+        built = snapshot.CatalogSnapshot.build()
+        for params in ('min_price=NaN', 'max_price=-Infinity', 'min_price=1&max_price=snan'):
+            with self.subTest(params=params):
+                self.assertIsNone(built.query(QueryDict(params)))
+
+    @override_settings(CATALOG_SNAPSHOT_ENABLED=True)
+    def test_refresh_picks_up_changes_and_deletions(self):
+        self.get_data('/api/products/')
+        product = Product.objects.get(slug='product-1')
+        product.name = 'Renamed'
+        product.save()
+        Product.objects.filter(slug='product-2').delete()
+        snapshot._snapshot.refreshed_at = 0
+        data = self.get_data('/api/products/?no_pagination=true')
+        names = {row['name'] for row in data}
+        self.assertIn('Renamed', names)
+        self.assertEqual(len(data), 29)
+
+
+@override_settings(CATALOG_CACHE_ENABLED=True)
+class CatalogCacheTests(APITestCase):
+    """
+    Catalog responses are cached per normalized URL and catalog version;
+    staff bypass the cache and any product write invalidates it.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create_user('staff', 'staff@example.com', 'password', is_staff=True)
+        cls.category = Category.objects.create(name='Lamps', slug='lamps')
+        cls.product = Product.objects.create(
+            name='Desk lamp', slug='desk-lamp', description='A lamp', price=Decimal('20.00'),
+            category=cls.category, inventory=3,
+        )
+
+    def setUp(self):
+        for cache in caches.all():
+            cache.clear()
+
+    def test_equivalent_urls_share_a_cached_response(self):
+        self.assertEqual(self.client.get('/api/products/?ordering=name&_=1')['X-Cache'], 'MISS')
+        response = self.client.get('/api/products/?_=2&ordering=name')
+        self.assertEqual(response['X-Cache'], 'HIT')
+        self.assertEqual(response.data['results'][0]['name'], 'Desk lamp')
+
+    def test_cache_hits_are_validated_without_product_queries(self):
+        etag = self.client.get('/api/products/')['ETag']
+        with CaptureQueriesContext(connection) as context:
+            hit = self.client.get('/api/products/')
+            not_modified = self.client.get('/api/products/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(hit['X-Cache'], 'HIT')
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertFalse([q for q in context.captured_queries if 'products_product' in q['sql']])
+
+    def test_category_rename_changes_the_etag(self):
+        for enabled in (True, False):
+            with self.subTest(cache_enabled=enabled), self.settings(CATALOG_CACHE_ENABLED=enabled):
+                etag = self.client.get('/api/products/')['ETag']
+                self.assertEqual(self.client.get('/api/products/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+                with self.captureOnCommitCallbacks(execute=True):
+                    self.category.name = f'Lighting {enabled}'
+                    self.category.save()
+                response = self.client.get('/api/products/', HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.data['results'][0]['category_name'], f'Lighting {enabled}')
+
+    def test_staff_bypass_the_cache(self):
+        self.client.get('/api/products/')
+        self.client.force_authenticate(self.staff)
+        self.assertNotIn('X-Cache', self.client.get('/api/products/'))
+
+    def test_writes_invalidate_cached_responses(self):
+        self.client.get('/api/products/')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.name = 'Floor lamp'
+            self.product.save()
+        response = self.client.get('/api/products/')
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.data['results'][0]['name'], 'Floor lamp')
+
+    def test_disabled_without_a_shared_cache(self):
+        with self.settings(CATALOG_CACHE_ENABLED=False):
+            self.client.get('/api/products/')
+            self.assertNotIn('X-Cache', self.client.get('/api/products/'))
+
+
+class BulkCatalogTests(APITestCase):
+    """
+    Bulk import upserts by slug and reports bad rows by line, export streams
+    the catalog back, and stock updates report a status per row.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        cls.category = Category.objects.create(name='Tools', slug='tools')
+        cls.hammer = Product.objects.create(
+            name='Hammer', slug='hammer', description='A hammer', price=Decimal('12.00'),
+            category=cls.category, inventory=5,
+        )
+        cls.saw = Product.objects.create(
+            name='Saw', slug='saw', description='A saw', price=Decimal('20.00'),
+            category=cls.category, inventory=2,
+        )
+
+    def setUp(self):
+        self.client.force_authenticate(self.admin)
+
+    def upload(self, name, content, **data):
+        upload = SimpleUploadedFile(name, content.encode('utf-8'))
+        return self.client.post('/api/admin/products/bulk_import/', dict(data, file=upload), format='multipart')
+
+    def test_csv_import_upserts_by_slug_and_reports_bad_rows(self):
+        response = self.upload('products.csv', (
+            'name,slug,price,category,inventory\n'
+            'Hammer,hammer,14.50,tools,7\n'
+            'Work Bench,,99.00,tools,1\n'
+            'Work Bench,,89.00,tools,2\n'
+            'Drill,,not-a-price,tools,1\n'
+            'Lathe,,500.00,machines,1\n'
+        ))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['processed'], 5)
+        self.assertEqual(response.data['failed'], 2)
+        self.assertEqual([(error['line'], list(error['errors'])) for error in response.data['errors']], [
+            (5, ['price']), (6, ['category']),
+        ])
+
+        hammer = Product.objects.get(slug='hammer')
+        self.assertEqual((hammer.pk, hammer.price, hammer.inventory), (self.hammer.pk, Decimal('14.50'), 7))
+        # Rows without a slug fall back to the slugified name, so the later duplicate wins
+        bench = Product.objects.get(slug='work-bench')
+        self.assertEqual((bench.price, bench.inventory), (Decimal('89.00'), 2))
+        self.assertFalse(Product.objects.filter(name__in=['Drill', 'Lathe']).exists())
+
+    def test_ndjson_import_reports_malformed_lines(self):
+        lines = [
+            json.dumps({'name': 'Chisel', 'price': '6.00', 'category_id': self.category.id}),
+            '{not json',
+            json.dumps(['a', 'list']),
+        ]
+        response = self.upload('products.ndjson', '\n'.join(lines) + '\n')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['upserted'], 1)
+        self.assertEqual([error['line'] for error in response.data['errors']], [2, 3])
+        self.assertEqual(Product.objects.get(slug='chisel').category, self.category)
+
+    def test_export_streams_csv_and_ndjson(self):
+        response = self.client.get('/api/admin/products/export/')
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], ','.join(column for _, column in bulk.EXPORT_COLUMNS))
+        self.assertEqual([line.split(',')[2] for line in lines[1:]], ['hammer', 'saw'])
+
+        response = self.client.get('/api/admin/products/export/', {'export_format': 'ndjson'})
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([(row['slug'], row['category']) for row in rows], [('hammer', 'tools'), ('saw', 'tools')])
+
+    def test_export_round_trips_through_import(self):
+        exported = b''.join(self.client.get('/api/admin/products/export/').streaming_content).decode()
+        response = self.upload('products.csv', exported)
+        self.assertEqual((response.data['upserted'], response.data['failed']), (2, 0))
+        self.assertEqual(Product.objects.count(), 2)
+
+    def test_stock_updates_report_each_row(self):
+        results = bulk.apply_stock_updates([
+            {'id': self.hammer.id, 'inventory_delta': -3},
+            {'slug': 'saw', 'inventory': 9, 'expected_inventory': 1},
+            {'slug': 'missing', 'inventory': 1},
+            {'id': self.hammer.id, 'price': Decimal('1.00')},
+            {'slug': 'saw', 'inventory_delta': -5},
+        ])
+        self.assertEqual([result['status'] for result in results], [
+            'updated', 'conflict', 'not_found', 'duplicate', 'duplicate',
+        ])
+        self.assertEqual(results[0]['inventory'], 2)
+        self.assertEqual(dict(Product.objects.values_list('slug', 'inventory')), {'hammer': 2, 'saw': 2})
+
+    def test_stock_delta_never_goes_below_zero(self):
+        response = self.client.post('/api/admin/products/bulk_update/', {'updates': [
+            {'slug': 'saw', 'inventory_delta': -3},
+            {'slug': 'hammer', 'inventory_delta': -5, 'discount_price': '10.00'},
+        ]}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['updated'], 1)
+        self.assertEqual([result['status'] for result in response.data['results']], ['conflict', 'updated'])
+        self.assertEqual(response.data['results'][1]['effective_price'], Decimal('10.00'))
+        self.assertEqual(Product.objects.get(slug='saw').inventory, 2)
+
+
+class FullTextSearchTests(APITestCase):
+    """
+    The trigger keeps search_vector current, name matches rank above
+    description matches, and ?highlight=true marks the matched terms.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Lighting', slug='lighting')
+        cls.shade = Product.objects.create(
+            name='Linen shade', slug='linen-shade', description='Fits any standard lamp base',
+            price=Decimal('15.00'), category=category,
+        )
+        cls.lamp = Product.objects.create(
+            name='Brass lamp', slug='brass-lamp', description='Polished brass with a linen shade',
+            price=Decimal('45.00'), category=category,
+        )
+
+    def search(self, text, **params):
+        return self.client.get('/api/products/', dict(params, search=text, no_pagination='true')).json()
+
+    def test_trigger_maintains_the_search_vector(self):
+        self.assertTrue(Product.objects.filter(pk=self.lamp.pk, search_vector=SearchQuery('brass')).exists())
+        Product.objects.filter(pk=self.lamp.pk).update(name='Copper lamp', description='Hammered copper')
+        self.assertFalse(Product.objects.filter(pk=self.lamp.pk, search_vector=SearchQuery('brass')).exists())
+        self.assertTrue(Product.objects.filter(pk=self.lamp.pk, search_vector=SearchQuery('copper')).exists())
+
+    def test_name_matches_rank_first_and_prefixes_match(self):
+        self.assertEqual([row['slug'] for row in self.search('lam')], ['brass-lamp', 'linen-shade'])
+        self.assertEqual([row['slug'] for row in self.search('shade linen')], ['linen-shade', 'brass-lamp'])
+        self.assertEqual(self.search('chandelier'), [])
+
+    def test_highlight_marks_matched_terms(self):
+        rows = {row['slug']: row for row in self.search('lamp', highlight='true')}
+        self.assertIn('<mark>lamp</mark>', rows['linen-shade']['search_headline'])
+        self.assertNotIn('search_headline', self.search('lamp')[0])
+
+
+class CategoryTreeTests(APITestCase):
+    """
+    Moving a category re-roots its whole subtree, and ?category_tree=
+    filters products by a category and all of its descendants.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.garden = Category.objects.create(name='Garden', slug='garden')
+        cls.tools = Category.objects.create(name='Garden tools', slug='garden-tools', parent=cls.garden)
+        cls.shears = Category.objects.create(name='Shears', slug='shears', parent=cls.tools)
+        cls.workshop = Category.objects.create(name='Workshop', slug='workshop')
+        cls.product = Product.objects.create(
+            name='Hedge shears', slug='hedge-shears', description='Shears', price=Decimal('25.00'),
+            category=cls.shears,
+        )
+
+    def tree_slugs(self, category_id):
+        response = self.client.get('/api/products/', {'category_tree': category_id, 'no_pagination': 'true'})
+        return [row['slug'] for row in response.json()]
+
+    def test_moving_a_category_re_roots_its_subtree(self):
+        self.assertEqual((self.shears.path, self.shears.depth), (f'/{self.garden.pk}/{self.tools.pk}/{self.shears.pk}/', 2))
+        self.assertEqual(self.tree_slugs(self.garden.pk), ['hedge-shears'])
+
+        self.tools.parent = self.workshop
+        self.tools.save()
+        shears = Category.objects.get(pk=self.shears.pk)
+        self.assertEqual((shears.path, shears.depth), (f'/{self.workshop.pk}/{self.tools.pk}/{self.shears.pk}/', 2))
+        self.assertEqual(self.tree_slugs(self.workshop.pk), ['hedge-shears'])
+        self.assertEqual(self.tree_slugs(self.garden.pk), [])
+
+        self.tools.parent = None
+        self.tools.save()
+        shears = Category.objects.get(pk=self.shears.pk)
+        self.assertEqual((shears.path, shears.depth), (f'/{self.tools.pk}/{self.shears.pk}/', 1))
+
+    def test_category_cannot_move_under_its_own_subtree(self):
+        self.garden.parent = self.shears
+        with self.assertRaises(ValueError):
+            self.garden.save()
+
+    def test_unknown_tree_matches_nothing(self):
+        self.assertEqual(self.tree_slugs(999999), [])
+        self.assertEqual(self.tree_slugs('garden'), [])
+
+
+class FacetTests(APITestCase):
+    """Facet counts agree with the filtered listing they describe"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.kitchen = Category.objects.create(name='Kitchen', slug='kitchen')
+        cls.bath = Category.objects.create(name='Bath', slug='bath')
+        for slug, price, discount, category, inventory, active in [
+            ('kettle', '30.00', '20.00', cls.kitchen, 4, True),
+            ('toaster', '60.00', None, cls.kitchen, 0, True),
+            ('mixer', '300.00', None, cls.kitchen, 2, True),
+            ('towel', '10.00', None, cls.bath, 9, True),
+            ('old-towel', '10.00', None, cls.bath, 9, False),
+        ]:
+            Product.objects.create(
+                name=slug, slug=slug, description=slug, price=Decimal(price),
+                discount_price=Decimal(discount) if discount else None,
+                category=category, inventory=inventory, is_active=active,
+            )
+
+    def test_facet_counts(self):
+        facets = compute_facets(Product.objects.filter(is_active=True), price_field='effective_price')
+        self.assertEqual(facets['total'], 4)
+        self.assertEqual(facets['categories'], [
+            {'id': self.kitchen.id, 'name': 'Kitchen', 'count': 3},
+            {'id': self.bath.id, 'name': 'Bath', 'count': 1},
+        ])
+        # The discounted kettle counts in the band of what the customer pays
+        self.assertEqual([band['count'] for band in facets['price_ranges']], [2, 0, 1, 0, 1])
+        self.assertEqual(facets['availability'], {'in_stock': 3, 'out_of_stock': 1})
+        self.assertEqual(facets['discount'], {'discounted': 1, 'full_price': 3})
+
+    def test_endpoint_applies_the_listing_filters(self):
+        response = self.client.get('/api/products/facets/', {'category': self.bath.id})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['total'], 2)
+        self.assertEqual(response.data['availability'], {'in_stock': 2, 'out_of_stock': 0})
+
+
+@override_settings(IMAGE_VARIANTS={'thumbnail': 'c_fill,w_150,h_150'})
+class ImageVariantTests(APITestCase):
+    """
+    Image URLs come from the stored cached_image_url without asking the
+    storage backend, and size variants are computed once per URL.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Prints', slug='prints')
+        cls.product = Product.objects.create(
+            name='Poster', slug='poster', description='A poster', price=Decimal('9.00'), category=category,
+        )
+        cls.url = 'https://res.cloudinary.com/demo/image/upload/v1/nexcart/products/poster.jpg'
+        Product.objects.filter(pk=cls.product.pk).update(cached_image_url=cls.url)
+
+    def setUp(self):
+        images.variant_url.cache_clear()
+
+    def test_variants_come_from_the_stored_url(self):
+        def image_url(**params):
+            return self.client.get('/api/products/', params).data['results'][0]['image_url']
+
+        with mock.patch.object(images, 'stored_image_url') as stored:
+            original = image_url()
+            thumbnail = image_url(image_size='thumbnail')
+            unknown = image_url(image_size='huge')
+        stored.assert_not_called()
+        self.assertEqual(original, self.url)
+        self.assertEqual(thumbnail, self.url.replace('/image/upload/', '/image/upload/c_fill,w_150,h_150/'))
+        self.assertEqual(unknown, self.url)
+
+    def test_variant_urls_are_computed_once(self):
+        for _ in range(3):
+            self.client.get('/api/products/', {'image_size': 'thumbnail'})
+        info = images.variant_url.cache_info()
+        self.assertEqual((info.misses, info.hits), (1, 2))
+
+    def test_refresh_only_writes_a_changed_url(self):
+        product = Product.objects.get(pk=self.product.pk)
+        with mock.patch.object(images, 'stored_image_url', return_value=self.url), self.assertNumQueries(0):
+            images.refresh_image_url(product)
+        with mock.patch.object(images, 'stored_image_url', return_value=''), self.assertNumQueries(1):
+            images.refresh_image_url(product)
+        self.assertEqual(Product.objects.get(pk=self.product.pk).cached_image_url, '')
+
+
+class SuggestPlanTests(APITestCase):
+    """
+    Run EXPLAIN on the typeahead queries and fail unless both the product and
+    the category lookup go through their UPPER(name) trigram index.
+    """
+    row_count = 10000
+
+    @classmethod
+    def setUpTestData(cls):
+        categories = Category.objects.bulk_create([
+            Category(name=f'Category {i}', slug=f'category-{i}')
+            for i in range(cls.row_count)
+        ], batch_size=2000)
+        Product.objects.bulk_create([
+            Product(
+                name=f'Product {i}',
+                slug=f'product-{i}',
+                description='',
+                price=Decimal('9.99'),
+                category=categories[i % 25],
+            )
+            for i in range(cls.row_count)
+        ], batch_size=2000)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE products_product')
+            cursor.execute('ANALYZE products_category')
+
+    def explain(self, sql):
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN ' + sql)
+            return '\n'.join(row[0] for row in cursor.fetchall())
+
+    def test_suggestion_queries_use_trigram_indexes(self):
+        with CaptureQueriesContext(connection) as context:
+            search.find_suggestions('4242', 8)
+        plans = {}
+        for query in context.captured_queries:
+            for table in ['products_product', 'products_category']:
+                if f'FROM "{table}"' in query['sql']:
+                    plans[table] = (query['sql'], self.explain(query['sql']))
+        for table, index in [('products_product', 'product_name_trgm_gin'),
+                             ('products_category', 'category_name_trgm_gin')]:
+            with self.subTest(table=table):
+                sql, plan = plans[table]
+                self.assertIn(index, plan, f'{sql}\n{plan}')
+                self.assertNotIn(f'Seq Scan on {table}', plan, f'{sql}\n{plan}')
+
+
+class SuggestTests(APITestCase):
+    """Typeahead matches names by substring, best trigram match first, within the limit bounds"""
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Lamps', slug='lamps')
+        Category.objects.create(name='Hidden lamps', slug='hidden-lamps', is_active=False)
+        for name in ['Lamp', 'Table lamp with a long linen shade', 'Floor lamp', 'Clamp', 'Rug']:
+            Product.objects.create(
+                name=name, slug=name.lower().replace(' ', '-'), description=name,
+                price=Decimal('10.00'), category=category,
+            )
+        Product.objects.create(
+            name='Lamp (retired)', slug='retired-lamp', description='', price=Decimal('10.00'),
+            category=category, is_active=False,
+        )
+
+    def setUp(self):
+        search.cached_suggestions.cache_clear()
+
+    def test_substring_matches_best_first(self):
+        results = search.suggest('  LAMP ')
+        names = [row['name'] for row in results['products']]
+        self.assertEqual(names[0], 'Lamp')
+        self.assertEqual(set(names), {'Lamp', 'Table lamp with a long linen shade', 'Floor lamp', 'Clamp'})
+        self.assertEqual([row['name'] for row in results['categories']], ['Lamps'])
+
+    def test_limit_is_clamped(self):
+        self.assertEqual(len(search.suggest('lamp', limit=0)['products']), 1)
+        with mock.patch.object(search, 'SUGGEST_MAX_LIMIT', 2):
+            self.assertEqual(len(search.suggest('lamp', limit=100)['products']), 2)
+
+    def test_endpoint(self):
+        response = self.client.get('/api/products/suggest/', {'q': 'lamp', 'limit': 'many'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['products']), 4)
+        self.assertEqual(self.client.get('/api/products/suggest/').data, {'products': [], 'categories': []})
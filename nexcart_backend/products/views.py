@@ -1,9 +1,79 @@
 from rest_framework import viewsets, permissions, filters
 from rest_framework.decorators import action
 from rest_framework.response import Response
+from django.db.models import Count, Max
 from django_filters.rest_framework import DjangoFilterBackend
+from api.conditional import conditional_get
+from api.querysets import EagerLoadingMixin
+from .cache import cache_catalog_response, versioned_validator
+from .facets import compute_facets
+from .filters import ProductOrderingFilter
 from .models import Category, Product
+from .search import FullTextSearchFilter, suggest
 from .serializers import CategorySerializer, ProductSerializer, ProductListSerializer
+from .snapshot import get_catalog_snapshot
+
+@versioned_validator
+def category_list_validator(view, request, *args, **kwargs):
+    """Newest modification and row count of the filtered category set"""
+    stats = view.filter_queryset(view.get_queryset()).aggregate(updated=Max('updated_at'), count=Count('id'))
+    return ('categories', stats['count'], stats['updated']), None
+
+
+@versioned_validator
+def category_detail_validator(view, request, *args, **kwargs):
+    updated = view.get_queryset().filter(pk=kwargs.get('pk')).values_list('updated_at', flat=True).first()
+    if updated is None:
+        return None, None
+    return ('category', kwargs.get('pk'), updated), updated
+
+
+@versioned_validator
+def category_tree_validator(view, request, *args, **kwargs):
+    stats = Category.objects.filter(is_active=True).aggregate(updated=Max('updated_at'), count=Count('id'))
+    return ('category-tree', stats['count'], stats['updated']), None
+
+
+def snapshot_rows(request):
+    """
+    Product list rows answered from the in-process catalog snapshot, or None
+    when it is disabled or cannot serve the query. Memoised on the request so
+    the validator and the view share one pass.
+    """
+    if not hasattr(request, '_snapshot_rows'):
+        snapshot = get_catalog_snapshot()
+        request._snapshot_rows = snapshot.query(request.query_params, request) if snapshot else None
+    return request._snapshot_rows
+
+
+@versioned_validator
+def product_list_validator(view, request, *args, **kwargs):
+    """Newest modification and row count of the filtered product set"""
+    rows = snapshot_rows(request)
+    if rows is not None:
+        return ('products', len(rows), rows.last_modified()), None
+    stats = view.filter_queryset(view.get_queryset()).aggregate(
+        updated=Max('updated_at'), category_updated=Max('category__updated_at'), count=Count('id')
+    )
+    return ('products', stats['count'], stats['updated'], stats['category_updated']), None
+
+
+@versioned_validator
+def product_detail_validator(view, request, *args, **kwargs):
+    row = view.get_queryset().filter(pk=kwargs.get('pk')).values_list('updated_at', 'category__updated_at').first()
+    if row is None:
+        return None, None
+    updated, category_updated = row
+    return ('product', kwargs.get('pk'), updated, category_updated), max(updated, category_updated or updated)
+
+
+@versioned_validator
+def category_products_validator(view, request, *args, **kwargs):
+    stats = Product.objects.filter(category_id=kwargs.get('pk'), is_active=True).aggregate(
+        updated=Max('updated_at'), category_updated=Max('category__updated_at'), count=Count('id')
+    )
+    return ('category-products', kwargs.get('pk'), stats['count'], stats['updated'], stats['category_updated']), None
+
 
 class CategoryViewSet(viewsets.ModelViewSet):
     """
@@ -12,21 +82,62 @@ class CategoryViewSet(viewsets.ModelViewSet):
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
-    filter_backends = [filters.SearchFilter]
+    filter_backends = [FullTextSearchFilter]
     search_fields = ['name', 'description']
+    cursor_ordering = ('name', 'id')
 
     def get_permissions(self):
         if self.action in ['create', 'update', 'partial_update', 'destroy']:
             return [permissions.IsAdminUser()]
         return [permissions.IsAuthenticatedOrReadOnly()]
 
+    @conditional_get(category_list_validator)
+    @cache_catalog_response
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @conditional_get(category_detail_validator)
+    @cache_catalog_response
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
+    @action(detail=False, methods=['get'])
+    @conditional_get(category_tree_validator)
+    @cache_catalog_response
+    def tree(self, request):
+        """
+        Get the active category tree, nested by parent, from a single query
+        """
+        rows = Category.objects.filter(is_active=True).order_by('depth', 'name').values(
+            'id', 'name', 'slug', 'parent_id', 'depth'
+        )
+        nodes = {}
+        roots = []
+        for row in rows:
+            node = {
+                'id': row['id'],
+                'name': row['name'],
+                'slug': row['slug'],
+                'depth': row['depth'],
+                'children': [],
+            }
+            nodes[row['id']] = node
+            if row['parent_id'] is None:
+                roots.append(node)
+            elif row['parent_id'] in nodes:
+                nodes[row['parent_id']]['children'].append(node)
+            # Children of inactive categories are hidden along with their parent
+        return Response(roots)
+
     @action(detail=True, methods=['get'])
+    @conditional_get(category_products_validator)
+    @cache_catalog_response
     def products(self, request, pk=None):
         """
         Get all products in a category
         """
         category = self.get_object()
-        products = Product.objects.filter(category=category, is_active=True)
+        products = Product.objects.filter(category=category, is_active=True).select_related('category')
         serializer = ProductListSerializer(
             products,
             many=True,
@@ -34,39 +145,90 @@ class CategoryViewSet(viewsets.ModelViewSet):
         )
         return Response(serializer.data)
 
-class ProductViewSet(viewsets.ModelViewSet):
+class ProductViewSet(EagerLoadingMixin, viewsets.ModelViewSet):
     """
     ViewSet for Product model
     """
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
-    filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
+    filter_backends = [DjangoFilterBackend, FullTextSearchFilter, ProductOrderingFilter]
     filterset_fields = ['category', 'is_active']
     search_fields = ['name', 'description']
-    ordering_fields = ['price', 'created_at', 'name']
+    search_vector_field = 'search_vector'
+    search_headline_field = 'description'
+    select_related_fields = ('category',)
+    ordering_fields = ['price', 'effective_price', 'created_at', 'name']
 
     def get_permissions(self):
         if self.action in ['create', 'update', 'partial_update', 'destroy']:
             return [permissions.IsAdminUser()]
         return [permissions.IsAuthenticatedOrReadOnly()]
 
+    @conditional_get(product_list_validator)
+    @cache_catalog_response
+    def list(self, request, *args, **kwargs):
+        rows = snapshot_rows(request)
+        if rows is not None:
+            page = self.paginate_queryset(rows)
+            if page is not None:
+                return self.get_paginated_response(page)
+            return Response(rows[:])
+        return super().list(request, *args, **kwargs)
+
+    @conditional_get(product_detail_validator)
+    @cache_catalog_response
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
+    @action(detail=False, methods=['get'])
+    @conditional_get(product_list_validator)
+    @cache_catalog_response
+    def facets(self, request):
+        """
+        Get category, price band, stock and discount counts for the products
+        matching the same filters as the list endpoint
+        """
+        queryset = self.filter_queryset(self.get_queryset())
+        return Response(compute_facets(queryset, price_field='effective_price'))
+
+    @action(detail=False, methods=['get'])
+    def suggest(self, request):
+        """
+        Typeahead suggestions: id, name and slug of the best matching active
+        products and categories for ?q=, limited by ?limit= (default 8)
+        """
+        try:
+            limit = int(request.query_params.get('limit', 8))
+        except ValueError:
+            limit = 8
+        return Response(suggest(request.query_params.get('q', ''), limit))
+
     def get_serializer_class(self):
         if self.action == 'list':
             return ProductListSerializer
         return ProductSerializer
 
     def get_queryset(self):
-        queryset = Product.objects.all()
+        # Default to newest first so pages are stable and served by product_created_idx
+        queryset = Product.objects.order_by('-created_at', '-id')
 
-        # Filter by price range
+        # Filter by price range, on what the customer actually pays
         min_price = self.request.query_params.get('min_price')
         max_price = self.request.query_params.get('max_price')
 
         if min_price:
-            queryset = queryset.filter(price__gte=min_price)
+            queryset = queryset.filter(effective_price__gte=min_price)
         if max_price:
-            queryset = queryset.filter(price__lte=max_price)
+            queryset = queryset.filter(effective_price__lte=max_price)
+
+        # Filter by a category and all of its subcategories
+        category_tree = self.request.query_params.get('category_tree')
+        if category_tree:
+            path = Category.objects.filter(pk=category_tree).values_list('path', flat=True).first() if category_tree.isdigit() else None
+            if path is None:
+                return queryset.none()
+            queryset = queryset.filter(category__path__startswith=path)
 
         return queryset
 
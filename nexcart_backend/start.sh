@@ -57,4 +57,4 @@ python manage.py collectstatic --noinput
 
 # Start the application
 echo "Starting Gunicorn server..."
-exec gunicorn --bind 0.0.0.0:8000 --workers 3 nexcart_backend.wsgi:application
+exec gunicorn --bind 0.0.0.0:8000 --workers 3 --preload nexcart_backend.wsgi:application
@@ -0,0 +1,18 @@
+# Generated by Django 5.0 on 2026-10-18 10:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0004_user_date_joined_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='cached_avatar_url',
+            field=models.CharField(blank=True, default='', editable=False, max_length=500),
+        ),
+    ]
@@ -1,6 +1,7 @@
 from django.db import models
 from django.contrib.auth.models import AbstractUser
 from django.utils.translation import gettext_lazy as _
+from api.images import refresh_image_url
 
 class User(AbstractUser):
     """
@@ -9,13 +10,25 @@ class User(AbstractUser):
     email = models.EmailField(_('email address'), unique=True)
     phone_number = models.CharField(max_length=15, blank=True, null=True)
     avatar = models.ImageField(upload_to='avatars/', blank=True, null=True)
+    # Canonical avatar URL, recomputed whenever the user is saved
+    cached_avatar_url = models.CharField(max_length=500, blank=True, default='', editable=False)
 
     USERNAME_FIELD = 'username'
     REQUIRED_FIELDS = ['email']
 
+    class Meta(AbstractUser.Meta):
+        indexes = [
+            # Keyset pagination over (date_joined, id) for the admin user list
+            models.Index(fields=['-date_joined', '-id'], name='user_date_joined_id_idx'),
+        ]
+
     def __str__(self):
         return self.email
 
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        refresh_image_url(self, image_field='avatar', url_field='cached_avatar_url')
+
 class Address(models.Model):
     """
     Address model for storing user shipping addresses
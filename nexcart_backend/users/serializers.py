@@ -1,5 +1,6 @@
 from rest_framework import serializers
 from django.contrib.auth import get_user_model
+from api.images import ImageURLField
 from .models import Address
 
 User = get_user_model()
@@ -18,7 +19,7 @@ class UserSerializer(serializers.ModelSerializer):
     Serializer for the User model
     """
     addresses = AddressSerializer(many=True, read_only=True)
-    avatar_url = serializers.SerializerMethodField()
+    avatar_url = ImageURLField(image_field='avatar', url_field='cached_avatar_url')
 
     class Meta:
         model = User
@@ -26,14 +27,6 @@ class UserSerializer(serializers.ModelSerializer):
                   'phone_number', 'addresses', 'date_joined', 'avatar', 'avatar_url']
         read_only_fields = ['date_joined', 'avatar_url']
 
-    def get_avatar_url(self, obj):
-        if obj.avatar:
-            request = self.context.get('request')
-            if request:
-                return request.build_absolute_uri(obj.avatar.url)
-            return obj.avatar.url
-        return None
-
 class UserCreateSerializer(serializers.ModelSerializer):
     """
     Serializer for creating a new user
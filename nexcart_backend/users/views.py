@@ -2,17 +2,20 @@ from rest_framework import viewsets, permissions, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from django.contrib.auth import get_user_model
+from api.querysets import EagerLoadingMixin
 from .models import Address
 from .serializers import UserSerializer, UserCreateSerializer, AddressSerializer
 
 User = get_user_model()
 
-class UserViewSet(viewsets.ModelViewSet):
+class UserViewSet(EagerLoadingMixin, viewsets.ModelViewSet):
     """
     ViewSet for User model
     """
     queryset = User.objects.all()
     serializer_class = UserSerializer
+    prefetch_related_fields = ('addresses',)
+    cursor_ordering = ('-date_joined',)
 
     def get_permissions(self):
         if self.action == 'create':
@@ -118,6 +121,7 @@ class AddressViewSet(viewsets.ModelViewSet):
     """
     serializer_class = AddressSerializer
     permission_classes = [permissions.IsAuthenticated]
+    cursor_ordering = ('id',)
 
     def get_queryset(self):
         return Address.objects.filter(user=self.request.user)
@@ -1,6 +1,7 @@
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
 from rest_framework_simplejwt.views import TokenObtainPairView
 from django.contrib.auth import get_user_model
+from orders.cart_store import CartLocked, merge_anonymous_cart
 
 User = get_user_model()
 
@@ -16,6 +17,14 @@ class CustomTokenObtainPairSerializer(TokenObtainPairSerializer):
         data['email'] = self.user.email
         data['username'] = self.user.username
 
+        # Carry the visitor's anonymous cart over to the account
+        request = self.context.get('request')
+        token = request.headers.get('X-Cart-Token') if request is not None else None
+        try:
+            merge_anonymous_cart(token or self.initial_data.get('cart_token'), self.user)
+        except CartLocked:
+            pass  # the cart is kept; the next cart request with the token merges it
+
         return data
 
 class CustomTokenObtainPairView(TokenObtainPairView):
@@ -24,4 +24,4 @@ else:
 
 # Start the application with Gunicorn
 echo "Starting Gunicorn server..."
-exec gunicorn --bind 0.0.0.0:$PORT --workers 3 nexcart_backend.wsgi:application
+exec gunicorn --bind 0.0.0.0:$PORT --workers 3 --preload nexcart_backend.wsgi:application